@@ -0,0 +1,871 @@
+"""
+This module defines on-disk caches that are used by the BALTO GUI
+app to avoid downloading the same bytes from an OpenDAP server more
+than once.  Data responses are stored in files named by a hash of
+the request (file URL, variable name and hyperslab), the total size
+of the cache is capped, and the least recently used entries are
+removed first.  Dataset metadata (the DDS and DAS documents) is
+cached separately and revalidated with Last-Modified and ETag.
+A slab journal records which slabs of a download are complete, so
+that an interrupted download resumes with only the missing slabs.
+Measured latency, throughput and failures are kept for each server
+(host), and are used to choose slab sizes and concurrency.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+import numpy as np
+import balto_retry as br
+
+#------------------------------------------------------------------------
+#
+# get_default_cache_dir()
+#
+# class response_cache
+#     __init__()
+#     set_validator()
+#     get_key()
+#     get_path()
+#     get()
+#     put()
+#     get_total_bytes()
+#     evict()
+#     get_entries()
+#     info()
+#     clear()
+#
+# class metadata_cache
+#     __init__()
+#     write_log()
+#     get_path()
+#     load_entry()
+#     save_entry()
+#     fetch_entry()
+#     get_validator()
+#     open_url()
+#     open_like()
+#     remove()
+#     clear()
+#
+# class slab_journal
+#     __init__()
+#     get_slab_key()
+#     load()
+#     save()
+#     get()
+#     put()
+#     get_n_done()
+#     get_slab_size()
+#     set_slab_size()
+#     add_split()
+#     is_split()
+#     finish()
+#
+# get_url_host()
+#
+# class host_profiles
+#     __init__()
+#     load()
+#     save()
+#     get()
+#     record_success()
+#     record_failure()
+#     get_slab_settings()
+#
+# build_dataset()
+# benchmark_open_dataset()
+#
+#------------------------------------------------------------------------
+def get_default_cache_dir( subdir='data' ):
+
+    return os.path.join( os.path.expanduser('~'), '.balto_cache', subdir )
+
+#   get_default_cache_dir()
+#------------------------------------------------------------------------
+class response_cache:
+    #--------------------------------------------------------------------
+    def __init__(self, cache_dir=None, max_bytes=2000000000):
+
+        if (cache_dir is None):
+            cache_dir = get_default_cache_dir()
+        self.cache_dir  = cache_dir
+        self.max_bytes  = max_bytes
+        self.lock       = threading.Lock()
+        self.n_hits     = 0
+        self.n_misses   = 0
+        self.n_bytes    = None   # (total size, see get_total_bytes)
+        self.validators = dict()
+        os.makedirs( cache_dir, exist_ok=True )
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def set_validator(self, url, validator):
+
+        #----------------------------------------------------
+        # Note: A validator (e.g. the ETag of the file, see
+        #       metadata_cache.get_validator()) is part of the
+        #       key of each entry for url.  When a file is
+        #       changed on the server, e.g. a near-real-time
+        #       aggregation, its validator changes and the
+        #       old entries are no longer used.
+        #----------------------------------------------------
+        with self.lock:
+            if (validator is None):
+                self.validators.pop( url, None )
+            else:
+                self.validators[ url ] = str( validator )
+
+    #   set_validator()
+    #--------------------------------------------------------------------
+    def get_key(self, url, var_name, index):
+
+        #----------------------------------------------------
+        # Note: index is a tuple of slices.  Normalize each
+        #       one to (start, stop, step) so that the key
+        #       does not depend on how it was written.
+        #----------------------------------------------------
+        parts = [ str(url), str(var_name) ]
+        with self.lock:
+            validator = self.validators.get( url )
+        if (validator is not None):
+            parts.append( validator )
+        for s in index:
+            parts.append( '%s:%s:%s' % (s.start, s.stop, s.step) )
+        key_str = '|'.join( parts )
+        return hashlib.sha256( key_str.encode('utf-8') ).hexdigest()
+
+    #   get_key()
+    #--------------------------------------------------------------------
+    def get_path(self, key):
+
+        return os.path.join( self.cache_dir, key + '.npz' )
+
+    #   get_path()
+    #--------------------------------------------------------------------
+    def get(self, url, var_name, index):
+
+        #----------------------------------------------
+        # Return (var, maps) like fetch_slab(), or
+        # None if this request is not in the cache.
+        #----------------------------------------------
+        path = self.get_path( self.get_key( url, var_name, index ) )
+        try:
+            with np.load( path, allow_pickle=False ) as npz:
+                n_maps = len(npz.files) - 1
+                var  = npz['var']
+                maps = [npz['map' + str(k)] for k in range(n_maps)]
+        except (OSError, KeyError, ValueError):
+            with self.lock:
+                self.n_misses += 1
+            return None
+
+        #-----------------------------------------------
+        # Update the modification time, which is used
+        # to find the least recently used entries.
+        #-----------------------------------------------
+        try:
+            os.utime( path, None )
+        except OSError:
+            pass
+        with self.lock:
+            self.n_hits += 1
+        return (var, maps)
+
+    #   get()
+    #--------------------------------------------------------------------
+    def put(self, url, var_name, index, var, maps):
+
+        #-------------------------------------------------
+        # Returns the path of the new entry, or None if
+        # it could not be written.
+        #-------------------------------------------------
+        path = self.get_path( self.get_key( url, var_name, index ) )
+        arrays = {'var': var}
+        for k in range(len(maps)):
+            arrays['map' + str(k)] = maps[k]
+
+        #-------------------------------------------------
+        # Write to a temporary file first, then rename,
+        # so a reader never sees a partially written
+        # entry, even with several threads writing.
+        #-------------------------------------------------
+        (fd, tmp_path) = tempfile.mkstemp( dir=self.cache_dir,
+                                           suffix='.tmp' )
+        try:
+            with os.fdopen( fd, 'wb' ) as f:
+                np.savez( f, **arrays )
+            size = os.path.getsize( tmp_path )
+            self.get_total_bytes()   # (count the entries once)
+            with self.lock:
+                try:
+                    old_size = os.path.getsize( path )
+                except OSError:
+                    old_size = 0
+                os.replace( tmp_path, path )
+                if (self.n_bytes is not None):
+                    self.n_bytes += (size - old_size)
+                FULL = (self.n_bytes is not None) and \
+                       (self.n_bytes > self.max_bytes)
+        except OSError:
+            if (os.path.exists( tmp_path )):
+                os.remove( tmp_path )
+            return None
+        if (FULL):
+            self.evict()
+        return path
+
+    #   put()
+    #--------------------------------------------------------------------
+    def get_total_bytes(self):
+
+        #------------------------------------------------
+        # The total size of the entries is counted once,
+        # then kept up to date by put() and evict(), so
+        # the directory is not listed on every put().
+        #------------------------------------------------
+        with self.lock:
+            if (self.n_bytes is None):
+                entries = self.get_entries()
+                self.n_bytes = sum( [e['size'] for e in entries] )
+            return self.n_bytes
+
+    #   get_total_bytes()
+    #--------------------------------------------------------------------
+    def evict(self):
+
+        #------------------------------------------------
+        # Remove least recently used entries until the
+        # total size of the cache is below max_bytes.
+        # This lists the directory, so it is only called
+        # when the running total is over max_bytes, and
+        # it also corrects that total (e.g. for entries
+        # written by another process).
+        #------------------------------------------------
+        with self.lock:
+            entries = self.get_entries()
+            total   = sum( [e['size'] for e in entries] )
+            entries.sort( key=lambda e: e['last_used'] )
+            for entry in entries:
+                if (total <= self.max_bytes):
+                    break
+                try:
+                    os.remove( entry['path'] )
+                    total -= entry['size']
+                except OSError:
+                    pass
+            self.n_bytes = total
+
+    #   evict()
+    #--------------------------------------------------------------------
+    def get_entries(self):
+
+        entries = list()
+        for e in os.scandir( self.cache_dir ):
+            if not(e.name.endswith('.npz')):
+                continue
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            entries.append( {'path': e.path, 'size': st.st_size,
+                             'last_used': st.st_mtime} )
+        return entries
+
+    #   get_entries()
+    #--------------------------------------------------------------------
+    def info(self):
+
+        entries = self.get_entries()
+        total   = sum( [e['size'] for e in entries] )
+        with self.lock:
+            (n_hits, n_misses) = (self.n_hits, self.n_misses)
+        info = {'cache_dir': self.cache_dir,
+                'n_entries': len(entries),
+                'n_bytes':   total,
+                'max_bytes': self.max_bytes,
+                'n_hits':    n_hits,
+                'n_misses':  n_misses }
+        if (len(entries) > 0):
+            oldest = min( [e['last_used'] for e in entries] )
+            info['oldest_entry'] = time.ctime( oldest )
+        return info
+
+    #   info()
+    #--------------------------------------------------------------------
+    def clear(self):
+
+        with self.lock:
+            for entry in self.get_entries():
+                try:
+                    os.remove( entry['path'] )
+                except OSError:
+                    pass
+            self.n_hits   = 0
+            self.n_misses = 0
+            self.n_bytes  = None
+
+    #   clear()
+    #--------------------------------------------------------------------
+class metadata_cache:
+    #--------------------------------------------------------------------
+    def __init__(self, cache_dir=None, max_age=86400, log=None):
+
+        #-------------------------------------------------------
+        # Note: Entries younger than max_age seconds are used
+        #       without asking the server.  Older entries are
+        #       revalidated with a conditional request, which
+        #       costs one small round-trip (HTTP 304) if the
+        #       file has not changed.  If the server can't be
+        #       reached, the old entry is used, with a warning
+        #       that is sent to log(msg, level), if given.
+        #-------------------------------------------------------
+        if (cache_dir is None):
+            cache_dir = get_default_cache_dir( 'metadata' )
+        self.cache_dir = cache_dir
+        self.max_age   = max_age
+        self.log       = log
+        os.makedirs( cache_dir, exist_ok=True )
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def write_log(self, msg, level='info'):
+
+        if (self.log is not None):
+            self.log( msg, level )
+
+    #   write_log()
+    #--------------------------------------------------------------------
+    def get_path(self, url):
+
+        key = hashlib.sha256( url.encode('utf-8') ).hexdigest()
+        return os.path.join( self.cache_dir, key + '.json' )
+
+    #   get_path()
+    #--------------------------------------------------------------------
+    def load_entry(self, url):
+
+        try:
+            with open( self.get_path( url ), 'r' ) as f:
+                entry = json.load( f )
+        except (OSError, ValueError):
+            return None
+        if (entry.get('url') != url):
+            return None
+        return entry
+
+    #   load_entry()
+    #--------------------------------------------------------------------
+    def save_entry(self, entry):
+
+        path = self.get_path( entry['url'] )
+        (fd, tmp_path) = tempfile.mkstemp( dir=self.cache_dir,
+                                           suffix='.tmp' )
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( entry, f )
+        os.replace( tmp_path, path )
+
+    #   save_entry()
+    #--------------------------------------------------------------------
+    def fetch_entry(self, url, entry=None, timeout=60):
+
+        #---------------------------------------------------
+        # Get the DDS and DAS for url from the server.  If
+        # an old entry is given, ask for the DDS only if it
+        # has changed (If-None-Match, If-Modified-Since).
+        # If that fails (e.g. offline, or a server error),
+        # the old entry is returned, to be checked again
+        # next time.
+        #---------------------------------------------------
+        headers = dict()
+        if (entry is not None):
+            if (entry.get('etag')):
+                headers['If-None-Match'] = entry['etag']
+            if (entry.get('last_modified')):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            r = br.http_get( url + '.dds', headers=headers,
+                             timeout=timeout )
+            if (r.status_code == 304) and (entry is not None):
+                entry['checked'] = time.time()
+                return entry
+            dds = r.text
+            r2  = br.http_get( url + '.das', timeout=timeout )
+            das = r2.text
+        except Exception as err:
+            if (entry is None):
+                raise
+            msg1 = 'Could not check the cached metadata of:'
+            msg2 = '   ' + url
+            msg3 = '   (' + repr(err) + '), so it was used as is.'
+            self.write_log( [msg1, msg2, msg3], level='warning' )
+            return entry
+
+        entry = {'url': url, 'dds': dds, 'das': das,
+                 'etag': r.headers.get('ETag'),
+                 'last_modified': r.headers.get('Last-Modified'),
+                 'checked': time.time() }
+        return entry
+
+    #   fetch_entry()
+    #--------------------------------------------------------------------
+    def get_validator(self, url):
+
+        #------------------------------------------------------
+        # Return a string that changes when the file at url
+        # changes: its ETag or Last-Modified, or else a hash
+        # of its DDS and DAS.  None if url is not cached.
+        # (See response_cache.set_validator().)
+        #------------------------------------------------------
+        entry = self.load_entry( url )
+        if (entry is None):
+            return None
+        if (entry.get('etag')):
+            return entry['etag']
+        if (entry.get('last_modified')):
+            return entry['last_modified']
+        text = entry['dds'] + entry['das']
+        return hashlib.sha256( text.encode('utf-8') ).hexdigest()[:16]
+
+    #   get_validator()
+    #--------------------------------------------------------------------
+    def open_url(self, url, timeout=60):
+
+        #------------------------------------------------------
+        # Return a pydap dataset like pydap.client.open_url(),
+        # but build it from cached DDS and DAS when possible.
+        #------------------------------------------------------
+        entry = self.load_entry( url )
+        if (entry is None) or \
+           ((time.time() - entry['checked']) > self.max_age):
+            entry = self.fetch_entry( url, entry=entry, timeout=timeout )
+            self.save_entry( entry )
+        return build_dataset( url, entry['dds'], entry['das'],
+                              timeout=timeout )
+
+    #   open_url()
+    #--------------------------------------------------------------------
+    def open_like(self, url, template_url, timeout=60):
+
+        #------------------------------------------------------
+        # Return a pydap dataset for url, built from the DDS
+        # and DAS of template_url.  This is for a set of files
+        # with the same structure, such as one file per time
+        # step, and saves two requests for each file.
+        #------------------------------------------------------
+        entry = self.load_entry( template_url )
+        if (entry is None):
+            self.open_url( template_url, timeout=timeout )
+            entry = self.load_entry( template_url )
+        return build_dataset( url, entry['dds'], entry['das'],
+                              timeout=timeout )
+
+    #   open_like()
+    #--------------------------------------------------------------------
+    def remove(self, url):
+
+        path = self.get_path( url )
+        if (os.path.exists( path )):
+            os.remove( path )
+
+    #   remove()
+    #--------------------------------------------------------------------
+    def clear(self):
+
+        for e in os.scandir( self.cache_dir ):
+            if (e.name.endswith('.json')):
+                os.remove( e.path )
+
+    #   clear()
+#------------------------------------------------------------------------
+class slab_journal:
+    #--------------------------------------------------------------------
+    def __init__(self, url, var_name, indices, journal_dir=None):
+
+        #-----------------------------------------------------------
+        # Note: A journal is for one planned download: a file
+        #       URL, a variable and a list of index tuples (the
+        #       pieces of a hyperslab).  It has its own directory
+        #       with one .npz file for each slab that has been
+        #       downloaded, and "journal.json", which maps each
+        #       slab's index to its file.  Unlike response_cache,
+        #       entries are never evicted; the directory is
+        #       removed by finish() once the download is done.
+        #       A slab that is also in a response_cache is not
+        #       saved twice: the journal just records the path
+        #       of the cache entry (see put()).  If that entry
+        #       is evicted, the slab is downloaded again.
+        #-----------------------------------------------------------
+        # The slab plan is saved too, so that a resumed download
+        # asks for the same slabs even if the host profile has
+        # changed the slab size since: the number of time steps
+        # per slab, and the slabs that were split in two after
+        # the server said they were too large (or timed out).
+        #-----------------------------------------------------------
+        if (journal_dir is None):
+            journal_dir = get_default_cache_dir( 'journal' )
+        parts = [ str(url), str(var_name) ]
+        for index in indices:
+            parts.append( str( [(s.start, s.stop, s.step) for s in index] ) )
+        key = hashlib.sha256( '|'.join(parts).encode('utf-8') ).hexdigest()
+        self.dir  = os.path.join( journal_dir, key )
+        self.path = os.path.join( self.dir, 'journal.json' )
+        self.lock = threading.Lock()
+        os.makedirs( self.dir, exist_ok=True )
+        self.entry = self.load()
+        if (self.entry is None):
+            self.entry = {'url': url, 'var_name': var_name, 'done': dict(),
+                          'slab_size': None, 'split': list()}
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def get_slab_key(self, index):
+
+        return ','.join( ['%s:%s:%s' % (s.start, s.stop, s.step)
+                          for s in index] )
+
+    #   get_slab_key()
+    #--------------------------------------------------------------------
+    def load(self):
+
+        try:
+            with open( self.path, 'r' ) as f:
+                return json.load( f )
+        except (OSError, ValueError):
+            return None
+
+    #   load()
+    #--------------------------------------------------------------------
+    def save(self):
+
+        (fd, tmp_path) = tempfile.mkstemp( dir=self.dir, suffix='.tmp' )
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( self.entry, f )
+        os.replace( tmp_path, self.path )
+
+    #   save()
+    #--------------------------------------------------------------------
+    def get(self, index):
+
+        #--------------------------------------------
+        # Return (var, maps) for a completed slab,
+        # or None if it still has to be downloaded.
+        #--------------------------------------------
+        filename = self.entry['done'].get( self.get_slab_key( index ) )
+        if (filename is None):
+            return None
+        try:
+            with np.load( os.path.join(self.dir, filename),
+                          allow_pickle=False ) as npz:
+                n_maps = len(npz.files) - 1
+                var  = npz['var']
+                maps = [npz['map' + str(k)] for k in range(n_maps)]
+        except (OSError, KeyError, ValueError):
+            return None
+        return (var, maps)
+
+    #   get()
+    #--------------------------------------------------------------------
+    def put(self, index, var, maps, path=None):
+
+        #-----------------------------------------------------
+        # Save a slab, then record it in the journal.  The
+        # slab file is complete before it is recorded, so an
+        # interrupted put() just leaves an unused file.
+        # If path is the file of a response_cache entry for
+        # the same slab, only the path is recorded.
+        #-----------------------------------------------------
+        slab_key = self.get_slab_key( index )
+        if (path is not None):
+            with self.lock:
+                self.entry['done'][ slab_key ] = os.path.abspath( path )
+                self.save()
+            return
+        arrays = {'var': var}
+        for k in range(len(maps)):
+            arrays['map' + str(k)] = maps[k]
+        (fd, tmp_path) = tempfile.mkstemp( dir=self.dir, suffix='.tmp' )
+        with os.fdopen( fd, 'wb' ) as f:
+            np.savez( f, **arrays )
+        filename = hashlib.sha256( slab_key.encode('utf-8') ).hexdigest()
+        filename = filename + '.npz'
+        os.replace( tmp_path, os.path.join(self.dir, filename) )
+        with self.lock:
+            self.entry['done'][ slab_key ] = filename
+            self.save()
+
+    #   put()
+    #--------------------------------------------------------------------
+    def get_n_done(self):
+
+        return len( self.entry['done'] )
+
+    #   get_n_done()
+    #--------------------------------------------------------------------
+    def get_slab_size(self):
+
+        return self.entry.get( 'slab_size' )
+
+    #   get_slab_size()
+    #--------------------------------------------------------------------
+    def set_slab_size(self, slab_size):
+
+        with self.lock:
+            self.entry['slab_size'] = slab_size
+            self.save()
+
+    #   set_slab_size()
+    #--------------------------------------------------------------------
+    def add_split(self, index):
+
+        slab_key = self.get_slab_key( index )
+        with self.lock:
+            split = self.entry.setdefault( 'split', list() )
+            if (slab_key not in split):
+                split.append( slab_key )
+                self.save()
+
+    #   add_split()
+    #--------------------------------------------------------------------
+    def is_split(self, index):
+
+        return (self.get_slab_key( index ) in self.entry.get( 'split', [] ))
+
+    #   is_split()
+    #--------------------------------------------------------------------
+    def finish(self):
+
+        #---------------------------------------------
+        # The download is complete, so remove the
+        # journal and all of its slab files.
+        #---------------------------------------------
+        shutil.rmtree( self.dir, ignore_errors=True )
+
+    #   finish()
+#------------------------------------------------------------------------
+def get_url_host( url ):
+
+    return urllib.parse.urlparse( url ).netloc.lower()
+
+#   get_url_host()
+#------------------------------------------------------------------------
+class host_profiles:
+    #--------------------------------------------------------------------
+    def __init__(self, path=None, slab_bytes=16000000, n_workers=4,
+                 min_slab_bytes=1000000, max_slab_bytes=256000000,
+                 max_workers=8, fast_secs=5.0, slow_secs=30.0):
+
+        #-----------------------------------------------------------
+        # Note: One profile is kept for each host, in a JSON
+        #       file.  Each one holds the slab size and number
+        #       of workers to use next time, plus running
+        #       averages of latency and throughput, and counts
+        #       of requests and failures.
+        #-----------------------------------------------------------
+        # Slabs that finish in less than fast_secs let the slab
+        # size grow by 50% and add a worker, and those that take
+        # more than slow_secs make it shrink by 25% and remove a
+        # worker.  A request that the server rejects as too
+        # large, or that times out, halves it, and also removes
+        # one worker.  Other failures are only counted.
+        #-----------------------------------------------------------
+        if (path is None):
+            path = os.path.join( get_default_cache_dir(''), 'hosts.json' )
+        self.path           = path
+        self.slab_bytes     = slab_bytes
+        self.n_workers      = n_workers
+        self.min_slab_bytes = min_slab_bytes
+        self.max_slab_bytes = max_slab_bytes
+        self.max_workers    = max_workers
+        self.fast_secs      = fast_secs
+        self.slow_secs      = slow_secs
+        self.lock           = threading.Lock()
+        self.last_save      = 0.0
+        self.profiles       = self.load()
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def load(self):
+
+        try:
+            with open( self.path, 'r' ) as f:
+                return json.load( f )
+        except (OSError, ValueError):
+            return dict()
+
+    #   load()
+    #--------------------------------------------------------------------
+    def save(self):
+
+        with self.lock:
+            cache_dir = os.path.dirname( self.path )
+            os.makedirs( cache_dir, exist_ok=True )
+            (fd, tmp_path) = tempfile.mkstemp( dir=cache_dir,
+                                               suffix='.tmp' )
+            with os.fdopen( fd, 'w' ) as f:
+                json.dump( self.profiles, f, indent=2 )
+            os.replace( tmp_path, self.path )
+            self.last_save = time.time()
+
+    #   save()
+    #--------------------------------------------------------------------
+    def get(self, host):
+
+        if (host not in self.profiles):
+            self.profiles[ host ] = {'slab_bytes': self.slab_bytes,
+                                     'n_workers':  self.n_workers,
+                                     'latency_secs': None,
+                                     'bytes_per_sec': None,
+                                     'n_requests': 0,
+                                     'n_failures': 0 }
+        return self.profiles[ host ]
+
+    #   get()
+    #--------------------------------------------------------------------
+    def record_success(self, url, n_bytes, secs):
+
+        with self.lock:
+            profile = self.get( get_url_host( url ) )
+            profile['n_requests'] += 1
+            #--------------------------------------------
+            # Running (exponential) averages, where
+            # latency is taken as the time for requests
+            # with very few bytes.
+            #--------------------------------------------
+            rate = n_bytes / max(secs, 1e-6)
+            if (profile['bytes_per_sec'] is None):
+                profile['bytes_per_sec'] = rate
+            else:
+                profile['bytes_per_sec'] = (0.8 * profile['bytes_per_sec']) + (0.2 * rate)
+            if (n_bytes < 100000):
+                if (profile['latency_secs'] is None):
+                    profile['latency_secs'] = secs
+                else:
+                    profile['latency_secs'] = (0.8 * profile['latency_secs']) + (0.2 * secs)
+
+            #---------------------------------------
+            # Grow or shrink the slab size, and add
+            # or remove a worker, when things are
+            # fast or slow
+            #---------------------------------------
+            slab_bytes = profile['slab_bytes']
+            if (secs < self.fast_secs) and (n_bytes >= 0.5 * slab_bytes):
+                slab_bytes = min( int(1.5 * slab_bytes), self.max_slab_bytes )
+                profile['n_workers'] = min( profile['n_workers'] + 1,
+                                            self.max_workers )
+            elif (secs > self.slow_secs):
+                slab_bytes = max( int(0.75 * slab_bytes), self.min_slab_bytes )
+                profile['n_workers'] = max( profile['n_workers'] - 1, 1 )
+            profile['slab_bytes'] = slab_bytes
+            SAVE = (time.time() - self.last_save) > 5.0
+        if (SAVE):
+            self.save()
+
+    #   record_success()
+    #--------------------------------------------------------------------
+    def record_failure(self, url, SIZE=False, TIMEOUT=False):
+
+        #-------------------------------------------------
+        # SIZE is True if the request failed because it
+        # was too large (see br.is_size_error()), and
+        # TIMEOUT if it timed out (br.is_timeout_error()).
+        #-------------------------------------------------
+        with self.lock:
+            profile = self.get( get_url_host( url ) )
+            profile['n_requests'] += 1
+            profile['n_failures'] += 1
+            if (SIZE or TIMEOUT):
+                profile['slab_bytes'] = max( profile['slab_bytes'] // 2,
+                                             self.min_slab_bytes )
+                profile['n_workers']  = max( profile['n_workers'] - 1, 1 )
+        self.save()
+
+    #   record_failure()
+    #--------------------------------------------------------------------
+    def get_slab_settings(self, url):
+
+        #----------------------------------------------
+        # Return (slab_bytes, n_workers) for the host
+        # of url, to use for the next download.
+        #----------------------------------------------
+        with self.lock:
+            profile = self.get( get_url_host( url ) )
+            return (profile['slab_bytes'], profile['n_workers'])
+
+    #   get_slab_settings()
+#------------------------------------------------------------------------
+def build_dataset( url, dds, das, timeout=60 ):
+
+    #--------------------------------------------------------
+    # Note: This does what pydap.handlers.dap.DAPHandler
+    #       does after it has downloaded the DDS and DAS:
+    #       build the dataset, add the attributes, and
+    #       attach data proxies that will fetch the values
+    #       from the server only when they are indexed.
+    #--------------------------------------------------------
+    import copy
+    from pydap.parsers.dds import build_dataset as build_from_dds
+    from pydap.parsers.das import parse_das, add_attributes
+    from pydap.model import BaseType, SequenceType, GridType
+    from pydap.lib import walk
+    from pydap.handlers.dap import BaseProxy, SequenceProxy
+
+    dataset = build_from_dds( dds )
+    add_attributes( dataset, parse_das( das ) )
+
+    for var in walk( dataset, BaseType ):
+        var.data = BaseProxy( url, var.id, var.dtype, var.shape,
+                              timeout=timeout )
+    for var in walk( dataset, SequenceType ):
+        template = copy.copy( var )
+        var.data = SequenceProxy( url, template, timeout=timeout )
+    for var in walk( dataset, GridType ):
+        if hasattr( var, 'set_output_grid' ):
+            var.set_output_grid( True )
+    return dataset
+
+#   build_dataset()
+#------------------------------------------------------------------------
+def benchmark_open_dataset( url, cache=None, timeout=60, n_warm=5 ):
+
+    #-------------------------------------------------------
+    # Compare the time to open a dataset with an empty
+    # (cold) cache and with a filled (warm) cache.  Also
+    # time pydap.client.open_url() for reference.
+    #-------------------------------------------------------
+    import pydap.client
+
+    if (cache is None):
+        cache = metadata_cache()
+
+    start = time.time()
+    pydap.client.open_url( url, timeout=timeout )
+    t_pydap = (time.time() - start)
+
+    cache.remove( url )
+    start = time.time()
+    cache.open_url( url, timeout=timeout )
+    t_cold = (time.time() - start)
+
+    start = time.time()
+    for k in range(n_warm):
+        cache.open_url( url, timeout=timeout )
+    t_warm = (time.time() - start) / n_warm
+
+    return {'url': url, 'pydap_secs': t_pydap,
+            'cold_secs': t_cold, 'warm_secs': t_warm }
+
+#   benchmark_open_dataset()
+#------------------------------------------------------------------------
@@ -0,0 +1,947 @@
+"""
+This module defines the download engine that is used by the BALTO
+GUI app to fetch subsets (hyperslabs) of variables from OpenDAP
+servers.  A large hyperslab is split along its first (time) axis
+into smaller "slabs" that are fetched concurrently with a bounded
+pool of threads and then either assembled into a preallocated
+array or yielded one at a time.  A hyperslab that is given as
+several pieces, such as a longitude box that crosses the seam of
+the grid, is fetched piece by piece and stitched back together.
+The same subset can also be fetched from many files, such as one
+file per time step, and joined along time.  A download_monitor
+tracks the progress, speed and ETA of a download, and can cancel it.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import numpy as np
+import balto_retry as br
+
+#------------------------------------------------------------------------
+#
+# class download_cancelled
+#
+# class download_monitor
+#     __init__()
+#     start()
+#     add()
+#     cancel()
+#     is_cancelled()
+#     fail()
+#     is_failed()
+#     check()
+#     get_rate()
+#     get_eta()
+#     get_fraction()
+#     get_status()
+#
+# get_slice_size()
+# get_hyperslab_shape()
+# get_request_bytes()
+# get_slab_size()
+# get_plan_slab_size()
+# get_time_slabs()
+# get_grid_data()
+# get_grid_slab()
+# fetch_slab()
+# split_slab_index()
+# fetch_slab_adaptive()
+# fetch_variables()
+# get_dap_constraint()
+# get_member_data()
+# fetch_hyperslabs()
+# plan_slabs()
+# cancel_futures()
+# download_slabs()
+# download_hyperslabs()
+# iter_slabs()
+# stitch_pieces()
+# download_pieces()
+# get_pieces_shape()
+# iter_pieces()
+# fetch_file()
+# download_files()
+#
+#------------------------------------------------------------------------
+class download_cancelled( Exception ):
+    pass
+
+#------------------------------------------------------------------------
+class download_monitor:
+    #--------------------------------------------------------------------
+    def __init__(self, total_bytes=0, callback=None, min_interval=0.5):
+
+        #-----------------------------------------------------------
+        # Note: The slabs of a download add their bytes to the
+        #       monitor as they arrive, from several threads.
+        #       callback(monitor) is called at most once every
+        #       min_interval seconds, and when the download is
+        #       done, e.g. to update a progress bar.  Calling
+        #       cancel() makes every slab that has not started
+        #       raise download_cancelled.  (Requests already
+        #       sent can't be stopped, and their data is
+        #       dropped.)  When one slab fails, fail() stops the
+        #       other slabs in the same way, so that the error
+        #       is reported without waiting for all of them.
+        #-----------------------------------------------------------
+        # The network calls of the download are counted in
+        # counters (see balto_retry.py), and a call that is
+        # waiting to retry stops when the download is
+        # cancelled or has failed (stop_event).
+        #-----------------------------------------------------------
+        self.callback     = callback
+        self.min_interval = min_interval
+        self.lock         = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.failed_event = threading.Event()
+        self.stop_event   = threading.Event()
+        self.counters     = br.retry_counters( self.stop_event )
+        self.start( total_bytes )
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def start(self, total_bytes):
+
+        with self.lock:
+            self.total_bytes = total_bytes
+            self.n_bytes     = 0
+            self.start_time  = time.time()
+            self.last_call   = 0.0
+
+    #   start()
+    #--------------------------------------------------------------------
+    def add(self, n_bytes):
+
+        with self.lock:
+            self.n_bytes += n_bytes
+            now  = time.time()
+            DONE = (self.n_bytes >= self.total_bytes)
+            CALL = DONE or ((now - self.last_call) >= self.min_interval)
+            if (CALL):
+                self.last_call = now
+        if (CALL) and (self.callback is not None):
+            self.callback( self )
+
+    #   add()
+    #--------------------------------------------------------------------
+    def cancel(self):
+
+        self.cancel_event.set()
+        self.stop_event.set()
+
+    #   cancel()
+    #--------------------------------------------------------------------
+    def is_cancelled(self):
+
+        return self.cancel_event.is_set()
+
+    #   is_cancelled()
+    #--------------------------------------------------------------------
+    def fail(self):
+
+        self.failed_event.set()
+        self.stop_event.set()
+
+    #   fail()
+    #--------------------------------------------------------------------
+    def is_failed(self):
+
+        return self.failed_event.is_set()
+
+    #   is_failed()
+    #--------------------------------------------------------------------
+    def check(self):
+
+        if (self.cancel_event.is_set()):
+            raise download_cancelled( 'Download cancelled.' )
+        if (self.failed_event.is_set()):
+            raise download_cancelled( 'Download stopped by an error.' )
+
+    #   check()
+    #--------------------------------------------------------------------
+    def get_rate(self):
+
+        #------------------------------
+        # Average speed, in bytes/sec
+        #------------------------------
+        secs = time.time() - self.start_time
+        return (self.n_bytes / secs) if (secs > 0) else 0.0
+
+    #   get_rate()
+    #--------------------------------------------------------------------
+    def get_eta(self):
+
+        #------------------------------------------------
+        # Seconds left at the average speed, or None
+        #------------------------------------------------
+        rate = self.get_rate()
+        if (rate <= 0):
+            return None
+        return max( 0.0, (self.total_bytes - self.n_bytes) / rate )
+
+    #   get_eta()
+    #--------------------------------------------------------------------
+    def get_fraction(self):
+
+        if (self.total_bytes <= 0):
+            return 0.0
+        return min( 1.0, self.n_bytes / self.total_bytes )
+
+    #   get_fraction()
+    #--------------------------------------------------------------------
+    def get_status(self):
+
+        #----------------------------------------------------
+        # e.g. "12.5 of 40.0 MB, 2.10 MB/s, ETA 0:00:13"
+        #----------------------------------------------------
+        eta = self.get_eta()
+        if (eta is None):
+            eta_str = '?'
+        else:
+            eta = int( round(eta) )
+            eta_str = '%d:%02d:%02d' % (eta // 3600, (eta // 60) % 60, eta % 60)
+        status  = '%.1f of %.1f MB, ' % (self.n_bytes / 1e6,
+                                         self.total_bytes / 1e6)
+        status += '%.2f MB/s, ETA %s' % (self.get_rate() / 1e6, eta_str)
+        return status
+
+    #   get_status()
+#------------------------------------------------------------------------
+def get_slice_size( s, n ):
+
+    #------------------------------------------------
+    # Number of elements selected by slice s from an
+    # axis with n elements.  Works for any step.
+    #------------------------------------------------
+    return len( range( *s.indices(n) ) )
+
+#   get_slice_size()
+#------------------------------------------------------------------------
+def get_hyperslab_shape( index, shape ):
+
+    #----------------------------------------------------
+    # index is a tuple of slices, one for each dimension
+    #----------------------------------------------------
+    return tuple( [get_slice_size(s, n) for (s, n) in zip(index, shape)] )
+
+#   get_hyperslab_shape()
+#------------------------------------------------------------------------
+def get_request_bytes( indices, shape, itemsize ):
+
+    #----------------------------------------------------
+    # Total bytes for a list of hyperslabs, e.g. the
+    # pieces from get_download_indices() in balto_gui.
+    #----------------------------------------------------
+    n_bytes = 0
+    for index in indices:
+        sub_shape = get_hyperslab_shape( index, shape )
+        n_bytes  += itemsize * int( np.prod( sub_shape ) )
+    return n_bytes
+
+#   get_request_bytes()
+#------------------------------------------------------------------------
+def get_slab_size( index, shape, itemsize, target_bytes ):
+
+    #-------------------------------------------------------
+    # Return the number of time steps per slab so that each
+    # slab request is about target_bytes in size.
+    #-------------------------------------------------------
+    sub_shape  = get_hyperslab_shape( index, shape )
+    step_bytes = itemsize * int( np.prod( sub_shape[1:] ) )
+    step_bytes = max( step_bytes, 1 )
+    return max( 1, int(target_bytes // step_bytes) )
+
+#   get_slab_size()
+#------------------------------------------------------------------------
+def get_plan_slab_size( pydap_grid, indices, target_bytes, journal=None ):
+
+    #-------------------------------------------------------
+    # Note: Return the number of time steps per slab for
+    #       all of the pieces in indices, so that a slab of
+    #       every piece together is about target_bytes.
+    #       If a slab_journal is given, the size that it
+    #       saved is used, so that a resumed download asks
+    #       for the same slabs as before, even if the host
+    #       profile has since changed target_bytes.
+    #-------------------------------------------------------
+    if (journal is not None):
+        slab_size = journal.get_slab_size()
+        if (slab_size is not None):
+            return slab_size
+    shape = pydap_grid.shape
+    step_bytes = 0
+    for index in indices:
+        sub_shape   = get_hyperslab_shape( index, shape )
+        step_bytes += int( np.prod( sub_shape[1:] ) )
+    step_bytes *= pydap_grid.dtype.itemsize
+    slab_size = max( 1, int(target_bytes // max(step_bytes, 1)) )
+    if (journal is not None):
+        journal.set_slab_size( slab_size )
+    return slab_size
+
+#   get_plan_slab_size()
+#------------------------------------------------------------------------
+def get_time_slabs( t_i1, t_i2, slab_size ):
+
+    #---------------------------------------------------
+    # Split the half-open index range [t_i1, t_i2) into
+    # consecutive half-open ranges of slab_size steps.
+    #---------------------------------------------------
+    slabs = list()
+    i1 = t_i1
+    while (i1 < t_i2):
+        i2 = min( i1 + slab_size, t_i2 )
+        slabs.append( (i1, i2) )
+        i1 = i2
+    return slabs
+
+#   get_time_slabs()
+#------------------------------------------------------------------------
+def get_grid_data( grid ):
+
+    #--------------------------------------------------
+    # Note: type(grid) = pydap.model.GridType, and
+    #       grid.data is a list: [var, map1, map2,...]
+    #       For pydap.model.BaseType, it is an array.
+    #--------------------------------------------------
+    data = grid.data
+    if (isinstance( data, list )):
+        var  = np.asarray( data[0] )
+        maps = [np.asarray( d ) for d in data[1:]]
+    else:
+        var  = np.asarray( data )
+        maps = []
+    return (var, maps)
+
+#   get_grid_data()
+#------------------------------------------------------------------------
+def get_grid_slab( pydap_grid, index ):
+
+    grid = pydap_grid[ index ]
+    return get_grid_data( grid )
+
+#   get_grid_slab()
+#------------------------------------------------------------------------
+def fetch_slab( pydap_grid, index, cache=None, url=None, journal=None,
+                profiles=None, monitor=None ):
+
+    #-----------------------------------------------
+    # Subscripting a pydap grid with a tuple of
+    # slices sends a DAP constraint to the server;
+    # accessing grid.data downloads the values.
+    #-----------------------------------------------
+    # If a slab_journal or a response_cache (see
+    # balto_cache.py) is given, check it first.
+    # The journal holds the slabs of an unfinished
+    # download; the cache is keyed on the file url,
+    # the variable and the slab's index.  A slab
+    # that was saved in the cache is only referred
+    # to by the journal, not saved again.
+    #-----------------------------------------------
+    # If a download_monitor is given, the slab's
+    # bytes are added to it, and a slab is not
+    # started if the download was cancelled.
+    #-----------------------------------------------
+    if (monitor is not None):
+        monitor.check()
+    shape = pydap_grid.shape
+    index = tuple( [slice(*s.indices(n)) for (s, n) in zip(index, shape)] )
+    result = None
+    if (journal is not None):
+        result = journal.get( index )
+    if (result is None) and (cache is not None):
+        result = cache.get( url, pydap_grid.id, index )
+    if (result is not None):
+        if (monitor is not None):
+            monitor.add( result[0].nbytes )
+        return result
+
+    #------------------------------------------------
+    # If host_profiles are given, record the time and
+    # size of each request, or the failure.
+    # Transient errors are retried by the shared
+    # retry policy (see balto_retry.py), and counted
+    # in the monitor's counters.
+    #------------------------------------------------
+    counters = (monitor.counters if (monitor is not None) else None)
+    start_time = time.time()
+    try:
+        result = br.default_policy.call( get_grid_slab, pydap_grid, index,
+                                         counters=counters )
+    except Exception as err:
+        if (monitor is not None):
+            monitor.check()   # (cancelled while waiting to retry)
+        if (profiles is not None) and (url is not None):
+            profiles.record_failure( url, SIZE=br.is_size_error( err ),
+                                     TIMEOUT=br.is_timeout_error( err ) )
+        raise
+    if (profiles is not None) and (url is not None):
+        profiles.record_success( url, result[0].nbytes,
+                                 time.time() - start_time )
+
+    path = None
+    if (cache is not None):
+        path = cache.put( url, pydap_grid.id, index, result[0], result[1] )
+    if (journal is not None):
+        journal.put( index, result[0], result[1], path=path )
+    if (monitor is not None):
+        monitor.add( result[0].nbytes )
+    return result
+
+#   fetch_slab()
+#------------------------------------------------------------------------
+def split_slab_index( index, shape ):
+
+    #------------------------------------------------
+    # Split a slab in two along its first axis.
+    # Returns None if it has only one step.
+    #------------------------------------------------
+    (start, stop, step) = index[0].indices( shape[0] )
+    n = len( range(start, stop, step) )
+    if (n < 2):
+        return None
+    half = n // 2
+    i2 = start + ((half - 1) * step) + 1
+    index1 = (slice(start, i2, step),) + tuple(index[1:])
+    index2 = (slice(start + (half * step), stop, step),) + tuple(index[1:])
+    return (index1, index2)
+
+#   split_slab_index()
+#------------------------------------------------------------------------
+def fetch_slab_adaptive( pydap_grid, index, cache=None, url=None,
+                         journal=None, profiles=None, monitor=None,
+                         max_depth=3 ):
+
+    #-------------------------------------------------------
+    # Note: Like fetch_slab(), but if host_profiles are
+    #       given and the server rejects the slab as too
+    #       large (see br.is_size_error()), or it still times
+    #       out after its retries, the slab is split in two
+    #       along the first axis, and each half is fetched
+    #       the same way, at most max_depth times.
+    #       The halves are then joined.
+    #       A slab_journal remembers the split, so a resumed
+    #       download goes straight to the halves it saved.
+    #-------------------------------------------------------
+    halves = None
+    if (journal is not None) and (journal.is_split( index )):
+        halves = split_slab_index( index, pydap_grid.shape )
+    if (halves is None):
+        try:
+            return fetch_slab( pydap_grid, index, cache, url, journal,
+                               profiles, monitor )
+        except Exception as err:
+            SHRINK = br.is_size_error( err ) or br.is_timeout_error( err )
+            if (profiles is None) or (max_depth <= 0) or not(SHRINK):
+                raise
+            halves = split_slab_index( index, pydap_grid.shape )
+            if (halves is None):
+                raise
+        if (journal is not None):
+            journal.add_split( index )
+    results = [ fetch_slab_adaptive( pydap_grid, half, cache, url,
+                                     journal, profiles, monitor,
+                                     max_depth - 1 )
+                for half in halves ]
+    return stitch_pieces( results, axis=0 )
+
+#   fetch_slab_adaptive()
+#------------------------------------------------------------------------
+def fetch_variables( url, names, timeout=60 ):
+
+    #-----------------------------------------------------
+    # Download several whole variables, such as the
+    # coordinate vectors lat, lon and time, in a single
+    # DAP request, e.g.  <url>.dods?lat,lon,time
+    # Returns a dictionary of numpy arrays, keyed by name.
+    #-----------------------------------------------------
+    import pydap.client
+
+    if (len(names) == 0):
+        return dict()
+    dods_url = url + '.dods?' + ','.join( names )
+    dataset  = br.default_policy.call( pydap.client.open_dods, dods_url,
+                                       timeout=timeout )
+    arrays = dict()
+    for name in names:
+        arrays[ name ] = np.asarray( dataset[ name ].data )
+    return arrays
+
+#   fetch_variables()
+#------------------------------------------------------------------------
+def get_dap_constraint( name, index, shape ):
+
+    #------------------------------------------------------
+    # Note: DAP hyperslabs are [start:stride:last], where
+    #       last is inclusive.  e.g. for a 3D variable:
+    #       sst[0:1:11][10:2:50][100:1:199]
+    #------------------------------------------------------
+    parts = list()
+    for (s, n) in zip(index, shape):
+        (start, stop, step) = s.indices( n )
+        n_sel = len( range(start, stop, step) )
+        last  = start + ((n_sel - 1) * step)
+        parts.append( '[%d:%d:%d]' % (start, step, last) )
+    return name + ''.join( parts )
+
+#   get_dap_constraint()
+#------------------------------------------------------------------------
+def get_member_data( dataset, name ):
+
+    #------------------------------------------------------
+    # The array part of a grid (e.g. "u.u") is returned
+    # inside a structure or a grid named "u".  Get it as
+    # a numpy array, whichever way it comes back.
+    #------------------------------------------------------
+    var = dataset[ name ]
+    if hasattr( var, 'keys' ) and (name in var.keys()):
+        var = var[ name ]
+    data = var.data
+    if isinstance( data, list ):
+        data = data[0]
+    return np.asarray( data )
+
+#   get_member_data()
+#------------------------------------------------------------------------
+def fetch_hyperslabs( url, var_names, index, shape, grid_names=None,
+                      timeout=60, counters=None ):
+
+    #------------------------------------------------------------
+    # Note: Download the same hyperslab of several variables,
+    #       which must have the same dimensions, in a single
+    #       DAP request, e.g.
+    #       <url>.dods?u.u[0:1:9][0:1:99],v.v[0:1:9][0:1:99]
+    #       For the variables in grid_names, only the array is
+    #       requested (e.g. "u.u"), not the coordinate maps,
+    #       which are the same for all of them.  Returns a
+    #       dictionary of numpy arrays, keyed by short name.
+    #       The request is counted in counters, if given (see
+    #       balto_retry.py).
+    #------------------------------------------------------------
+    import pydap.client
+
+    if (grid_names is None):
+        grid_names = list()
+    terms = list()
+    for name in var_names:
+        dap_name = name
+        if (name in grid_names):
+            dap_name = name + '.' + name
+        terms.append( get_dap_constraint( dap_name, index, shape ) )
+    dods_url = url + '.dods?' + ','.join( terms )
+    dataset  = br.default_policy.call( pydap.client.open_dods, dods_url,
+                                       timeout=timeout, counters=counters )
+    arrays = dict()
+    for name in var_names:
+        arrays[ name ] = get_member_data( dataset, name )
+    return arrays
+
+#   fetch_hyperslabs()
+#------------------------------------------------------------------------
+def plan_slabs( pydap_grid, index, slab_size=None,
+                target_bytes=16000000 ):
+
+    #-----------------------------------------------------------
+    # Note: index is a tuple of slices, one per dimension, for
+    #       the full hyperslab.  The first axis (usually time)
+    #       is split into slabs of slab_size steps.  Returns
+    #       (out_shape, slabs), where each slab is a tuple:
+    #       (k1, k2, slab_index) and [k1:k2] is the location
+    #       of the slab along the first axis of the output.
+    #-----------------------------------------------------------
+    shape = pydap_grid.shape
+    index = tuple( [slice(*s.indices(n)) for (s, n) in zip(index, shape)] )
+    out_shape = get_hyperslab_shape( index, shape )
+
+    #------------------------------------------
+    # Nothing to split for a 0-D or empty slab
+    #------------------------------------------
+    if (len(shape) == 0) or (0 in out_shape):
+        return (out_shape, [(0, 0, index)])
+
+    if (slab_size is None):
+        slab_size = get_slab_size( index, shape,
+                                   pydap_grid.dtype.itemsize,
+                                   target_bytes )
+
+    #-----------------------------------------------------
+    # Split along first axis, in units of output steps
+    # so that a slice step (stride) is handled correctly
+    #-----------------------------------------------------
+    (start, stop, step) = index[0].indices( shape[0] )
+    slabs = list()
+    for (k1, k2) in get_time_slabs( 0, out_shape[0], slab_size ):
+        i1 = start + (k1 * step)
+        i2 = start + ((k2 - 1) * step) + 1
+        slab_index = (slice(i1, i2, step),) + index[1:]
+        slabs.append( (k1, k2, slab_index) )
+    return (out_shape, slabs)
+
+#   plan_slabs()
+#------------------------------------------------------------------------
+def cancel_futures( futures, monitor ):
+
+    #-------------------------------------------------------
+    # Note: Called when one of the futures of a download
+    #       raised an exception.  Futures that have not
+    #       started are cancelled, and the monitor stops
+    #       the slabs that are running (or waiting inside
+    #       another executor) before their next request.
+    #-------------------------------------------------------
+    for future in futures:
+        future.cancel()
+    if (monitor is not None):
+        monitor.fail()
+
+#   cancel_futures()
+#------------------------------------------------------------------------
+def download_slabs( pydap_grid, index, slab_size=None,
+                    target_bytes=16000000, n_workers=4,
+                    cache=None, url=None, journal=None,
+                    profiles=None, monitor=None ):
+
+    #-----------------------------------------------------------
+    # Note: The slabs from plan_slabs() are fetched
+    #       concurrently, and each one is copied into its
+    #       place in a preallocated output array.  If a slab
+    #       fails, the others are stopped and its exception
+    #       is raised at once.
+    #-----------------------------------------------------------
+    #       Returns (var, maps), like get_grid_data().
+    #-----------------------------------------------------------
+    (out_shape, slabs) = plan_slabs( pydap_grid, index,
+                                     slab_size=slab_size,
+                                     target_bytes=target_bytes )
+    if (len(slabs) == 1):
+        return fetch_slab_adaptive( pydap_grid, slabs[0][2], cache, url,
+                                    journal, profiles, monitor )
+
+    var  = np.empty( out_shape, dtype=pydap_grid.dtype )
+    maps = None
+    if (monitor is None):
+        monitor = download_monitor()
+
+    executor = ThreadPoolExecutor( max_workers=n_workers )
+    futures  = dict()
+    try:
+        for (k1, k2, slab_index) in slabs:
+            future = executor.submit( fetch_slab_adaptive, pydap_grid,
+                                      slab_index, cache, url, journal,
+                                      profiles, monitor )
+            futures[ future ] = (k1, k2)
+
+        #----------------------------------------------
+        # Copy each slab into place as it arrives.
+        # An exception in any slab is re-raised here.
+        #----------------------------------------------
+        for future in as_completed( futures ):
+            (k1, k2) = futures[ future ]
+            (slab, slab_maps) = future.result()
+            var[k1:k2] = slab
+            if (maps is None):
+                #-----------------------------------------
+                # Map for first axis is assembled below;
+                # the other maps are the same for all.
+                #-----------------------------------------
+                maps = list( slab_maps )
+                if (len(maps) > 0):
+                    maps[0] = np.empty( out_shape[0],
+                                        dtype=slab_maps[0].dtype )
+            if (len(maps) > 0):
+                maps[0][k1:k2] = slab_maps[0]
+    except BaseException:
+        cancel_futures( futures, monitor )
+        raise
+    finally:
+        executor.shutdown( wait=False )
+
+    return (var, maps)
+
+#   download_slabs()
+#------------------------------------------------------------------------
+def download_hyperslabs( url, pydap_grid, var_names, index,
+                         grid_names=None, slab_size=None,
+                         target_bytes=16000000, n_workers=4,
+                         timeout=60, monitor=None ):
+
+    #-----------------------------------------------------------
+    # Note: Like download_slabs(), but for several variables
+    #       with the same dimensions as pydap_grid.  Each slab
+    #       from plan_slabs() is one DAP request for all of
+    #       them (see fetch_hyperslabs()), so target_bytes is
+    #       shared by the variables.  Returns a dictionary of
+    #       numpy arrays, keyed by short name.
+    #-----------------------------------------------------------
+    if (slab_size is None):
+        target_bytes = max( 1, target_bytes // max(1, len(var_names)) )
+    (out_shape, slabs) = plan_slabs( pydap_grid, index,
+                                     slab_size=slab_size,
+                                     target_bytes=target_bytes )
+    if (monitor is None):
+        monitor = download_monitor()
+
+    def fetch( slab_index ):
+        monitor.check()
+        try:
+            arrays = fetch_hyperslabs( url, var_names, slab_index,
+                                       pydap_grid.shape,
+                                       grid_names=grid_names,
+                                       timeout=timeout,
+                                       counters=monitor.counters )
+        except Exception:
+            monitor.check()   # (cancelled while waiting to retry)
+            raise
+        monitor.add( sum( [a.nbytes for a in arrays.values()] ) )
+        return arrays
+
+    if (len(slabs) == 1):
+        return fetch( slabs[0][2] )
+
+    results  = dict()
+    executor = ThreadPoolExecutor( max_workers=n_workers )
+    futures  = dict()
+    try:
+        for (k1, k2, slab_index) in slabs:
+            futures[ executor.submit( fetch, slab_index ) ] = (k1, k2)
+        for future in as_completed( futures ):
+            (k1, k2) = futures[ future ]
+            arrays = future.result()
+            for name in var_names:
+                if (name not in results):
+                    results[ name ] = np.empty( out_shape,
+                                                dtype=arrays[ name ].dtype )
+                results[ name ][k1:k2] = arrays[ name ]
+    except BaseException:
+        cancel_futures( futures, monitor )
+        raise
+    finally:
+        executor.shutdown( wait=False )
+
+    return results
+
+#   download_hyperslabs()
+#------------------------------------------------------------------------
+def iter_slabs( pydap_grid, index, slab_size=None,
+                target_bytes=16000000, n_workers=4,
+                cache=None, url=None, journal=None,
+                profiles=None, monitor=None ):
+
+    #-----------------------------------------------------------
+    # Note: This is a generator that yields (var, maps) for
+    #       each slab from plan_slabs(), in order.  At most
+    #       n_workers slabs are requested ahead of the one
+    #       being yielded, so memory use stays constant.
+    #-----------------------------------------------------------
+    (out_shape, slabs) = plan_slabs( pydap_grid, index,
+                                     slab_size=slab_size,
+                                     target_bytes=target_bytes )
+    slab_indices = [slab_index for (k1, k2, slab_index) in slabs]
+
+    executor = ThreadPoolExecutor( max_workers=n_workers )
+    try:
+        futures = list()
+        next_slab = 0
+        while (len(futures) > 0) or (next_slab < len(slab_indices)):
+            #---------------------------------------
+            # Keep up to n_workers slabs in flight
+            #---------------------------------------
+            while (len(futures) < n_workers) and \
+                  (next_slab < len(slab_indices)):
+                slab_index = slab_indices[ next_slab ]
+                futures.append( executor.submit( fetch_slab_adaptive,
+                                     pydap_grid, slab_index, cache, url,
+                                     journal, profiles, monitor ) )
+                next_slab += 1
+            future = futures.pop(0)
+            yield future.result()
+    finally:
+        #-----------------------------------------------
+        # If the caller stops early, don't start any
+        # requests that are still waiting in the queue
+        #-----------------------------------------------
+        for future in futures:
+            future.cancel()
+        executor.shutdown( wait=False )
+
+#   iter_slabs()
+#------------------------------------------------------------------------
+def stitch_pieces( results, axis=-1 ):
+
+    #----------------------------------------------------
+    # Note: results is a list of (var, maps), one for
+    #       each piece, in order.  The vars, and the maps
+    #       for the given axis, are joined along that axis.
+    #       Other maps are the same for all pieces.
+    #----------------------------------------------------
+    if (len(results) == 1):
+        return results[0]
+    var  = np.concatenate( [r[0] for r in results], axis=axis )
+    maps = list( results[0][1] )
+    if (len(maps) > 0):
+        k = (axis % var.ndim)
+        maps[k] = np.concatenate( [r[1][k] for r in results] )
+    return (var, maps)
+
+#   stitch_pieces()
+#------------------------------------------------------------------------
+def download_pieces( pydap_grid, indices, axis=-1, slab_size=None,
+                     target_bytes=16000000, n_workers=4,
+                     cache=None, url=None, journal=None,
+                     profiles=None, monitor=None ):
+
+    #-----------------------------------------------------------
+    # Note: indices is a list of index tuples that differ only
+    #       along axis.  The pieces are downloaded concurrently
+    #       with download_slabs(), then stitched together.  They
+    #       share one monitor, so an error in one piece also
+    #       stops the others.  All pieces use the same slab_size
+    #       (see get_plan_slab_size()).
+    #-----------------------------------------------------------
+    if (slab_size is None):
+        slab_size = get_plan_slab_size( pydap_grid, indices,
+                                        target_bytes, journal )
+    if (len(indices) == 1):
+        return download_slabs( pydap_grid, indices[0],
+                               slab_size=slab_size,
+                               target_bytes=target_bytes,
+                               n_workers=n_workers,
+                               cache=cache, url=url, journal=journal,
+                               profiles=profiles, monitor=monitor )
+
+    if (monitor is None):
+        monitor = download_monitor()
+    executor = ThreadPoolExecutor( max_workers=len(indices) )
+    futures  = list()
+    try:
+        futures = [ executor.submit( download_slabs, pydap_grid, index,
+                                     slab_size, target_bytes, n_workers,
+                                     cache, url, journal, profiles,
+                                     monitor )
+                    for index in indices ]
+        for future in as_completed( futures ):
+            future.result()   # (raise the first error)
+        results = [future.result() for future in futures]
+    except BaseException:
+        cancel_futures( futures, monitor )
+        raise
+    finally:
+        executor.shutdown( wait=False )
+    return stitch_pieces( results, axis=axis )
+
+#   download_pieces()
+#------------------------------------------------------------------------
+def get_pieces_shape( indices, shape ):
+
+    #------------------------------------------------------
+    # Shape of the pieces after they are stitched along
+    # the last axis by stitch_pieces().
+    #------------------------------------------------------
+    shapes = [get_hyperslab_shape( index, shape ) for index in indices]
+    return shapes[0][:-1] + (sum( [s[-1] for s in shapes] ),)
+
+#   get_pieces_shape()
+#------------------------------------------------------------------------
+def iter_pieces( pydap_grid, indices, axis=-1, slab_size=None,
+                 target_bytes=16000000, n_workers=4,
+                 cache=None, url=None, journal=None,
+                 profiles=None, monitor=None ):
+
+    #-----------------------------------------------------------
+    # Note: Like iter_slabs(), but for a list of pieces.  All
+    #       pieces use the same slab_size, so their slabs line
+    #       up along the first axis and can be stitched.
+    #-----------------------------------------------------------
+    if (slab_size is None):
+        slab_size = get_plan_slab_size( pydap_grid, indices,
+                                        target_bytes, journal )
+    iters = [ iter_slabs( pydap_grid, index, slab_size=slab_size,
+                          n_workers=n_workers, cache=cache, url=url,
+                          journal=journal, profiles=profiles,
+                          monitor=monitor )
+              for index in indices ]
+    try:
+        for results in zip( *iters ):
+            yield stitch_pieces( list(results), axis=axis )
+    finally:
+        for it in iters:
+            it.close()
+
+#   iter_pieces()
+#------------------------------------------------------------------------
+def fetch_file( url, var_name, indices, open_func, cache=None,
+                profiles=None, monitor=None ):
+
+    #------------------------------------------------------
+    # Open one file with open_func(url), which returns a
+    # pydap dataset, and fetch the pieces of the subset
+    # given by indices, stitched along the last axis.
+    #------------------------------------------------------
+    #------------------------------------------------------
+    # The requests of open_func() are counted in the
+    # monitor's counters (see br.set_job_counters()).
+    #------------------------------------------------------
+    if (monitor is not None):
+        monitor.check()
+        old_counters = br.set_job_counters( monitor.counters )
+    try:
+        pydap_grid = open_func( url )[ var_name ]
+    finally:
+        if (monitor is not None):
+            br.set_job_counters( old_counters )
+    results = [ fetch_slab_adaptive( pydap_grid, index, cache, url,
+                                     None, profiles, monitor )
+                for index in indices ]
+    return stitch_pieces( results, axis=-1 )
+
+#   fetch_file()
+#------------------------------------------------------------------------
+def download_files( urls, var_name, indices, open_func,
+                    n_workers=4, cache=None, profiles=None,
+                    monitor=None ):
+
+    #------------------------------------------------------------
+    # Note: This is for products that store one (or a few)
+    #       time steps per file.  The same subset is fetched
+    #       from every file in urls, at most n_workers at once,
+    #       then joined along the first (time) axis.  Results
+    #       are put in time order using the first value of the
+    #       time map of each file, so all files must use the
+    #       same time units.  Returns (var, maps).  If one file
+    #       fails, the others are stopped, as in download_slabs().
+    #------------------------------------------------------------
+    if (monitor is None):
+        monitor = download_monitor()
+    executor = ThreadPoolExecutor( max_workers=n_workers )
+    futures  = list()
+    try:
+        futures = [ executor.submit( fetch_file, url, var_name, indices,
+                                     open_func, cache, profiles, monitor )
+                    for url in urls ]
+        for future in as_completed( futures ):
+            future.result()   # (raise the first error)
+        results = [future.result() for future in futures]
+    except BaseException:
+        cancel_futures( futures, monitor )
+        raise
+    finally:
+        executor.shutdown( wait=False )
+
+    #----------------------------------------
+    # Sort by first time in each file, if
+    # every file has a nonempty time map
+    #----------------------------------------
+    HAVE_TIMES = all( [(len(r[1]) > 0) and (r[1][0].size > 0)
+                       for r in results] )
+    if (HAVE_TIMES):
+        results.sort( key=lambda r: r[1][0][0] )
+    return stitch_pieces( results, axis=0 )
+
+#   download_files()
+#------------------------------------------------------------------------
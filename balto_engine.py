@@ -0,0 +1,1494 @@
+"""
+This module defines the download engine of the BALTO GUI app, which
+does not use any widgets, so the same subsetting and download logic
+can run in batch jobs, such as cron jobs or jobs on compute nodes.
+A download is described by a request spec, a dictionary (or a JSON
+file) with the url of the file, the variable, a bounding box, a time
+range, strides and an output format.  The GUI builds the same kind
+of job from its widgets and runs it with this engine.  Spec files
+can be run from a terminal with:
+    python -m balto_gui spec1.json spec2.json
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import types
+import numpy as np
+import balto_cache as bc
+import balto_download as bd
+import balto_index as bi
+import balto_io as bio
+import balto_retry as br
+import balto_unpack as bu
+
+#------------------------------------------------------------------------
+#
+# get_request_spec()
+# load_request_specs()
+# get_datetime_obj()
+# get_coord_name()
+# get_time_index_range()
+# get_lat_index_range()
+# get_lon_index_ranges()
+# get_lon_slices()
+# get_hyperslab_indices()
+# get_aggregate_indices()
+# get_coord_attributes()
+# get_dim_kind()
+# get_coords_from_maps()
+#
+# class download_engine
+#     __init__()
+#     write_log()
+#     open_dataset()
+#     open_like()
+#     get_coord_array()
+#     get_coord_index()
+#     get_time_index()
+#     get_request_indices()
+#     make_job()
+#     get_output_path()
+#     get_slab_settings()
+#     set_cache_validator()
+#     get_journal()
+#     report_interrupted_download()
+#     get_user_var()
+#     get_unpacked_shape()
+#     run()
+#     run_request()
+#     download_to_memory()
+#     download_to_netcdf()
+#     download_to_chunk_store()
+#     download_to_memmap()
+#     iter_download()
+#     get_netcdf_result()
+#     save_netcdf()
+#     download_aggregate()
+#     download_variables()
+#
+# print_log()
+# main()
+#
+#------------------------------------------------------------------------
+#  A request spec.  Only url and var_name are required.
+#------------------------------------------------------------------------
+#  bbox    = [minlon, minlat, maxlon, maxlat], default is everything
+#  start   = first datetime, e.g. "2000-01-01" or "2000-01-01T12:00:00Z"
+#  end     = last datetime (included).  Give both or neither.
+#  strides = [time, lat, lon] strides, or one int for all three
+#  format  = "netCDF", "netCDF4", "Chunk store" or "In memory"
+#  path    = output file, default is <download_dir>/<file>_<var>.nc
+#  download_dir = default is the engine's download_dir
+#  var_names = several variables with the same dimensions, to get
+#            the same hyperslab of each (one output file for each)
+#  urls    = many files with the same structure, e.g. one time step
+#            per file, to join along time (url defaults to urls[0])
+#------------------------------------------------------------------------
+DEFAULT_SPEC = {'url': None, 'var_name': None, 'bbox': None,
+                'start': None, 'end': None, 'strides': [1, 1, 1],
+                'format': 'netCDF4', 'path': None, 'download_dir': None,
+                'var_names': None, 'urls': None}
+
+FORMATS = ['In memory', 'netCDF', 'netCDF4', 'Chunk store']
+
+#------------------------------------------------------------------------
+def get_request_spec( spec ):
+
+    #-----------------------------------------------------
+    # Check a request spec, and fill in the defaults.
+    # Raises a ValueError for a spec that is not valid.
+    #-----------------------------------------------------
+    unknown = [key for key in spec if (key not in DEFAULT_SPEC)]
+    if (len(unknown) > 0):
+        raise ValueError( 'Unknown keys in request spec: ' +
+                          ', '.join( unknown ) )
+    new_spec = dict( DEFAULT_SPEC )
+    new_spec.update( spec )
+    for key in ['var_names', 'urls']:
+        values = new_spec[ key ]
+        if (values is None):
+            continue
+        if not(isinstance( values, list )) or (len(values) == 0):
+            raise ValueError( key + ' must be a list of strings.' )
+        new_spec[ key ] = [ str(value) for value in values ]
+    if (new_spec['var_names'] is not None) and (new_spec['urls'] is not None):
+        raise ValueError( 'Request spec can not have both var_names and urls.' )
+    if (new_spec['var_names'] is not None) and not(new_spec['var_name']):
+        new_spec['var_name'] = new_spec['var_names'][0]
+    if (new_spec['urls'] is not None) and not(new_spec['url']):
+        new_spec['url'] = new_spec['urls'][0]
+    for key in ['url', 'var_name']:
+        if not(new_spec[ key ]):
+            raise ValueError( 'Request spec has no ' + key + '.' )
+
+    bbox = new_spec['bbox']
+    if (bbox is not None):
+        if (len(bbox) != 4):
+            raise ValueError( 'bbox must be [minlon, minlat, maxlon, maxlat].' )
+        new_spec['bbox'] = [ float(x) for x in bbox ]
+
+    strides = new_spec['strides']
+    if (np.ndim( strides ) == 0):
+        strides = [ strides ] * 3
+    if (len(strides) != 3) or (min( [int(s) for s in strides] ) < 1):
+        raise ValueError( 'strides must be 3 ints, each 1 or more.' )
+    new_spec['strides'] = [ int(s) for s in strides ]
+
+    formats = dict( [(name.lower(), name) for name in FORMATS] )
+    format_name = str( new_spec['format'] ).lower()
+    if (format_name not in formats):
+        raise ValueError( 'format must be one of: ' + ', '.join( FORMATS ) )
+    new_spec['format'] = formats[ format_name ]
+
+    for key in ['start', 'end']:
+        new_spec[ key ] = get_datetime_obj( new_spec[ key ] )
+    (start, end) = (new_spec['start'], new_spec['end'])
+    if ((start is None) != (end is None)):
+        raise ValueError( 'Request spec must have both start and end, or neither.' )
+    if (start is not None) and (start > end):
+        raise ValueError( 'Request spec start is after its end.' )
+    if (start is not None) and (new_spec['urls'] is not None):
+        #--------------------------------------------------
+        # All times in each file are used (see
+        # download_engine.download_aggregate), so choose
+        # the files instead.
+        #--------------------------------------------------
+        raise ValueError( 'Request spec can not have start and end with urls.' )
+    if (new_spec['format'] == 'Chunk store') and \
+       ((new_spec['var_names'] is not None) or (new_spec['urls'] is not None)):
+        raise ValueError( 'Chunk store is not supported with var_names or urls.' )
+    return new_spec
+
+#   get_request_spec()
+#------------------------------------------------------------------------
+def load_request_specs( path ):
+
+    #-----------------------------------------------------
+    # A spec file holds one spec (a JSON object), or a
+    # list of them.  Returns a list of checked specs.
+    #-----------------------------------------------------
+    with open( path, 'r' ) as spec_file:
+        specs = json.load( spec_file )
+    if (isinstance( specs, dict )):
+        specs = [ specs ]
+    if not(isinstance( specs, list )):
+        raise ValueError( path + ' must hold a JSON object or list.' )
+    return [ get_request_spec( spec ) for spec in specs ]
+
+#   load_request_specs()
+#------------------------------------------------------------------------
+def get_datetime_obj( value ):
+
+    #-----------------------------------------------------
+    # Note: Returns a naive datetime, in UTC if value has
+    #       a time zone.  fromisoformat() does not accept
+    #       a trailing "Z" (for UTC) before Python 3.11.
+    #-----------------------------------------------------
+    if (value is None):
+        return value
+    if isinstance( value, datetime.datetime ):
+        dt = value
+    elif isinstance( value, datetime.date ):
+        return datetime.datetime( value.year, value.month, value.day )
+    else:
+        value = str(value).strip()
+        if (value[-1:] in ['Z', 'z']):
+            value = value[:-1] + '+00:00'
+        dt = datetime.datetime.fromisoformat( value )
+    if (dt.tzinfo is not None):
+        dt = dt.astimezone( datetime.timezone.utc ).replace( tzinfo=None )
+    return dt
+
+#   get_datetime_obj()
+#------------------------------------------------------------------------
+def get_coord_name( var_names, kind ):
+
+    #-------------------------------------------------
+    # Return the short name of the time, lat or lon
+    # variable in var_names, or None.
+    #-------------------------------------------------
+    name_lists = {
+    'time': ['time', 'TIME'],
+    'lat' : ['lat', 'LAT', 'coadsy', 'COADSY',
+             'latitude', 'LATITUDE'],
+    'lon' : ['lon', 'LON', 'coadsx', 'COADSX',
+             'longitude', 'LONGITUDE'] }
+
+    for name in name_lists[ kind ]:
+        if (name in var_names):
+            return name
+    return None
+
+#   get_coord_name()
+#------------------------------------------------------------------------
+def get_time_index_range( time_index, nt, start_datetime_obj,
+                          end_datetime_obj ):
+
+    #-------------------------------------------------------
+    # Note: Returns (i1, i2) for times[i1:i2], from the
+    #       start to the end datetime, inclusive.  If the
+    #       time period is shorter than the time spacing,
+    #       the last time before the start is used.  With
+    #       no time_index or datetimes, returns (0, nt).
+    #       Raises a ValueError if the start is after the
+    #       end, or if the period is outside of the times.
+    #-------------------------------------------------------
+    if (time_index is None) or (start_datetime_obj is None) or \
+       (end_datetime_obj is None):
+        return (0, nt)  # (unrestricted)
+    if (start_datetime_obj > end_datetime_obj):
+        raise ValueError( 'The start time is after the end time.' )
+    t1 = time_index.encode( start_datetime_obj )
+    t2 = time_index.encode( end_datetime_obj )
+    (t_min, t_max) = (time_index.values.min(), time_index.values.max())
+    if (t2 < t_min) or (t1 > t_max):
+        msg = 'The time period is outside of the times in the data: '
+        msg += str( time_index.get_datetime( t_min ) ) + ' to '
+        msg += str( time_index.get_datetime( t_max ) )
+        raise ValueError( msg )
+    (start_index, end_index) = time_index.index_range( start_datetime_obj,
+                                                       end_datetime_obj )
+    if (start_index == end_index):
+        start_index = min( max(start_index - 1, 0), nt - 1 )
+        end_index   = start_index + 1
+    return (start_index, end_index)
+
+#   get_time_index_range()
+#------------------------------------------------------------------------
+def get_lat_index_range( lat_index, nlats, minlat, maxlat ):
+
+    #------------------------------------------------
+    # lat_i2 is exclusive, as used in the slice
+    # a[lat_i1:lat_i2], so the last latitude in the
+    # box is included.  An empty box gets all lats.
+    #------------------------------------------------
+    (lat_i1, lat_i2) = lat_index.index_range( minlat, maxlat )
+    if (lat_i1 == lat_i2):
+        lat_i1 = 0
+        lat_i2 = nlats
+    return (lat_i1, lat_i2)
+
+#   get_lat_index_range()
+#------------------------------------------------------------------------
+def get_lon_index_ranges( lon_index, nlons, minlon, maxlon ):
+
+    #------------------------------------------------
+    # Longitudes are periodic, so the box is shifted
+    # to the lons of the data.  If it crosses the
+    # seam of the grid, it is split into two index
+    # ranges.  An empty box gets all lons.
+    #------------------------------------------------
+    lon_ranges = bi.lon_index_ranges( lon_index, minlon, maxlon )
+    if (len(lon_ranges) == 0):
+        lon_ranges = [ (0, nlons) ]
+    return lon_ranges
+
+#   get_lon_index_ranges()
+#------------------------------------------------------------------------
+def get_lon_slices( lon_ranges, lon_stride=None ):
+
+    #---------------------------------------------------
+    # Note: Convert lon index ranges to slices.  When
+    #       a box crossing the seam is split in two and
+    #       there is a stride, the second piece starts
+    #       where the stride from the first one lands,
+    #       so the spacing is the same across the seam.
+    #---------------------------------------------------
+    slices = list()
+    n_used = 0
+    for (i1, i2) in lon_ranges:
+        start = i1
+        if (lon_stride is not None):
+            start += ((-n_used) % lon_stride)
+        if (start < i2):
+            slices.append( slice(start, i2, lon_stride) )
+        n_used += (i2 - i1)
+    return slices
+
+#   get_lon_slices()
+#------------------------------------------------------------------------
+def get_hyperslab_indices( ndims, t_range, lat_range, lon_ranges,
+                           strides=(1, 1, 1) ):
+
+    #---------------------------------------------------
+    # Note: Returns a list of tuples of slices, one
+    #       slice for each dimension, that define the
+    #       hyperslab to download.  There are two tuples
+    #       if the lon box crosses the seam of the grid,
+    #       else one.  A range of (None, None), or
+    #       lon_ranges=None, means the whole axis.
+    #---------------------------------------------------
+    # A stride > 1 keeps every n-th value, and is
+    # sent to the server as [start:stride:stop], so
+    # the other values are never transferred.
+    #---------------------------------------------------
+    (t_stride, lat_stride, lon_stride) = [ (None if (s == 1) else s)
+                                           for s in strides ]
+    (t_i1, t_i2)     = t_range
+    (lat_i1, lat_i2) = lat_range
+
+    all_index = slice(None)
+    if (t_i1 is None):
+        t_index = slice(None, None, t_stride)
+    else:
+        t_index = slice(t_i1, t_i2, t_stride)
+    if (lat_i1 is None) or (lon_ranges is None):
+        lat_index   = slice(None, None, lat_stride)
+        lon_indices = [slice(None, None, lon_stride)]
+    else:
+        lat_index   = slice(lat_i1, lat_i2, lat_stride)
+        lon_indices = get_lon_slices( lon_ranges, lon_stride )
+    #------------------------------------------------
+    indices = list()
+    for lon_index in lon_indices:
+        if (ndims == 3):
+            #-------------------------------------
+            # Assume dims are:  (time, lat, lon)
+            #-------------------------------------
+            index = (t_index, lat_index, lon_index)
+        elif (ndims == 1):  # time series
+            indices.append( (t_index,) )
+            break
+        elif (ndims == 2):  # spatial grid
+            #-------------------------------
+            # Assume dims are:  (lat, lon)
+            #-------------------------------
+            index = (lat_index, lon_index)
+        else:
+            indices.append( tuple( [all_index] * ndims ) )
+            break
+        indices.append( index )
+    return indices
+
+#   get_hyperslab_indices()
+#------------------------------------------------------------------------
+def get_aggregate_indices( shape, urls, indices ):
+
+    #-----------------------------------------------------
+    # Note: For download_aggregate().  shape is the shape
+    #       of the variable in one file, and indices are
+    #       the pieces of the lat/lon subset.  All times in
+    #       each file are kept.  If each file has a single
+    #       time step, a time stride selects every step-th
+    #       file of urls (which should be in time order);
+    #       otherwise it is used within each file.  Returns
+    #       (urls, indices).
+    #-----------------------------------------------------
+    step = indices[0][0].step
+    if (shape[0] == 1) and (step is not None) and (step > 1):
+        return (list(urls)[::step],
+                [ (slice(None),) + index[1:] for index in indices ])
+    return (list(urls),
+            [ (slice(None, None, step),) + index[1:] for index in indices ])
+
+#   get_aggregate_indices()
+#------------------------------------------------------------------------
+def get_coord_attributes( dataset, dims ):
+
+    #------------------------------------------------------
+    # The attributes of the coordinate variable of each
+    # dimension in dims, keyed by dimension name, for the
+    # dimensions that have one in the dataset.
+    #------------------------------------------------------
+    coord_atts = dict()
+    for dim in dims:
+        if (dim in dataset.keys()):
+            coord_atts[ dim ] = dataset[ dim ].attributes
+    return coord_atts
+
+#   get_coord_attributes()
+#------------------------------------------------------------------------
+def get_dim_kind( dim, atts=None ):
+
+    #-------------------------------------------------------
+    # Is the dimension named dim the 'time', 'lat' or 'lon'
+    # axis?  Known names are checked first (see
+    # get_coord_name()), then the CF attributes of its
+    # coordinate variable: axis (T, Y or X), standard_name,
+    # and units such as "degrees_north" or "days since
+    # 1800-1-1".  Returns None for others, e.g. depth.
+    #-------------------------------------------------------
+    for kind in ['time', 'lat', 'lon']:
+        if (get_coord_name( [dim], kind ) is not None):
+            return kind
+    if (atts is None):
+        return None
+    axis = str( atts.get('axis', '') ).upper()
+    axis_kinds = {'T': 'time', 'Y': 'lat', 'X': 'lon'}
+    if (axis in axis_kinds):
+        return axis_kinds[ axis ]
+    standard_name = str( atts.get('standard_name', '') ).lower()
+    name_kinds = {'time': 'time', 'latitude': 'lat', 'longitude': 'lon'}
+    if (standard_name in name_kinds):
+        return name_kinds[ standard_name ]
+    units = str( atts.get('units', '') ).lower()
+    if (' since ' in units):
+        return 'time'
+    if (units in ['degrees_north', 'degree_north', 'degrees_n', 'degree_n']):
+        return 'lat'
+    if (units in ['degrees_east', 'degree_east', 'degrees_e', 'degree_e']):
+        return 'lon'
+    return None
+
+#   get_dim_kind()
+#------------------------------------------------------------------------
+def get_coords_from_maps( maps, dims, coord_atts=None ):
+
+    #------------------------------------------------------
+    # "maps" holds the dimension vectors that come with
+    # a pydap grid, one for each name in dims, e.g.
+    # [time, lat, lon] or [lat, lon].  Each one is
+    # matched to time, lat or lon by its dimension's name
+    # or by the attributes in coord_atts (see
+    # get_dim_kind()), not by its position.
+    #------------------------------------------------------
+    if (coord_atts is None):
+        coord_atts = dict()
+    coords = {'time': None, 'lat': None, 'lon': None}
+    for (dim, values) in zip(dims, maps):
+        kind = get_dim_kind( dim, coord_atts.get( dim ) )
+        if (kind is not None) and (coords[ kind ] is None):
+            coords[ kind ] = values
+    return (coords['time'], coords['lat'], coords['lon'])
+
+#   get_coords_from_maps()
+#------------------------------------------------------------------------
+class download_engine:
+    #--------------------------------------------------------------------
+    def __init__(self, timeout_secs=60, use_parallel_download=True,
+                 slab_target_bytes=16000000, n_workers=4,
+                 cache=None, profiles=None, metadata_cache=None,
+                 use_journal=True, journal_dir=None,
+                 max_memory_bytes=2000000000, scratch_dir=None,
+                 unpack_dtype='float32', missing_mode='restore',
+                 use_packed_array=False, download_dir='.', log=None):
+
+        #-----------------------------------------------------------
+        # Note: The settings have the same names and meanings as
+        #       in balto_gui.  cache, profiles and metadata_cache
+        #       are a response_cache, host_profiles and
+        #       metadata_cache from balto_cache.py, or None.
+        #       log(msg, level) is called with each message,
+        #       where msg is a string or a list of strings.
+        #-----------------------------------------------------------
+        self.timeout_secs      = timeout_secs
+        self.use_parallel_download = use_parallel_download
+        self.slab_target_bytes = slab_target_bytes
+        self.n_workers         = n_workers
+        self.cache             = cache
+        self.profiles          = profiles
+        self.metadata_cache    = metadata_cache
+        self.use_journal       = use_journal
+        self.journal_dir       = journal_dir
+        self.max_memory_bytes  = max_memory_bytes
+        self.scratch_dir       = scratch_dir
+        self.unpack_dtype      = unpack_dtype
+        self.missing_mode      = missing_mode
+        self.use_packed_array  = use_packed_array
+        self.download_dir      = download_dir
+        self.log               = log
+        #-------------------------------------------
+        # Coordinate arrays and their indexes are
+        # cached for each url.  (The GUI passes in
+        # its own dicts, so they are shared.)
+        #-------------------------------------------
+        self.coord_cache = dict()
+        self.index_cache = dict()
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def write_log(self, msg, level='info'):
+
+        if (self.log is not None):
+            self.log( msg, level )
+
+    #   write_log()
+    #--------------------------------------------------------------------
+    def open_dataset(self, url):
+
+        if (self.metadata_cache is not None):
+            return self.metadata_cache.open_url( url,
+                                                 timeout=self.timeout_secs )
+        import pydap.client
+        return br.default_policy.call( pydap.client.open_url, url,
+                                       timeout=self.timeout_secs )
+
+    #   open_dataset()
+    #--------------------------------------------------------------------
+    def open_like(self, url, template_url):
+
+        #-----------------------------------------------------
+        # Files in one directory have the same structure,
+        # so build the dataset of url from the DDS and DAS
+        # of template_url, instead of asking for them.
+        #-----------------------------------------------------
+        if (self.metadata_cache is not None):
+            return self.metadata_cache.open_like( url, template_url,
+                                                  timeout=self.timeout_secs )
+        return self.open_dataset( url )
+
+    #   open_like()
+    #--------------------------------------------------------------------
+    def get_coord_array(self, url, dataset, name):
+
+        #-----------------------------------------------------
+        # The first time a coordinate is needed, all of the
+        # missing time, lat and lon arrays are fetched
+        # together in a single DAP request.
+        #-----------------------------------------------------
+        if (url not in self.coord_cache):
+            self.coord_cache[ url ] = dict()
+        coords = self.coord_cache[ url ]
+
+        if (name not in coords):
+            names = list()
+            var_names = list( dataset.keys() )
+            for kind in ['time', 'lat', 'lon']:
+                coord_name = get_coord_name( var_names, kind )
+                if (coord_name is not None) and (coord_name not in coords):
+                    names.append( coord_name )
+            if (name not in names):
+                names.append( name )
+            arrays = bd.fetch_variables( url, names,
+                                         timeout=self.timeout_secs )
+            coords.update( arrays )
+
+        return coords[ name ]
+
+    #   get_coord_array()
+    #--------------------------------------------------------------------
+    def get_coord_index(self, url, dataset, name):
+
+        key = (url, name)
+        if (key not in self.index_cache):
+            values = self.get_coord_array( url, dataset, name )
+            self.index_cache[ key ] = bi.coord_index( values )
+        return self.index_cache[ key ]
+
+    #   get_coord_index()
+    #--------------------------------------------------------------------
+    def get_time_index(self, url, dataset, name):
+
+        #-----------------------------------------------------
+        # Uses the "units" and "calendar" attributes of the
+        # time variable.  Raises a ValueError if they are
+        # not supported.
+        #-----------------------------------------------------
+        key = (url, '_time_index')
+        if (key not in self.index_cache):
+            atts = dataset[ name ].attributes
+            calendar = atts.get('calendar', 'standard')
+            values = self.get_coord_array( url, dataset, name )
+            self.index_cache[ key ] = bi.time_index( values,
+                                                     atts.get('units', ''),
+                                                     calendar=calendar )
+        return self.index_cache[ key ]
+
+    #   get_time_index()
+    #--------------------------------------------------------------------
+    def get_request_indices(self, spec, dataset):
+
+        #-----------------------------------------------------
+        # Return the hyperslab indices for a request spec,
+        # with the same logic that the GUI uses.
+        #-----------------------------------------------------
+        url  = spec['url']
+        ndims = len( dataset[ spec['var_name'] ].dimensions )
+        var_names = list( dataset.keys() )
+        t_range    = (None, None)
+        lat_range  = (None, None)
+        lon_ranges = None
+
+        time_name = get_coord_name( var_names, 'time' )
+        if (time_name is not None):
+            nt = len( self.get_coord_array( url, dataset, time_name ) )
+            time_index = None
+            if (spec['start'] is not None) and (spec['end'] is not None):
+                try:
+                    time_index = self.get_time_index( url, dataset,
+                                                      time_name )
+                except ValueError as err:
+                    #-------------------------------------------
+                    # e.g. "months since", which is not a
+                    # fixed unit, so all times are downloaded
+                    #-------------------------------------------
+                    msg1 = 'Sorry, ' + str(err)
+                    msg2 = 'The start and end are ignored, and'
+                    msg3 = 'all ' + str(nt) + ' times will be downloaded.'
+                    self.write_log( [msg1, msg2, msg3, ' '],
+                                    level='warning' )
+            t_range = get_time_index_range( time_index, nt,
+                                            spec['start'], spec['end'] )
+
+        bbox = spec['bbox']
+        lat_name = get_coord_name( var_names, 'lat' )
+        lon_name = get_coord_name( var_names, 'lon' )
+        if (bbox is not None) and (lat_name is not None) and \
+           (lon_name is not None):
+            (minlon, minlat, maxlon, maxlat) = bbox
+            lats = self.get_coord_array( url, dataset, lat_name )
+            lons = self.get_coord_array( url, dataset, lon_name )
+            if (lats.ndim == 1) and (lons.ndim == 1):
+                lat_index = self.get_coord_index( url, dataset, lat_name )
+                lon_index = self.get_coord_index( url, dataset, lon_name )
+                lat_range  = get_lat_index_range( lat_index, lats.size,
+                                                  minlat, maxlat )
+                lon_ranges = get_lon_index_ranges( lon_index, lons.size,
+                                                   minlon, maxlon )
+        return get_hyperslab_indices( ndims, t_range, lat_range,
+                                      lon_ranges, spec['strides'] )
+
+    #   get_request_indices()
+    #--------------------------------------------------------------------
+    def make_job(self, short_name, download_format, url, dataset,
+                 indices, filename=None, path=None, download_dir=None,
+                 monitor=None, callback=None, var_names=None, urls=None):
+
+        #---------------------------------------------------------
+        # Note: A job holds everything a download needs, as a
+        #       read-only mapping, so that it can run in a
+        #       thread while the user changes the GUI.  If no
+        #       monitor is given, one is made that calls
+        #       callback(monitor) as the download progresses.
+        #---------------------------------------------------------
+        # For several variables (var_names), or the same
+        # variable in several files (urls), see run().
+        #---------------------------------------------------------
+        if (filename is None):
+            filename = url.rstrip('/').split('/')[-1]
+        if (monitor is None):
+            names = (var_names if (var_names is not None) else [short_name])
+            n_bytes = 0
+            (n_files, file_indices) = (1, indices)
+            if (urls is not None):
+                (file_urls, file_indices) = get_aggregate_indices(
+                                                dataset[ short_name ].shape,
+                                                urls, indices )
+                n_files = len( file_urls )
+            for name in names:
+                pydap_grid = dataset[ name ]
+                n_bytes += bd.get_request_bytes( file_indices,
+                                                 pydap_grid.shape,
+                                                 pydap_grid.dtype.itemsize )
+            n_bytes *= n_files
+            monitor = bd.download_monitor( n_bytes, callback=callback )
+        if (var_names is not None):
+            var_names = tuple( var_names )
+        if (urls is not None):
+            urls = tuple( urls )
+        job = {'short_name': short_name,
+               'format':     download_format,
+               'filename':   filename,
+               'path':       path,
+               'download_dir': download_dir,
+               'url':        url,
+               'dataset':    dataset,
+               'indices':    tuple( indices ),
+               'monitor':    monitor,
+               'var_names':  var_names,
+               'urls':       urls }
+        return types.MappingProxyType( job )
+
+    #   make_job()
+    #--------------------------------------------------------------------
+    def get_output_path(self, job, extension='.nc', short_name=None):
+
+        #----------------------------------------------------
+        # e.g.  ./sst.mnmean_sst.nc  for sst in sst.mnmean.nc
+        # short_name is for one of the job's var_names.
+        #----------------------------------------------------
+        if (short_name is None):
+            short_name = job['short_name']
+        if (job['path'] is not None) and (short_name == job['short_name']):
+            return job['path']
+        filename = job['filename']
+        for ext in ['.gz', '.nc', '.nc4', '.hdf', '.h5']:
+            if (filename.endswith( ext )):
+                filename = filename[:-len(ext)]
+        filename += '_' + short_name + extension
+        download_dir = job['download_dir']
+        if (download_dir is None):
+            download_dir = self.download_dir
+        return os.path.join( download_dir, filename )
+
+    #   get_output_path()
+    #--------------------------------------------------------------------
+    def get_slab_settings(self, url):
+
+        #---------------------------------------------------
+        # Return (slab_bytes, n_workers) to use for the
+        # server of url.  These come from its host
+        # profile, which adapts to how fast it responds.
+        #---------------------------------------------------
+        if (self.profiles is None):
+            return (self.slab_target_bytes, self.n_workers)
+        return self.profiles.get_slab_settings( url )
+
+    #   get_slab_settings()
+    #--------------------------------------------------------------------
+    def set_cache_validator(self, url):
+
+        #---------------------------------------------------
+        # Key the response cache entries of url on the
+        # file's ETag (or Last-Modified, or DDS/DAS hash)
+        # from the metadata cache, so that slabs of an
+        # older version of the file are not used.
+        #---------------------------------------------------
+        if (self.cache is None) or (self.metadata_cache is None):
+            return
+        self.cache.set_validator( url, self.metadata_cache.get_validator( url ) )
+
+    #   set_cache_validator()
+    #--------------------------------------------------------------------
+    def get_journal(self, job):
+
+        #------------------------------------------------------
+        # Return the slab journal for this download, which
+        # already has the slabs from an earlier attempt that
+        # failed, if any.  Returns None if disabled.
+        #------------------------------------------------------
+        if not(self.use_journal):
+            return None
+        journal = bc.slab_journal( job['url'], job['short_name'],
+                                   list( job['indices'] ),
+                                   journal_dir=self.journal_dir )
+        n_done = journal.get_n_done()
+        if (n_done > 0):
+            msg = 'Resuming download; ' + str(n_done) + ' slabs already saved.'
+            self.write_log( msg )
+        return journal
+
+    #   get_journal()
+    #--------------------------------------------------------------------
+    def report_interrupted_download(self, journal):
+
+        msg1 = 'Sorry, the download was interrupted.'
+        msgs = [msg1]
+        if (journal is not None):
+            msg2 = str(journal.get_n_done()) + ' slabs were saved.'
+            msg3 = 'Download it again to get the rest.'
+            msgs += [msg2, msg3]
+        self.write_log( msgs + [' '], level='warning' )
+
+    #   report_interrupted_download()
+    #--------------------------------------------------------------------
+    def get_user_var(self, var, atts, PACKED=None):
+
+        #---------------------------------------------------------
+        # Apply missing_value, _FillValue, valid_range,
+        # scale_factor and add_offset (see balto_unpack.py),
+        # now, or as parts are indexed for a packed_array.
+        #---------------------------------------------------------
+        if (PACKED is None):
+            PACKED = self.use_packed_array
+        if (PACKED):
+            return bu.packed_array( var, atts, dtype=self.unpack_dtype,
+                                    missing=self.missing_mode )
+        return bu.unpack_array( var, atts, dtype=self.unpack_dtype,
+                                missing=self.missing_mode )
+
+    #   get_user_var()
+    #--------------------------------------------------------------------
+    def get_unpacked_shape(self, job):
+
+        #-----------------------------------------------------
+        # Return the shape and dtype of the hyperslab after
+        # unpacking, e.g. ">i2" packed becomes "float32".
+        #-----------------------------------------------------
+        pydap_grid = job['dataset'][ job['short_name'] ]
+        out_shape  = bd.get_pieces_shape( list( job['indices'] ),
+                                          pydap_grid.shape )
+        out_dtype  = bu.get_unpacked_dtype( pydap_grid.dtype,
+                                            pydap_grid.attributes,
+                                            dtype=self.unpack_dtype,
+                                            missing=self.missing_mode )
+        return (out_shape, out_dtype)
+
+    #   get_unpacked_shape()
+    #--------------------------------------------------------------------
+    def run(self, job):
+
+        #---------------------------------------------------------
+        # Note: Runs a job from make_job(), and returns a dict
+        #       with the result: var, times, lats, lons, and
+        #       for the file formats, path and file (the open
+        #       file, if any).  For a netCDF format, each slab
+        #       is written to a file as it arrives, instead of
+        #       being kept in RAM.  If the unpacked hyperslab
+        #       is bigger than max_memory_bytes, it is kept in
+        #       a memory-mapped scratch file (scratch_file).
+        #---------------------------------------------------------
+        # A job with var_names or urls is run by
+        # download_variables() or download_aggregate().
+        #---------------------------------------------------------
+        self.set_cache_validator( job['url'] )
+        if (job['urls'] is not None):
+            return self.download_aggregate( job )
+        if (job['var_names'] is not None):
+            return self.download_variables( job )
+        nc_format = bio.get_nc_format( job['format'] )
+        (out_shape, out_dtype) = self.get_unpacked_shape( job )
+        n_bytes = out_dtype.itemsize * int( np.prod( out_shape ) )
+        if (nc_format is not None):
+            return self.download_to_netcdf( job, nc_format )
+        elif (job['format'] == 'Chunk store'):
+            return self.download_to_chunk_store( job )
+        elif (n_bytes > self.max_memory_bytes):
+            return self.download_to_memmap( job )
+        else:
+            return self.download_to_memory( job )
+
+    #   run()
+    #--------------------------------------------------------------------
+    def run_request(self, spec, monitor=None):
+
+        #-----------------------------------------------------
+        # Open the file of a request spec, find the indices
+        # of the hyperslab and download it.
+        #-----------------------------------------------------
+        spec    = get_request_spec( spec )
+        dataset = self.open_dataset( spec['url'] )
+        var_names = spec['var_names']
+        if (var_names is None):
+            var_names = [ spec['var_name'] ]
+        for var_name in var_names:
+            if (var_name not in dataset.keys()):
+                raise ValueError( 'No variable ' + var_name +
+                                  ' in ' + spec['url'] )
+        indices = self.get_request_indices( spec, dataset )
+        job = self.make_job( spec['var_name'], spec['format'],
+                             spec['url'], dataset, indices,
+                             path=spec['path'],
+                             download_dir=spec['download_dir'],
+                             monitor=monitor,
+                             var_names=spec['var_names'],
+                             urls=spec['urls'] )
+        return self.run( job )
+
+    #   run_request()
+    #--------------------------------------------------------------------
+    def download_to_memory(self, job):
+
+        #--------------------------------------------------
+        # The parallel engine splits the hyperslab into
+        # slabs along the first axis, fetches them with a
+        # pool of threads and assembles them in one array.
+        # "maps" holds the dimension vectors, in order.
+        # If the lon box crosses the seam of the grid,
+        # its two pieces are fetched and stitched.
+        #--------------------------------------------------
+        # Completed slabs are saved in a journal, so if
+        # the download fails, calling it again only gets
+        # the missing slabs.
+        #--------------------------------------------------
+        short_name = job['short_name']
+        pydap_grid = job['dataset'][ short_name ]
+        indices    = list( job['indices'] )
+        url        = job['url']
+        msg = 'Downloading variable: ' + short_name + '...'
+        self.write_log( msg )
+
+        journal = self.get_journal( job )
+        try:
+            if (self.use_parallel_download):
+                (slab_bytes, n_workers) = self.get_slab_settings( url )
+                (var, maps) = bd.download_pieces( pydap_grid, indices,
+                                    target_bytes=slab_bytes,
+                                    n_workers=n_workers,
+                                    cache=self.cache, url=url,
+                                    journal=journal,
+                                    profiles=self.profiles,
+                                    monitor=job['monitor'] )
+            else:
+                results = [ bd.fetch_slab_adaptive( pydap_grid, index,
+                                    self.cache, url, journal,
+                                    self.profiles, job['monitor'] )
+                            for index in indices ]
+                (var, maps) = bd.stitch_pieces( results )
+        except Exception:
+            self.report_interrupted_download( journal )
+            raise
+        if (journal is not None):
+            journal.finish()
+
+        dims = pydap_grid.dimensions
+        coord_atts = get_coord_attributes( job['dataset'], dims )
+        (times, lats, lons) = get_coords_from_maps( maps, dims, coord_atts )
+        if (len(indices) > 1) and (lons is not None):
+            lons = bi.unwrap_lons( lons )
+        var = self.get_user_var( var, pydap_grid.attributes )
+        return {'var': var, 'times': times, 'lats': lats, 'lons': lons}
+
+    #   download_to_memory()
+    #--------------------------------------------------------------------
+    def download_to_netcdf(self, job, nc_format='NETCDF4'):
+
+        #---------------------------------------------------------
+        # Note: The hyperslab is downloaded one slab at a time
+        #       (see bd.iter_pieces), and each slab is written
+        #       straight into a chunked, compressed netCDF file,
+        #       so downloads that are bigger than memory finish.
+        #       Attributes of the variable, its coordinates and
+        #       the dataset are copied from the source.  The
+        #       result's var is the netCDF4 variable in that
+        #       file, which reads values lazily and unpacks them.
+        #---------------------------------------------------------
+        # The file is written as "<path>.part" and renamed when
+        # it is complete, so a file at path is never partial.
+        # The part file is removed if the download fails.
+        #---------------------------------------------------------
+        short_name = job['short_name']
+        dataset    = job['dataset']
+        pydap_grid = dataset[ short_name ]
+        indices    = list( job['indices'] )
+        url        = job['url']
+        dims = pydap_grid.dimensions
+        path = self.get_output_path( job, '.nc' )
+        part_path = path + '.part'
+
+        out_shape = bd.get_pieces_shape( indices, pydap_grid.shape )
+
+        coord_atts = get_coord_attributes( dataset, dims )
+        global_atts = dataset.attributes.get('NC_GLOBAL', dict())
+
+        msg1 = 'Downloading variable: ' + short_name + '...'
+        msg2 = 'Variable saved in:  ' + path
+        self.write_log( [msg1, msg2] )
+
+        writer = bio.netcdf_writer( part_path, short_name, dims, out_shape,
+                                    pydap_grid.dtype,
+                                    atts=pydap_grid.attributes,
+                                    coord_atts=coord_atts,
+                                    global_atts=global_atts,
+                                    nc_format=nc_format )
+        journal = self.get_journal( job )
+        (slab_bytes, n_workers) = self.get_slab_settings( url )
+        slabs = bd.iter_pieces( pydap_grid, indices,
+                                target_bytes=slab_bytes,
+                                n_workers=n_workers,
+                                cache=self.cache, url=url,
+                                journal=journal,
+                                profiles=self.profiles,
+                                monitor=job['monitor'] )
+        k1 = 0
+        try:
+            for (var, maps) in slabs:
+                maps = list( maps )
+                if (len(indices) > 1) and (len(maps) > 0):
+                    maps[-1] = bi.unwrap_lons( maps[-1] )
+                k2 = k1 + var.shape[0]
+                writer.write_slab( k1, k2, var, maps )
+                k1 = k2
+        except BaseException:
+            slabs.close()
+            writer.close()
+            if (os.path.exists( part_path )):
+                os.remove( part_path )
+            self.report_interrupted_download( journal )
+            raise
+        slabs.close()
+        writer.close()
+        os.replace( part_path, path )
+        if (journal is not None):
+            journal.finish()
+
+        return self.get_netcdf_result( path, short_name, dims )
+
+    #   download_to_netcdf()
+    #--------------------------------------------------------------------
+    def download_to_chunk_store(self, job):
+
+        #---------------------------------------------------------
+        # Note: Saves the unpacked hyperslab in a chunk store
+        #       (see balto_io.py): a directory with one
+        #       compressed file per chunk, and a JSON file with
+        #       the coordinates and the attributes of the
+        #       variable.  Slabs are appended along time as they
+        #       arrive.  The result's var is the chunk_store,
+        #       which reads only the chunks needed.
+        #---------------------------------------------------------
+        short_name = job['short_name']
+        dataset    = job['dataset']
+        pydap_grid = dataset[ short_name ]
+        dims = list( pydap_grid.dimensions )
+        path = self.get_output_path( job, '.chunks' )
+        (out_shape, out_dtype) = self.get_unpacked_shape( job )
+        chunks = bio.get_chunk_shape( out_shape, out_dtype.itemsize )
+
+        coord_atts = get_coord_attributes( dataset, dims )
+        kinds = [ get_dim_kind( dim, coord_atts.get( dim ) ) for dim in dims ]
+        #--------------------------------------------------
+        # Values are saved unpacked, so drop the packing
+        # attributes.  (missing_value is still valid.)
+        #--------------------------------------------------
+        atts = dict( [(k, v) for (k, v) in pydap_grid.attributes.items()
+                      if (k not in ['scale_factor', 'add_offset'])] )
+
+        msg1 = 'Downloading variable: ' + short_name + '...'
+        msg2 = 'Variable saved in:  ' + path
+        self.write_log( [msg1, msg2] )
+
+        store = None
+        lats  = None
+        lons  = None
+        journal = self.get_journal( job )
+        slabs = self.iter_download( job, journal=journal )
+        try:
+            for (times, lats, lons, var) in slabs:
+                #---------------------------------------------
+                # Slabs are appended along the first axis,
+                # so its coordinate is appended with them.
+                # The others are saved with the first slab.
+                #---------------------------------------------
+                values = {'time': times, 'lat': lats, 'lon': lons}
+                values = [ values.get( kind ) for kind in kinds ]
+                if (store is None):
+                    coords = dict()
+                    for (dim, dim_values) in zip(dims[1:], values[1:]):
+                        if (dim_values is not None):
+                            coords[ dim ] = dim_values
+                    store = bio.create_chunk_store( path,
+                                        (0,) + tuple(out_shape[1:]),
+                                        out_dtype, chunks, dims=dims,
+                                        attributes=atts,
+                                        coords=coords,
+                                        coord_attributes=coord_atts )
+                store.append( var, times=values[0] )
+        except Exception:
+            self.report_interrupted_download( journal )
+            raise
+        if (journal is not None):
+            journal.finish()
+
+        if (store is None):
+            self.write_log( 'Sorry, no data was downloaded.',
+                            level='warning' )
+            return {'var': None, 'times': None, 'lats': None,
+                    'lons': None, 'path': path}
+        coords = [ store.get_coords( dim ) for dim in dims ]
+        (times, lats, lons) = get_coords_from_maps( coords, dims, coord_atts )
+        return {'var': store, 'times': times, 'lats': lats, 'lons': lons,
+                'path': path}
+
+    #   download_to_chunk_store()
+    #--------------------------------------------------------------------
+    def download_to_memmap(self, job):
+
+        #---------------------------------------------------------
+        # Note: For a hyperslab bigger than max_memory_bytes,
+        #       the result's var is an np.memmap backed by a
+        #       file in scratch_dir, and each unpacked slab is
+        #       written into it as it arrives.  It is used just
+        #       like an array, and the OS keeps only the parts
+        #       in use in memory.  The caller removes the
+        #       scratch file when it is no longer needed, and
+        #       it is removed here if the download fails.
+        #---------------------------------------------------------
+        short_name = job['short_name']
+        (out_shape, out_dtype) = self.get_unpacked_shape( job )
+
+        scratch_dir = self.scratch_dir
+        if (scratch_dir is None):
+            scratch_dir = bc.get_default_cache_dir( 'scratch' )
+        os.makedirs( scratch_dir, exist_ok=True )
+        (fd, path) = tempfile.mkstemp( dir=scratch_dir, suffix='.dat',
+                                       prefix=short_name + '_' )
+        os.close( fd )
+
+        msg1 = 'Downloading variable: ' + short_name + '...'
+        msg2 = '   (memory-mapped to ' + path + ')'
+        self.write_log( [msg1, msg2] )
+
+        var_out   = None
+        times_out = None
+        lats = None
+        lons = None
+        k1 = 0
+        journal = self.get_journal( job )
+        slabs = self.iter_download( job, journal=journal )
+        try:
+            var_out = np.memmap( path, dtype=out_dtype, mode='w+',
+                                 shape=out_shape )
+            for (times, lats, lons, var) in slabs:
+                k2 = k1 + var.shape[0]
+                var_out[k1:k2] = var
+                if (times is not None):
+                    if (times_out is None):
+                        times_out = np.empty( out_shape[0], dtype=times.dtype )
+                    times_out[k1:k2] = times
+                k1 = k2
+        except BaseException:
+            slabs.close()
+            var_out = None   # (close the file before removing it)
+            if (os.path.exists( path )):
+                os.remove( path )
+            self.report_interrupted_download( journal )
+            raise
+        var_out.flush()
+        if (journal is not None):
+            journal.finish()
+        return {'var': var_out, 'times': times_out, 'lats': lats,
+                'lons': lons, 'scratch_file': path}
+
+    #   download_to_memmap()
+    #--------------------------------------------------------------------
+    def iter_download(self, job, journal=None):
+
+        #----------------------------------------------------
+        # Note: This is a generator that yields the
+        #       hyperslab one time slab at a time, as
+        #       (times, lats, lons, slab).  Each slab is
+        #       unpacked into a regular array, even if
+        #       use_packed_array is True.
+        #----------------------------------------------------
+        pydap_grid = job['dataset'][ job['short_name'] ]
+        indices    = list( job['indices'] )
+        url        = job['url']
+        atts = pydap_grid.attributes
+        dims = pydap_grid.dimensions
+        coord_atts = get_coord_attributes( job['dataset'], dims )
+
+        self.set_cache_validator( url )
+        (slab_bytes, n_workers) = self.get_slab_settings( url )
+        slabs = bd.iter_pieces( pydap_grid, indices,
+                                target_bytes=slab_bytes,
+                                n_workers=n_workers,
+                                cache=self.cache, url=url,
+                                journal=journal,
+                                profiles=self.profiles,
+                                monitor=job['monitor'] )
+        try:
+            for (var, maps) in slabs:
+                (times, lats, lons) = get_coords_from_maps( maps, dims,
+                                                            coord_atts )
+                if (len(indices) > 1) and (lons is not None):
+                    lons = bi.unwrap_lons( lons )
+                var = self.get_user_var( var, atts, PACKED=False )
+                yield (times, lats, lons, var)
+        finally:
+            slabs.close()
+
+    #   iter_download()
+    #--------------------------------------------------------------------
+    def get_netcdf_result(self, path, short_name, dims):
+
+        #----------------------------------------------
+        # Open the file, and read coordinates (small)
+        #----------------------------------------------
+        nc_file = bio.open_netcdf( path )
+        coords  = list()
+        coord_atts = dict()
+        for dim in dims:
+            if (dim not in nc_file.variables):
+                coords.append( None )
+                continue
+            nc_var = nc_file[ dim ]
+            coords.append( nc_var[:] )
+            coord_atts[ dim ] = dict( [(name, nc_var.getncattr( name ))
+                                       for name in nc_var.ncattrs()] )
+        (times, lats, lons) = get_coords_from_maps( coords, dims, coord_atts )
+        return {'var': nc_file[ short_name ], 'times': times,
+                'lats': lats, 'lons': lons, 'path': path, 'file': nc_file}
+
+    #   get_netcdf_result()
+    #--------------------------------------------------------------------
+    def save_netcdf(self, job, short_name, var, maps, nc_format):
+
+        #---------------------------------------------------------
+        # Note: Write a whole downloaded (still packed) array to
+        #       a netCDF file, for download_aggregate() and
+        #       download_variables().  maps holds a coordinate
+        #       array (or None) for each dimension.  As in
+        #       download_to_netcdf(), a ".part" file is renamed
+        #       when it is complete.  Returns the result dict.
+        #---------------------------------------------------------
+        dataset    = job['dataset']
+        pydap_grid = dataset[ short_name ]
+        dims = pydap_grid.dimensions
+        path = self.get_output_path( job, '.nc', short_name=short_name )
+        part_path = path + '.part'
+        coord_atts = get_coord_attributes( dataset, dims )
+        global_atts = dataset.attributes.get('NC_GLOBAL', dict())
+        maps = [ (np.arange(n) if (m is None) else m)
+                 for (m, n) in zip(maps, var.shape) ]
+        writer = bio.netcdf_writer( part_path, short_name, dims, var.shape,
+                                    pydap_grid.dtype,
+                                    atts=pydap_grid.attributes,
+                                    coord_atts=coord_atts,
+                                    global_atts=global_atts,
+                                    nc_format=nc_format )
+        try:
+            writer.write_slab( 0, var.shape[0], var, maps )
+        except BaseException:
+            writer.close()
+            if (os.path.exists( part_path )):
+                os.remove( part_path )
+            raise
+        writer.close()
+        os.replace( part_path, path )
+        self.write_log( 'Variable saved in:  ' + path )
+        return self.get_netcdf_result( path, short_name, dims )
+
+    #   save_netcdf()
+    #--------------------------------------------------------------------
+    def download_aggregate(self, job):
+
+        #---------------------------------------------------------
+        # Note: Some products, like GPM IMERG, store one time
+        #       step per file.  This fetches the same spatial
+        #       subset of a variable from each of job['urls'],
+        #       with a bounded pool of threads, and joins them
+        #       into one time-ordered array.  job['url'] is the
+        #       file of job['dataset'], which is used as the
+        #       template for the others (see open_like()).
+        #       For a time stride, see get_aggregate_indices().
+        #---------------------------------------------------------
+        short_name   = job['short_name']
+        template_url = job['url']
+        pydap_grid   = job['dataset'][ short_name ]
+        if (len( pydap_grid.dimensions ) != 3):
+            raise ValueError( 'Can only aggregate variables with ' +
+                              'dimensions (time, lat, lon).' )
+        (urls, indices) = get_aggregate_indices( pydap_grid.shape,
+                                                 job['urls'], job['indices'] )
+
+        msg1 = 'Downloading variable: ' + short_name
+        msg2 = '   from ' + str(len(urls)) + ' files...'
+        self.write_log( [msg1, msg2] )
+
+        def open_func( url ):
+            if (url == template_url):
+                return job['dataset']
+            #----------------------------------------------
+            # open_like() assumes that the file has the
+            # same structure as the template.  If its
+            # lat/lon grid differs, ask the server.
+            #----------------------------------------------
+            dataset = self.open_like( url, template_url )
+            if (short_name not in dataset.keys()) or \
+               (dataset[ short_name ].shape[1:] != pydap_grid.shape[1:]):
+                dataset = self.open_dataset( url )
+                if (short_name not in dataset.keys()) or \
+                   (dataset[ short_name ].shape[1:] != pydap_grid.shape[1:]):
+                    raise ValueError( 'The lat/lon grid of ' + url +
+                                      ' is not the same as in ' +
+                                      template_url + '.' )
+            self.set_cache_validator( url )
+            return dataset
+
+        n_workers = self.get_slab_settings( template_url )[1]
+        (var, maps) = bd.download_files( urls, short_name, indices,
+                                         open_func,
+                                         n_workers=n_workers,
+                                         cache=self.cache,
+                                         profiles=self.profiles,
+                                         monitor=job['monitor'] )
+        maps = list( maps )
+        if (len(indices) > 1) and (len(maps) > 0):
+            maps[-1] = bi.unwrap_lons( maps[-1] )
+
+        nc_format = bio.get_nc_format( job['format'] )
+        if (nc_format is not None):
+            return self.save_netcdf( job, short_name, var, maps, nc_format )
+        dims = pydap_grid.dimensions
+        coord_atts = get_coord_attributes( job['dataset'], dims )
+        (times, lats, lons) = get_coords_from_maps( maps, dims, coord_atts )
+        var = self.get_user_var( var, pydap_grid.attributes )
+        return {'var': var, 'times': times, 'lats': lats, 'lons': lons}
+
+    #   download_aggregate()
+    #--------------------------------------------------------------------
+    def download_variables(self, job):
+
+        #---------------------------------------------------------
+        # Note: Downloads the same hyperslab of several
+        #       variables (job['var_names']) from one file.  It
+        #       is split into time slabs, as for one variable,
+        #       and each slab is one DAP request for all of the
+        #       variables (see bd.download_hyperslabs()).  The
+        #       variables must have the same dimensions.  The
+        #       coordinates, shared by all of them, are cut from
+        #       the cached coordinate arrays, so they are not
+        #       downloaded again.
+        #---------------------------------------------------------
+        # The result's "vars" is a dictionary with each
+        # variable, keyed by short name, and "var" is the
+        # first one.  For a netCDF format, each variable is
+        # saved in its own file ("paths").
+        #---------------------------------------------------------
+        url        = job['url']
+        dataset    = job['dataset']
+        short_name = job['short_name']
+        var_names  = list( job['var_names'] )
+        indices    = list( job['indices'] )
+        dims = dataset[ short_name ].dimensions
+        bad_names = [ name for name in var_names
+                      if (dataset[ name ].dimensions != dims) ]
+        if (len(bad_names) > 0):
+            raise ValueError( 'These variables do not have the dimensions ' +
+                              str(dims) + ': ' + ', '.join( bad_names ) )
+
+        pydap_grid = dataset[ short_name ]
+        grid_names = [ name for name in var_names
+                       if hasattr( dataset[ name ], 'maps' ) ]
+        msg = 'Downloading variables: ' + ', '.join( var_names ) + '...'
+        self.write_log( msg )
+        (slab_bytes, n_workers) = self.get_slab_settings( url )
+        results = list()
+        for index in indices:
+            arrays = bd.download_hyperslabs( url, pydap_grid, var_names,
+                                             index, grid_names=grid_names,
+                                             target_bytes=slab_bytes,
+                                             n_workers=n_workers,
+                                             timeout=self.timeout_secs,
+                                             monitor=job['monitor'] )
+            results.append( arrays )
+
+        #---------------------------------------------
+        # Cut the coordinates from the cached arrays
+        #---------------------------------------------
+        coords = list()
+        for (k, dim) in enumerate(dims):
+            if (dim not in dataset.keys()):
+                coords.append( None )
+                continue
+            values = self.get_coord_array( url, dataset, dim )
+            coords.append( np.concatenate( [values[ index[k] ]
+                                            for index in indices] ) )
+        if (len(indices) > 1) and (len(coords) > 0) and \
+           (coords[-1] is not None):
+            coords[-1] = bi.unwrap_lons( coords[-1] )
+
+        nc_format = bio.get_nc_format( job['format'] )
+        user_vars = dict()
+        paths     = dict()
+        files     = list()
+        for name in var_names:
+            var = np.concatenate( [r[ name ] for r in results], axis=-1 )
+            if (nc_format is not None):
+                result = self.save_netcdf( job, name, var, coords, nc_format )
+                user_vars[ name ] = result['var']
+                paths[ name ] = result['path']
+                files.append( result['file'] )
+            else:
+                atts = dataset[ name ].attributes
+                user_vars[ name ] = self.get_user_var( var, atts )
+        coord_atts = get_coord_attributes( dataset, dims )
+        (times, lats, lons) = get_coords_from_maps( coords, dims, coord_atts )
+        result = {'var': user_vars[ var_names[0] ], 'vars': user_vars,
+                  'times': times, 'lats': lats, 'lons': lons}
+        if (nc_format is not None):
+            result['path']  = paths[ var_names[0] ]
+            result['paths'] = paths
+            result['file']  = files[0]
+            result['files'] = files
+        return result
+
+    #   download_variables()
+#------------------------------------------------------------------------
+def print_log( msg, level='info' ):
+
+    if not(isinstance( msg, list )):
+        msg = [ msg ]
+    for string in msg:
+        if (level != 'info'):
+            string = level.upper() + ': ' + string
+        print( string )
+
+#   print_log()
+#------------------------------------------------------------------------
+def main( argv=None ):
+
+    #---------------------------------------------------------
+    # Note: Runs the request specs in one or more JSON spec
+    #       files, one after another.  Returns 0 if all of
+    #       them worked, else 1.  For example:
+    #          python -m balto_gui sst_pacific.json
+    #       with sst_pacific.json:
+    #          {"url": "http://.../sst.mnmean.nc",
+    #           "var_name": "sst",
+    #           "bbox": [160, -10, -120, 10],
+    #           "start": "2000-01-01", "end": "2009-12-31",
+    #           "strides": [1, 2, 2], "format": "netCDF4"}
+    #---------------------------------------------------------
+    parser = argparse.ArgumentParser( prog='python -m balto_gui',
+                 description='Download subsets of OpenDAP variables.' )
+    parser.add_argument( 'spec_files', nargs='+',
+                         help='JSON files with request specs' )
+    parser.add_argument( '--workers', type=int, default=4,
+                         help='threads per download (default 4)' )
+    parser.add_argument( '--timeout', type=float, default=60,
+                         help='seconds per request (default 60)' )
+    parser.add_argument( '--cache', action='store_true',
+                         help='use the on-disk response cache' )
+    parser.add_argument( '--no-journal', action='store_true',
+                         help='do not save slabs to resume downloads' )
+    parser.add_argument( '--quiet', action='store_true',
+                         help='only print errors' )
+    args = parser.parse_args( argv )
+
+    def log( msg, level='info' ):
+        if not(args.quiet) or (level == 'error'):
+            print_log( msg, level )
+
+    engine = download_engine( timeout_secs=args.timeout,
+                              n_workers=args.workers,
+                              cache=(bc.response_cache() if (args.cache)
+                                     else None),
+                              use_journal=not(args.no_journal),
+                              log=log )
+    n_failed = 0
+    for spec_file in args.spec_files:
+        try:
+            specs = load_request_specs( spec_file )
+        except (OSError, ValueError) as err:
+            log( 'Sorry, could not read ' + spec_file + ': ' + str(err),
+                 level='error' )
+            n_failed += 1
+            continue
+        for spec in specs:
+            if (spec['format'] == 'In memory'):
+                log( 'Sorry, "In memory" is not a file format.',
+                     level='error' )
+                n_failed += 1
+                continue
+            #----------------------------------------------
+            # Count the network calls of each request,
+            # including opening the file, in its monitor
+            #----------------------------------------------
+            monitor = bd.download_monitor()
+            old_counters = br.set_job_counters( monitor.counters )
+            try:
+                result = engine.run_request( spec, monitor=monitor )
+            except Exception as err:
+                log( 'Sorry, the download failed: ' + repr(err),
+                     level='error' )
+                n_failed += 1
+                continue
+            finally:
+                br.set_job_counters( old_counters )
+            for nc_file in result.get('files', [result.get('file')]):
+                if (nc_file is not None):
+                    nc_file.close()
+            counters = monitor.counters.get()
+            paths = result.get('paths', {'': result.get('path')})
+            log( ['Done:  ' + ', '.join( [str(p) for p in paths.values()] ),
+                  'Network requests = ' + str(counters['n_calls']) +
+                  ', retries = ' + str(counters['n_retries']), ' '] )
+    return (1 if (n_failed > 0) else 0)
+
+#   main()
+#------------------------------------------------------------------------
+if (__name__ == '__main__'):
+    sys.exit( main() )
+
@@ -11,9 +11,23 @@ included in the same directory as the Jupyter notebook.
 #  Copyright (C) 2020-2022.  Scott D. Peckham
 #
 #------------------------------------------------------------------------
-
-from ipyleaflet import Map, basemaps, FullScreenControl
-from ipyleaflet import MeasureControl, Rectangle
+#  Run download request specs without the GUI, e.g.
+#     python -m balto_gui spec1.json spec2.json
+#  This comes before the widget imports below, so it also works on
+#  machines (e.g. compute nodes) without ipywidgets.  (See the
+#  main() function in balto_engine.py.)
+#------------------------------------------------------------------------
+if (__name__ == '__main__'):
+    import sys
+    import balto_engine as be
+    sys.exit( be.main() )
+
+#------------------------------------------------------------------
+# ipyleaflet, pydap and requests are slow to import, and are not
+# needed by every session (e.g. batch jobs never show the map),
+# so they are imported by the methods that use them.  The map
+# itself is created the first time its panel is shown.
+#------------------------------------------------------------------
 ## from ipyleaflet import ScaleControl  # (doesn't work)
 from traitlets import Tuple
 ## import ipyleaflet as ipyl
@@ -24,13 +38,24 @@ from IPython.display import display, HTML
 ## from IPython.core.display import display
 ## from IPython.lib.display import display
 
-import pydap.client  # (for open_url, etc.)
-import requests      # (used by get_filenames() )
 import json
+import fnmatch
+import os
+import subprocess
+import sys
+import time
+import threading
 import datetime      # (used by get_duration() )
 import copy
 import numpy as np
 import balto_plot as bp
+import balto_download as bd
+import balto_engine as be
+import balto_cache as bc
+import balto_io as bio
+import balto_log as bl
+import balto_retry as br
+import balto_unpack as bu
 
 #------------------------------------------------------------------------
 #
@@ -43,6 +68,8 @@ import balto_plot as bp
 #      make_data_panel()
 #      reset_data_panel()
 #      make_map_panel()
+#      make_map_window()
+#      show_panel()
 #      make_dates_panel()
 #      make_download_panel()
 #      make_prefs_panel()
@@ -56,8 +83,17 @@ import balto_plot as bp
 #      get_url_dir_filenames()
 #      update_filename_list()
 #      get_opendap_file_url()
+#      get_selected_file_url()
 #      open_dataset()
+#      get_dataset()
+#      get_metadata_cache()
+#      benchmark_open_dataset()
+#      benchmark_startup()
 #      update_data_panel()
+#      schedule_data_panel_update()
+#      cancel_data_panel_timer()
+#      run_data_panel_update()
+#      show_dataset_info()
 #      --------------------------
 #      update_var_info()
 #      get_all_var_shortnames()
@@ -94,17 +130,56 @@ import balto_plot as bp
 #      get_time_since_from_datetime()
 #      get_month_difference()
 #      -------------------------------
+#      get_coord_name()
+#      get_coord_array()
+#      get_coord_index()
+#      get_time_index()
 #      get_new_time_index_range()
 #      get_new_lat_index_range()
+#      get_new_lon_index_ranges()
 #      get_new_lon_index_range()
 #      -------------------------------
 #      get_duration()  ## not used yet
 #      ----------------------------
 #      get_download_format()
+#      get_download_strides()
 #      clear_download_log()
 #      append_download_log()
+#      export_download_log()
 #      print_user_choices()
+#      get_download_indices()
+#      get_lon_slices()
+#      get_download_index()
+#      unpack_var()
+#      get_user_var()
 #      download_data()
+#      start_download_job()
+#      get_engine()
+#      get_download_snapshot()
+#      run_download_job()
+#      set_user_var()
+#      get_download_job()
+#      get_download_dataset()
+#      get_download_url()
+#      get_download_monitor()
+#      is_downloading()
+#      wait_for_download()
+#      cancel_download()
+#      show_download_progress()
+#      report_retry_counters()
+#      report_download_size()
+#      get_download_path()
+#      export_geotiff()
+#      remove_scratch_file()
+#      download_aggregate()
+#      download_variables()
+#      get_coords_from_maps()
+#      iter_download()
+#      get_data_cache()
+#      get_host_profiles()
+#      get_slab_settings()
+#      get_cache_info()
+#      clear_cache()
 #      show_grid()
 #      -------------------------------
 #      get_opendap_package()    # (in prefs panel)
@@ -126,9 +201,109 @@ class balto_gui:
 
         self.version  = '0.5'
         self.user_var = None
+        self.user_vars = dict()
         self.default_url_dir = 'http://test.opendap.org/dap/data/nc/'
         self.timeout_secs = 60  # (seconds)
         #----------------------------------------------------------
+        # Settings for the parallel download engine.  Big
+        # hyperslabs are split along the time axis into slabs
+        # of about slab_target_bytes, fetched by n_workers.
+        #----------------------------------------------------------
+        self.use_parallel_download = True
+        self.slab_target_bytes     = 16000000   # (bytes)
+        self.n_workers             = 4
+        #----------------------------------------------------------
+        # Latency, throughput and failures are measured for each
+        # server and kept in ~/.balto_cache/hosts.json.  Slab
+        # size and n_workers then adapt to each server, starting
+        # from the two settings above.
+        #----------------------------------------------------------
+        self.use_host_profiles     = True
+        self.host_profiles         = None
+        #----------------------------------------------------------
+        # Settings for the on-disk cache of downloaded data.
+        # Requests for the same file, variable and hyperslab
+        # are then read from local disk.  (See balto_cache.py.)
+        #----------------------------------------------------------
+        self.use_cache       = True
+        self.cache_dir       = None        # (default: ~/.balto_cache)
+        self.cache_max_bytes = 2000000000  # (bytes)
+        self.data_cache      = None
+        #----------------------------------------------------------
+        # Dataset metadata (DDS and DAS) is cached on disk, too,
+        # and is revalidated with the server (Last-Modified and
+        # ETag) when older than metadata_max_age seconds.
+        #----------------------------------------------------------
+        self.use_metadata_cache = True
+        self.metadata_max_age   = 86400      # (seconds)
+        self.metadata_cache     = None
+        #----------------------------------------------------------
+        # Coordinate arrays (time, lat, lon), keyed by file URL
+        #----------------------------------------------------------
+        self.coord_cache = dict()
+        self.index_cache = dict()
+        #----------------------------------------------------------
+        # Downloads are done by one download_engine, created
+        # when first needed.  (See get_engine().)
+        #----------------------------------------------------------
+        self.engine = None
+        #----------------------------------------------------------
+        # Files written for the netCDF download formats go here
+        #----------------------------------------------------------
+        self.download_dir = '.'
+        #----------------------------------------------------------
+        # Downloads bigger than max_memory_bytes (after unpacking)
+        # are stored in an np.memmap backed by a scratch file.
+        #----------------------------------------------------------
+        self.max_memory_bytes = 2000000000   # (bytes)
+        #----------------------------------------------------------
+        # Packed values are unpacked to unpack_dtype.  Missing
+        # values are restored ('restore'), set to NaN ('nan')
+        # or masked ('mask').  (See balto_unpack.py.)
+        #----------------------------------------------------------
+        self.unpack_dtype = 'float32'
+        self.missing_mode = 'restore'
+        #----------------------------------------------------------
+        # If True, in-memory downloads keep the packed values
+        # (e.g. int16) in a balto_unpack.packed_array, which
+        # unpacks only the parts that are indexed.
+        #----------------------------------------------------------
+        self.use_packed_array = False
+        #----------------------------------------------------------
+        # The Download button starts the download in a thread,
+        # so the notebook can be used while it runs.  (Use
+        # balto.wait_for_download() before using the result.)
+        #----------------------------------------------------------
+        self.download_in_background = True
+        self.download_thread  = None
+        self.download_monitor = None
+        self.download_job     = threading.local()
+        #----------------------------------------------------------
+        # A new filename is opened after data_panel_delay secs,
+        # if it is still selected.  (0 = open it at once.)
+        #----------------------------------------------------------
+        self.data_panel_delay      = 0.3   # (seconds)
+        self.data_panel_timer      = None
+        self.data_panel_pending    = None
+        self.data_panel_shown      = None
+        self.data_panel_generation = 0
+        self.data_panel_lock       = threading.RLock()
+        #----------------------------------------------------------
+        # The download log and datetime notes keep the last
+        # log_max_lines lines, and are redrawn at most once
+        # every log_min_interval secs.  (See balto_log.py.)
+        #----------------------------------------------------------
+        self.log_max_lines    = 1000
+        self.log_min_interval = 0.2   # (seconds)
+        #----------------------------------------------------------
+        # Completed slabs are saved in a journal, so that a
+        # failed download can be resumed.  (See balto_cache.py.)
+        #----------------------------------------------------------
+        self.use_journal = True
+        self.journal_dir = None   # (default: ~/.balto_cache/journal)
+        self.scratch_dir      = None   # (default: ~/.balto_cache/scratch)
+        self.scratch_file     = None
+        #----------------------------------------------------------
         # "full_box_width" = (label_width + widget_width)
         # gui_width = left_label_width + mid_width + button_width 
         # The 2nd, label + widget box, is referred to as "next".
@@ -238,6 +413,7 @@ class balto_gui:
         acc.set_title(2, p2_title)
         acc.set_title(3, p3_title)
         acc.set_title(4, p4_title)
+        acc.observe( self.show_panel, names='selected_index' )
 
         # title  = 'BALTO User Interface'
         # L_tags = "<b><font size=5>"
@@ -289,6 +465,7 @@ class balto_gui:
         tab.set_title(2, p2_title)
         tab.set_title(3, p3_title)
         tab.set_title(4, p4_title)
+        tab.observe( self.show_panel, names='selected_index' )
         #### tab.titles = [str(i) for i in range(len(children))]
         
         # title  = 'BALTO User Interface'
@@ -406,7 +583,8 @@ class balto_gui:
         #------------------------------------------------------------
         b1.on_click( self.update_filename_list )
         b2.on_click( self.reset_data_panel )
-        o2.observe( self.update_data_panel, names=['options','value'] )
+        o2.observe( self.schedule_data_panel_update,
+                    names=['options','value'] )
         o3.observe( self.update_var_info, names=['options', 'value'] )
         ## o3.observe( self.update_var_info, names='value' )
         ## o2.observe( self.update_data_panel, names='All' )
@@ -434,6 +612,14 @@ class balto_gui:
         # In this case, type(caller_obj) =
         # <class 'ipywidgets.widgets.widget_button.Button'>
         #----------------------------------------------------
+        # A file that is waiting to be opened (see
+        # schedule_data_panel_update()) is dropped first,
+        # so it doesn't fill the panel after the reset.
+        #----------------------------------------------------
+        with self.data_panel_lock:
+            self.cancel_data_panel_timer()
+            self.data_panel_pending = None
+            self.data_panel_shown   = None
         if not(KEEP_DIR):
             self.data_url_dir.value = self.default_url_dir
         self.data_filename.options    = ['']
@@ -446,49 +632,18 @@ class balto_gui:
         self.data_var_atts.options    = ['']
         self.data_status.value        = 'Ready.'   
         #------------------------------------------
-        self.download_log.value = ''
+        self.clear_download_log()
 
     #   reset_data_panel() 
     #--------------------------------------------------------------------    
     def make_map_panel(self, SHOW_MAP=True):
 
-        map_width_px  = self.map_width_px
-        map_height_px = self.map_height_px
         btn_width_px  = self.pix_str( self.button_width )
         #--------------------------------------------------
         # bm_style   = {'description_width': '70px'}  # for top
         bbox_style = {'description_width': '100px'}
         bbox_width_px = '260px'
   
-        #---------------------------------------        
-        # Create the map width with ipyleaflet
-        # Center lat 20 looks better than 0.
-        #---------------------------------------
-        map_center = self.map_center_init    # (lat, lon)                
-        m = Map(center=map_center, zoom=1,
-             layout=Layout(width=map_width_px, height=map_height_px))
-
-        #----------------------                
-        # Add more controls ?
-        #----------------------
-        if (self.add_fullscreen_control):
-            m.add_control( FullScreenControl( position='topright' ) )
-        #---------------------------------------------------------
-        # Cannot be imported. (2020-05-18)
-        # if (self.add_scale_control):
-        #     m.add_control(ScaleControl( position='bottomleft' ))
-        #---------------------------------------------------------
-        if (self.add_measure_control):      
-            measure = MeasureControl( position='bottomright',
-                active_color = 'orange',
-                primary_length_unit = 'kilometers')
-            m.add_control(measure)
-            measure.completed_color = 'red'
-            ## measure.add_length_unit('yards', 1.09361, 4)
-            ## measure.secondary_length_unit = 'yards'
-            ## measure.add_area_unit('sqyards', 1.19599, 4)
-            ## measure.secondary_area_unit = 'sqyards'
-                        
         #-----------------------------------------------------
         # Does "step=0.01" restrict accuracy of selection ??
         #-----------------------------------------------------
@@ -548,12 +703,13 @@ class balto_gui:
         # prevented any part of the GUI from being displayed.
         # The SHOW_MAP flag helps to test for this problem.
         #------------------------------------------------------
-        if (SHOW_MAP):
-            panel = widgets.VBox( [m, bbox, bm] )
-        else:
-            panel = widgets.VBox( [bbox, bm] )
+        # The map is added by make_map_window(), when
+        # the panel is first shown.
+        #------------------------------------------------------
+        panel = widgets.VBox( [bbox, bm] )
                 
-        self.map_window  = m
+        self.show_map    = SHOW_MAP
+        self.map_window  = None
         self.map_minlon  = w1
         self.map_maxlon  = w2
         self.map_maxlat  = w3
@@ -567,14 +723,83 @@ class balto_gui:
         # Event handlers
         #-----------------
         bm.observe( self.change_base_map, names=['options','value'] )
-        m.on_interaction( self.replace_map_bounds )
-        m.observe( self.zoom_out_to_new_bounds, 'bounds' )
-        m.new_bounds = None  # (used for "zoom to fit")
         b1.on_click( self.update_map_bounds )
         b2.on_click( self.reset_map_panel )
                                    
     #   make_map_panel()
     #-------------------------------------------------------------------- 
+    def make_map_window(self):
+
+        #-------------------------------------------------------
+        # Note: Creating the ipyleaflet map is slow, so this
+        #       is called when the map panel is first shown
+        #       (see show_panel()), not by make_map_panel().
+        #-------------------------------------------------------
+        if (self.map_window is not None) or not(self.show_map):
+            return self.map_window
+        from ipyleaflet import Map, FullScreenControl, MeasureControl
+
+        map_width_px  = self.map_width_px
+        map_height_px = self.map_height_px
+
+        #---------------------------------------        
+        # Create the map width with ipyleaflet
+        # Center lat 20 looks better than 0.
+        #---------------------------------------
+        map_center = self.map_center_init    # (lat, lon)                
+        m = Map(center=map_center, zoom=1,
+             layout=Layout(width=map_width_px, height=map_height_px))
+
+        #----------------------                
+        # Add more controls ?
+        #----------------------
+        if (self.add_fullscreen_control):
+            m.add_control( FullScreenControl( position='topright' ) )
+        #---------------------------------------------------------
+        # Cannot be imported. (2020-05-18)
+        # if (self.add_scale_control):
+        #     m.add_control(ScaleControl( position='bottomleft' ))
+        #---------------------------------------------------------
+        if (self.add_measure_control):      
+            measure = MeasureControl( position='bottomright',
+                active_color = 'orange',
+                primary_length_unit = 'kilometers')
+            m.add_control(measure)
+            measure.completed_color = 'red'
+            ## measure.add_length_unit('yards', 1.09361, 4)
+            ## measure.secondary_length_unit = 'yards'
+            ## measure.add_area_unit('sqyards', 1.19599, 4)
+            ## measure.secondary_area_unit = 'sqyards'
+
+        #-----------------
+        # Event handlers
+        #-----------------
+        m.on_interaction( self.replace_map_bounds )
+        m.observe( self.zoom_out_to_new_bounds, 'bounds' )
+        m.new_bounds = None  # (used for "zoom to fit")
+
+        self.map_window = m
+        self.map_panel.children = (m,) + tuple( self.map_panel.children )
+        if (self.map_basemap.value != self.map_basemap.options[0]):
+            self.change_base_map()
+        return m
+
+    #   make_map_window()
+    #--------------------------------------------------------------------
+    def show_panel(self, change=None):
+
+        #-----------------------------------------------------
+        # Note: Handler for the selected_index of the Tab
+        #       or Accordion.  Creates the map the first
+        #       time that the Spatial Extent panel is shown.
+        #-----------------------------------------------------
+        if (change is None) or (change['new'] is None):
+            return
+        if (change['owner'].children[ change['new'] ] is self.map_panel):
+            self.make_map_window()
+
+    #   show_panel()
+    #--------------------------------------------------------------------
     def get_basemap_list(self):
  
         basemap_list = [
@@ -604,6 +829,10 @@ class balto_gui:
         # self.map_window.basemap = basemaps.Esri.WorldStreetMap
         # Need to call clear_layers(), then add_layer().
         #---------------------------------------------------------
+        if (self.map_window is None):
+            return   # (set when the map is created)
+        from ipyleaflet import basemaps
+
         map_choice = self.map_basemap.value
         self.map_window.clear_layers()
         basemap_layer = eval( 'basemaps.' + map_choice )
@@ -623,8 +852,9 @@ class balto_gui:
     #--------------------------------------------------------------------  
     def reset_map_panel(self, caller_obj=None):
     
-        self.map_window.center = self.map_center_init
-        self.map_window.zoom   = 1
+        if (self.map_window is not None):
+            self.map_window.center = self.map_center_init
+            self.map_window.zoom   = 1
         self.map_minlon.value  = '-225.0'
         self.map_maxlon.value  = '225.0'
         self.map_minlat.value  = '-51.6'
@@ -695,6 +925,9 @@ class balto_gui:
         self.datetime_end_time   = d4
         self.datetime_attributes = d7
         self.datetime_notes      = d8
+        self.datetime_notes_sink = bl.log_sink( d8,
+                                       max_lines=self.log_max_lines,
+                                       min_interval=self.log_min_interval )
         self.datetime_panel      = panel
 
     #   make_datetime_panel()
@@ -703,12 +936,56 @@ class balto_gui:
       
         init_style = self.init_label_style
         f1 = widgets.Dropdown( description='Download Format:',
-                               options=['HDF', 'netCDF', 'netCDF4', 'ASCII'],
-                               value='netCDF',
+                               options=list( be.FORMATS ),
+                               value='In memory',
                                disabled=False, style=init_style)
         pad = widgets.HTML(value=f"<p> </p>")   # padding
         b3  = widgets.Button(description="Download")
-        h3  = widgets.HBox([f1, pad, b3])
+        b4  = widgets.Button(description="Download All Files")
+        h3  = widgets.HBox([f1, pad, b3, b4])
+
+        #-------------------------------------------------
+        # Strides for time, lat and lon, for quick-look
+        # downloads, e.g. stride 10 keeps every 10th one
+        # and is sent to the server as [start:10:stop].
+        #-------------------------------------------------
+        stride_layout = Layout(width='150px')
+        s1 = widgets.BoundedIntText( description='Stride: time',
+                               value=1, min=1, max=100000, step=1,
+                               disabled=False, style=init_style,
+                               layout=stride_layout )
+        s2 = widgets.BoundedIntText( description='lat',
+                               value=1, min=1, max=100000, step=1,
+                               disabled=False, style=init_style,
+                               layout=Layout(width='110px') )
+        s3 = widgets.BoundedIntText( description='lon',
+                               value=1, min=1, max=100000, step=1,
+                               disabled=False, style=init_style,
+                               layout=Layout(width='110px') )
+        h4  = widgets.HBox([s1, s2, s3])
+
+        #-------------------------------------------------
+        # Several variables can be downloaded together,
+        # with the same hyperslab, in a single request
+        #-------------------------------------------------
+        v1 = widgets.SelectMultiple( description='Variables:',
+                               options=[], rows=3, disabled=False,
+                               style=init_style,
+                               layout=Layout(width='300px') )
+        b5 = widgets.Button(description="Download Selected")
+        h5 = widgets.HBox([v1, pad, b5])
+
+        #-------------------------------------------------
+        # Progress, speed and ETA of a download, and a
+        # button to cancel it
+        #-------------------------------------------------
+        p1 = widgets.FloatProgress( value=0.0, min=0.0, max=1.0,
+                                    description='Progress:',
+                                    style=init_style,
+                                    layout=Layout(width='300px') )
+        p2 = widgets.Label( value='' )
+        b6 = widgets.Button(description="Cancel")
+        h6 = widgets.HBox([p1, p2, b6])
 
         #-----------------------------------
         # Could use this for info messages
@@ -723,17 +1000,32 @@ class balto_gui:
                       layout=Layout(width=width_px, height=height_px)) 
  
         ## panel = widgets.VBox([h3, status, log]) 
-        panel = widgets.VBox([h3, log])
+        panel = widgets.VBox([h3, h4, h5, h6, log])
         
         self.download_format = f1
+        self.download_stride_time = s1
+        self.download_stride_lat  = s2
+        self.download_stride_lon  = s3
         self.download_button = b3
+        self.download_all_button = b4
+        self.download_var_names  = v1
+        self.download_vars_button = b5
+        self.download_progress = p1
+        self.download_status   = p2
+        self.download_cancel_button = b6
         self.download_log    = log                   
+        self.download_log_sink = bl.log_sink( log,
+                                     max_lines=self.log_max_lines,
+                                     min_interval=self.log_min_interval )
         self.download_panel = panel
         
         #-----------------
         # Event handlers
         #-----------------
         b3.on_click( self.download_data )
+        b4.on_click( self.download_aggregate )
+        b5.on_click( self.download_variables )
+        b6.on_click( self.cancel_download )
         
     #   make_download_panel()
     #-------------------------------------------------------------------- 
@@ -781,7 +1073,7 @@ class balto_gui:
         #        ok to use it like this:
         # [minlon, minlat, maxlon, maxlat] = get_map_bounds().
         #-------------------------------------------------------
-        if (FROM_MAP):
+        if (FROM_MAP) and (self.map_window is not None):
             #------------------------------------      
             # Get the visible map bounds, after
             # interaction such as pan or zoom
@@ -871,6 +1163,8 @@ class balto_gui:
         # print('bb_minlon, bb_maxlon =', bb_minlon, bb_maxlon)
         # print('bb_minlat, bb_maxlat =', bb_minlat, bb_maxlat)
         #----------------------------------------------------------
+        if (self.make_map_window() is None):
+            return
         zoom = self.map_window.max_zoom  # (usually 18)
         self.map_window.center = bb_center        
         self.map_window.zoom   = zoom
@@ -972,7 +1266,8 @@ class balto_gui:
         # Construct a list of filenames that are
         # available in the opendap url directory
         #-----------------------------------------
-        r = requests.get( self.data_url_dir.value )
+        r = br.http_get( self.data_url_dir.value,
+                         timeout=self.timeout_secs )
         lines = r.text.splitlines()
         # n_lines = len(lines)
         filenames = list()
@@ -991,6 +1286,7 @@ class balto_gui:
         # Construct a list of filenames that are
         # available in the opendap url directory
         #-----------------------------------------
+        import requests
         r = requests.get( self.data_url_dir.value )
         lines = r.text.splitlines()
         # n_lines = len(lines)
@@ -1034,24 +1330,138 @@ class balto_gui:
     #--------------------------------------------------------------------
     def get_opendap_file_url(self):
   
+        self.opendap_file_url = self.get_selected_file_url()
+
+    #   get_opendap_file_url()
+    #--------------------------------------------------------------------
+    def get_selected_file_url(self):
+
         directory = self.data_url_dir.value
         if (directory[-1] != '/'):
             directory += '/'
         #------------------------------------
         filename = self.data_filename.value
-        self.opendap_file_url = (directory + filename)
+        return (directory + filename)
+
+    #   get_selected_file_url()
 
-    #   get_opendap_file_url()
     #--------------------------------------------------------------------
     def open_dataset(self):
 
+        self.dataset = self.get_dataset( self.opendap_file_url )
+
+    #   open_dataset()
+    #--------------------------------------------------------------------
+    def get_dataset(self, opendap_url):
+
         timeout = self.timeout_secs
-        opendap_url = self.opendap_file_url
-        dataset = pydap.client.open_url( opendap_url, timeout=timeout )
+        cache = self.get_metadata_cache()
+        if (cache is not None):
+            #----------------------------------------------
+            # Build dataset from cached DDS and DAS, with
+            # no network round-trip if still fresh.
+            #----------------------------------------------
+            dataset = cache.open_url( opendap_url, timeout=timeout )
+        else:
+            import pydap.client
+            dataset = br.default_policy.call( pydap.client.open_url,
+                                              opendap_url, timeout=timeout )
+        return dataset
 
-        self.dataset = dataset
+    #   get_dataset()
+    #--------------------------------------------------------------------
+    def get_metadata_cache(self):
 
-    #   open_dataset()
+        if not(self.use_metadata_cache):
+            return None
+        if (self.metadata_cache is None):
+            self.metadata_cache = bc.metadata_cache(
+                                      max_age=self.metadata_max_age,
+                                      log=self.append_download_log )
+        return self.metadata_cache
+
+    #   get_metadata_cache()
+    #--------------------------------------------------------------------
+    def benchmark_open_dataset(self, opendap_url=None, n_warm=5,
+                               REPORT=True):
+
+        #-----------------------------------------------------
+        # Compare time to open a dataset with pydap, with
+        # a cold metadata cache, and with a warm one.
+        # Returns the timings, and if REPORT, also shows
+        # them in the download log.
+        #-----------------------------------------------------
+        if (opendap_url is None):
+            opendap_url = self.opendap_file_url
+        cache = bc.metadata_cache( max_age=self.metadata_max_age )
+        result = bc.benchmark_open_dataset( opendap_url, cache=cache,
+                                            timeout=self.timeout_secs,
+                                            n_warm=n_warm )
+        if (REPORT):
+            msgs = ['url         = ' + result['url'],
+                    'pydap open  = ' + str(result['pydap_secs']) + ' (secs)',
+                    'cold cache  = ' + str(result['cold_secs']) + ' (secs)',
+                    'warm cache  = ' + str(result['warm_secs']) + ' (secs)']
+            self.append_download_log( msgs + [' '] )
+        return result
+
+    #   benchmark_open_dataset()
+    #--------------------------------------------------------------------
+    def benchmark_startup(self, modules=None, REPORT=True):
+
+        #---------------------------------------------------------
+        # Note: Measures the startup costs, in seconds:
+        #         import_secs = import balto_gui, in a new Python
+        #         module_secs = import each of the heavy modules,
+        #                       each in a new Python (or None)
+        #         gui_secs    = create the GUI widgets
+        #         map_secs    = create the map, when its panel
+        #                       is first shown
+        #       The time for the browser to draw the widgets
+        #       can't be measured from here.  Returns the
+        #       timings, and if REPORT, also shows them in the
+        #       download log.
+        #---------------------------------------------------------
+        if (modules is None):
+            modules = ['ipywidgets', 'ipyleaflet', 'pydap.client',
+                       'requests', 'matplotlib.pyplot', 'cartopy.crs']
+        src_dir = os.path.dirname( os.path.abspath( __file__ ) )
+        def get_import_secs( name ):
+            code  = 'import time; start = time.time(); '
+            code += 'import ' + name + '; print(time.time() - start)'
+            proc = subprocess.run( [sys.executable, '-c', code],
+                                   cwd=src_dir, capture_output=True,
+                                   text=True )
+            if (proc.returncode != 0):
+                return None
+            return float( proc.stdout.strip().splitlines()[-1] )
+
+        result = dict()
+        result['import_secs'] = get_import_secs( 'balto_gui' )
+        result['module_secs'] = dict( [(name, get_import_secs( name ))
+                                       for name in modules] )
+        gui = balto_gui()
+        start_time = time.time()
+        gui.make_tab_gui()
+        result['gui_secs'] = time.time() - start_time
+        start_time = time.time()
+        gui.make_map_window()
+        result['map_secs'] = time.time() - start_time
+
+        if (REPORT):
+            msgs = ['Import balto_gui   = ' + str(result['import_secs']) +
+                    ' [secs]']
+            for (name, secs) in result['module_secs'].items():
+                msgs.append( '   import ' + name + ' = ' + str(secs) +
+                             ' [secs]' )
+            msgs.append( 'Create GUI widgets = ' + str(result['gui_secs']) +
+                         ' [secs]' )
+            msgs.append( 'Create map         = ' + str(result['map_secs']) +
+                         ' [secs]' )
+            self.append_download_log( msgs + [' '] )
+        return result
+
+    #   benchmark_startup()
     #--------------------------------------------------------------------
     def update_data_panel(self, change=None):
 
@@ -1071,6 +1481,123 @@ class balto_gui:
   
         self.get_opendap_file_url()
         self.open_dataset()
+        self.data_panel_shown = self.opendap_file_url
+        self.show_dataset_info()
+
+    #   update_data_panel() 
+    #--------------------------------------------------------------------
+    def schedule_data_panel_update(self, change=None):
+
+        #-------------------------------------------------------
+        # Note: This is the handler for the filename Dropdown.
+        #       Setting its options and value, or scrolling
+        #       through it with the keyboard, calls it many
+        #       times, so the dataset is not opened at once.
+        #       Each call restarts a timer, and only the file
+        #       that is still selected after data_panel_delay
+        #       seconds is opened (in the timer's thread).
+        #       A call for the file that is already pending
+        #       or shown does nothing.  An open that is still
+        #       running when another file is selected can't
+        #       be stopped, but its result is dropped.
+        #-------------------------------------------------------
+        if (self.data_filename.value == ''):
+            with self.data_panel_lock:
+                self.cancel_data_panel_timer()
+                self.data_panel_pending = None
+                self.data_panel_shown   = None
+            return
+        url = self.get_selected_file_url()
+        if (self.data_panel_delay <= 0):
+            self.update_data_panel()
+            return
+
+        with self.data_panel_lock:
+            if (url == self.data_panel_pending):
+                return
+            if (self.data_panel_pending is None) and \
+               (url == self.data_panel_shown):
+                return
+            self.cancel_data_panel_timer()
+            self.data_panel_generation += 1
+            self.data_panel_pending = url
+            timer = threading.Timer( self.data_panel_delay,
+                                     self.run_data_panel_update,
+                                     args=(self.data_panel_generation, url) )
+            timer.daemon = True
+            self.data_panel_timer = timer
+        self.data_status.value = 'Waiting to open: ' + url
+        timer.start()
+
+    #   schedule_data_panel_update()
+    #--------------------------------------------------------------------
+    def cancel_data_panel_timer(self):
+
+        #------------------------------------------------
+        # Note: Call with data_panel_lock held.  Also
+        #       makes any open that is running stale.
+        #------------------------------------------------
+        if (self.data_panel_timer is not None):
+            self.data_panel_timer.cancel()
+            self.data_panel_timer = None
+        self.data_panel_generation += 1
+
+    #   cancel_data_panel_timer()
+    #--------------------------------------------------------------------
+    def run_data_panel_update(self, generation, url):
+
+        #---------------------------------------------------
+        # Open the dataset for a scheduled update, unless
+        # a newer selection was made in the meantime.
+        #---------------------------------------------------
+        # Note: The lock is not held during network
+        #       requests, so a new selection never waits
+        #       for an old one to open.  It is held from
+        #       the last check of generation through the
+        #       widget updates of show_dataset_info(), so a
+        #       stale open can't overwrite a newer file's
+        #       info, and a new selection or a reset waits
+        #       for the (short) updates to finish.  The
+        #       coordinates that the datetime panel needs
+        #       are fetched before this, so
+        #       show_dataset_info() finds them in the
+        #       coord_cache.
+        #---------------------------------------------------
+        with self.data_panel_lock:
+            if (generation != self.data_panel_generation):
+                return
+        self.data_status.value = 'Opening: ' + url
+        try:
+            dataset = self.get_dataset( url )
+            time_name = be.get_coord_name( list( dataset.keys() ), 'time' )
+            if (time_name is not None):
+                self.get_engine().get_coord_array( url, dataset, time_name )
+        except Exception as err:
+            with self.data_panel_lock:
+                if (generation == self.data_panel_generation):
+                    self.data_panel_pending = None
+                    msg = 'Sorry, could not open file: ' + repr(err)
+                    self.data_status.value = msg
+            return
+
+        with self.data_panel_lock:
+            if (generation != self.data_panel_generation):
+                return   # (stale)
+            self.data_panel_pending = None
+            self.data_panel_shown   = url
+            self.opendap_file_url = url
+            self.dataset = dataset
+            self.show_dataset_info()
+            self.data_status.value = 'Ready.'
+
+    #   run_data_panel_update()
+    #--------------------------------------------------------------------
+    def show_dataset_info(self):
+
+        #----------------------------------------------------
+        # Show the variables of self.dataset, and the info
+        # for the first one, in the data panel.
+        #----------------------------------------------------
         self.get_all_var_shortnames()
         self.get_all_var_longnames()
         self.get_all_var_units()
@@ -1090,6 +1617,8 @@ class balto_gui:
         #-------------------------------------------
         self.data_var_name.options = short_names
         self.data_var_name.value   = short_names[0]    
+        if (hasattr(self, 'download_var_names')):
+            self.download_var_names.options = short_names
 
         #------------------------------------
         # Show other info for this variable
@@ -1107,7 +1636,7 @@ class balto_gui:
         #-------------------------------------------
         self.update_datetime_panel()  # clears notes, too
                   
-    #   update_data_panel() 
+    #   show_dataset_info()
     #--------------------------------------------------------------------
     def update_var_info(self, change=None):
 
@@ -1190,6 +1719,13 @@ class balto_gui:
     #--------------------------------------------------------------------
     def get_var_shortname(self):
     
+        #--------------------------------------------------
+        # In a download thread, use the variable that was
+        # selected when the download started.
+        #--------------------------------------------------
+        job = self.get_download_job()
+        if (job is not None):
+            return job['short_name']
         short_name = self.data_var_name.value
         if (short_name == ''):
             pass
@@ -1346,13 +1882,10 @@ class balto_gui:
         #-----------------------------------------
         # Are there any times for this dataset ?
         #-----------------------------------------
-        short_names = self.var_short_names   # self.dataset.keys()
-        if ('time' in short_names):
-            self.time_obj = self.dataset.time
-            self.time_var = self.time_obj.data[:]
-        elif ('TIME' in short_names):
-            self.time_obj = self.dataset.TIME
-            self.time_var = self.time_obj.data[:]
+        time_name = self.get_coord_name( 'time' )
+        if (time_name is not None):
+            self.time_obj = self.dataset[ time_name ]
+            self.time_var = self.get_coord_array( time_name )
         else:
             msg = 'Unable to find times for this dataset.'
             self.append_datetime_notes( msg )
@@ -1447,8 +1980,17 @@ class balto_gui:
         #---------------------------------------------
         time_since1    = self.time_range[0]
         time_since2    = self.time_range[1]
-        start_datetime_obj = self.get_datetime_from_time_since(time_since1)
-        end_datetime_obj   = self.get_datetime_from_time_since(time_since2)
+        time_index     = self.get_time_index()
+        if (time_index is not None):
+            #---------------------------------------------
+            # This honors the calendar, e.g. noleap, and
+            # matches what get_new_time_index_range uses.
+            #---------------------------------------------
+            start_datetime_obj = time_index.get_datetime( time_since1 )
+            end_datetime_obj   = time_index.get_datetime( time_since2 )
+        else:
+            start_datetime_obj = self.get_datetime_from_time_since(time_since1)
+            end_datetime_obj   = self.get_datetime_from_time_since(time_since2)
         start_datetime_str = str(start_datetime_obj)
         end_datetime_str   = str(end_datetime_obj)
         (start_date, start_time) = self.split_datetime_str( start_datetime_str )
@@ -1515,13 +2057,13 @@ class balto_gui:
     #--------------------------------------------------------------------    
     def clear_datetime_notes(self):
 
-        self.datetime_notes.value = ''
+        self.datetime_notes_sink.clear()
 
     #   clear_datetime_notes()
     #--------------------------------------------------------------------    
-    def append_datetime_notes(self, msg):
+    def append_datetime_notes(self, msg, level='info'):
 
-        self.datetime_notes.value += (msg + '\n')
+        self.datetime_notes_sink.write( msg, level=level )
 
     #   append_datetime_notes()
     #--------------------------------------------------------------------
@@ -1916,6 +2458,60 @@ class balto_gui:
 
     #   get_month_difference()
     #--------------------------------------------------------------------    
+    def get_coord_name(self, kind):
+
+        #-------------------------------------------------
+        # Return the short name of the time, lat or lon
+        # variable for this dataset, or None.
+        #-------------------------------------------------
+        return be.get_coord_name( self.var_short_names, kind )
+
+    #   get_coord_name()
+    #--------------------------------------------------------------------
+    def get_coord_array(self, name):
+
+        #-----------------------------------------------------
+        # Coordinate arrays are cached for each dataset URL.
+        # The first time one is needed, all of the missing
+        # time, lat and lon arrays are fetched together in
+        # a single DAP request.  (See balto_engine.py.)
+        #-----------------------------------------------------
+        return self.get_engine().get_coord_array( self.opendap_file_url,
+                                                  self.dataset, name )
+
+    #   get_coord_array()
+    #--------------------------------------------------------------------
+    def get_coord_index(self, name):
+
+        #----------------------------------------------------
+        # Build a coord_index for a coordinate array once
+        # per dataset, and reuse it for every bounding box.
+        #----------------------------------------------------
+        return self.get_engine().get_coord_index( self.opendap_file_url,
+                                                  self.dataset, name )
+
+    #   get_coord_index()
+    #--------------------------------------------------------------------
+    def get_time_index(self):
+
+        #----------------------------------------------------
+        # Build a time_index for the time array once per
+        # dataset (see download_engine.get_time_index()).
+        # Returns None if the units or calendar are not
+        # supported, and says so in the datetime notes.
+        #----------------------------------------------------
+        time_name = self.get_coord_name( 'time' )
+        if (time_name is None):
+            return None
+        try:
+            return self.get_engine().get_time_index( self.opendap_file_url,
+                                                     self.dataset, time_name )
+        except ValueError as err:
+            self.append_datetime_notes( 'Sorry, ' + str(err) )
+            return None
+
+    #   get_time_index()
+    #--------------------------------------------------------------------
     def get_new_time_index_range(self, REPORT=True):
 
         if not(hasattr(self, 'origin_datetime_str')):
@@ -1923,86 +2519,32 @@ class balto_gui:
             self.append_download_log( [msg, ' '] )
             if (hasattr(self, 'time_var')):
                 nt = len(self.time_var)
-                return (0, nt - 1)  # (unrestricted by choices) 
+                return (0, nt)  # (unrestricted by choices) 
             else:
                 return (None, None)
 
-        #----------------------------------------------------
-        # Get min possible datetime, from time_vars.min().
-        # Every time_var value is measured from an "origin"
-        # such as: '1800-01-01 00:00:00'
-        #----------------------------------------------------
-        ## origin_datetime_obj = self.origin_datetime_obj
-        time_since_min   = self.time_var.min()
-        min_datetime_obj = self.get_datetime_from_time_since( time_since_min )
-        
         #-----------------------------------------------        
         # Get current settings from the datetime panel
         #-----------------------------------------------
         start_datetime_obj = self.get_start_datetime_obj()
         end_datetime_obj   = self.get_end_datetime_obj()
+        nt = len( self.time_var )
+        if (start_datetime_obj is None) or (end_datetime_obj is None):
+            return (0, nt)  # (unrestricted by choices)
 
-        #---------------------------------------------------     
-        # Convert dt datetime string to "timedelta" object
-        # e.g. 00-01-00 00:00:00
-        #---------------------------------------------------
-        # Note: datetime.timedelta() does not do "months",
-        #       since they're not a fixed number of days,
-        #       so we use "get_month_difference()".  Also
-        #       it does not have a "years" argument.
-        #---------------------------------------------------
-        ## print('In get_new_time_index_range():')
-        ## print('self.time_delta =', self.time_delta)
-        USE_LOOPS = True
-        (y,m1,d,h,m2,s) = self.split_datetime_str(self.time_delta, ALL=True)
-        ## print('time_delta =', self.time_delta )
-        ## print('y, m1, d, h, m2, s =', y, m1, d, h, m2, s )
-        if (m1 == 0):
-            d = (y*365) + d   # python int(), not 2-byte int.
-            # print('days =', d)
-            dt_timedelta_obj = datetime.timedelta(days=d, hours=h, minutes=m2, seconds=s)
-        elif (m1 > 0 and (y+d+h+m2+s == 0)):
-            n_months1 = self.get_month_difference( min_datetime_obj, start_datetime_obj  )
-            n_months2 = self.get_month_difference( min_datetime_obj, end_datetime_obj  )
-            start_index = int(n_months1 / m1)
-            end_index   = int(n_months2 / m1)
-            USE_LOOPS   = False
-        else:
-            # Note: I think there is a "monthdelta" package ?
-            #       Or we may be able to use dateutils.
-            print('ERROR: Cannot handle this dt case yet.')
-            return None
-
-        #-------------------------------------------------        
+        #-------------------------------------------------------
         # Compute start and end index into time array.
-        # General method, if delta_t is datetime string.
-        #-------------------------------------------------
-        if (USE_LOOPS):
-            start_index = 0
-            # print('min_datetime_str =', str(min_datetime_obj) )
-            # print('dt_timedelta_str =', str(dt_timedelta_obj) )
-            next = copy.copy( min_datetime_obj )
-            while (True):
-                next = (next + dt_timedelta_obj)
-                ## print('next =', str(next))
-                if (next < start_datetime_obj):
-                    start_index += 1
-                else: break
-            #-------------------------------------------------
-            end_index = 0
-            next = copy.copy( min_datetime_obj )
-            while (True):
-                next = (next + dt_timedelta_obj)
-                if (next < end_datetime_obj):
-                    end_index += 1
-                else: break
-                
-        #---------------------------------
-        # Make sure indices are in range
-        #---------------------------------                  
-        nt = len( self.time_var )
-        start_index = max(0, start_index)
-        end_index   = min(end_index, nt-1)
+        #-------------------------------------------------------
+        # Note: This used to step forward from the min time by
+        #       time_delta, one step at a time, which was slow
+        #       for long time series and didn't work for an
+        #       irregular or monthly time axis.  Now we use a
+        #       time_index (see balto_index.py) that is built
+        #       once per dataset.  It converts the start and
+        #       end to "time since" in the dataset's calendar
+        #       (e.g. noleap or 360_day) and then does a binary
+        #       search.  The end datetime is included.
+        #-------------------------------------------------------
         #---------------------------------------
         # User time period may be smaller than
         # time spacing (dt).
@@ -2010,10 +2552,23 @@ class balto_gui:
         # We are using these indices like this:
         #   a[ t_i1:t_i2, lat_i1:lat_i2, lon_i1:lon_i2]
         # So if indices are equal, result will be empty.
-        # If indices differ by 1, get 1 value for that dim.
+        # In that case, the last time before the start
+        # is used.  (See balto_engine.py.)
         #----------------------------------------------------        
-        if (start_index == end_index):
-            end_index = start_index + 1
+        time_index = self.get_time_index()
+        if (time_index is None):
+            #----------------------------------------------
+            # e.g. "months since", which is not a fixed
+            # unit (see bi.parse_time_units), so the time
+            # range can't be used.  Say so, in the log.
+            #----------------------------------------------
+            msg1 = 'Sorry, the time units are not supported: '
+            msg1 += self.time_units_str
+            msg2 = 'All ' + str(nt) + ' times will be downloaded.'
+            self.append_download_log( [msg1, msg2, ' '] )
+        (start_index, end_index) = be.get_time_index_range( time_index, nt,
+                                       start_datetime_obj,
+                                       end_datetime_obj )
         
         if (REPORT):
             # print('n_times =', nt)
@@ -2027,18 +2582,6 @@ class balto_gui:
             self.append_download_log( [msg1, msg2, ' '] )
 
         return (start_index, end_index)
-                     
-        # Not needed for current problem.
-        # days_since1 = self.get_days_since_from_datetime(start_datetime_obj)
-        # days_since2 = self.get_days_since_from_datetime(end_datetime_obj)
-       
-        # For testing
-        # print('type(start_index) =', type(start_index) )
-        # print('type(end_index)   =', type(end_index) )
-        # print('start_index =', start_index)
-        # print('end_index   =', end_index)
-        # print('n_times     =', nt)
-        # return (start_index, end_index)
         
     #   get_new_time_index_range()
     #--------------------------------------------------------------------
@@ -2051,15 +2594,8 @@ class balto_gui:
         #       variable short names, stored earlier.
         #       They are valid keys to self.dataset.
         #-------------------------------------------------
-        ## dim_list = self.dataset[ short_name ].dimensions
-        ## dim_list = self.dataset[ short_name ].attributes.keys()
-        dim_list = self.var_short_names       
-        lat_name_list = ['lat', 'LAT', 'coadsy', 'COADSY',
-                         'latitude', 'LATITUDE', 'None']
-        for lat_name in lat_name_list:
-            if (lat_name in dim_list):
-                break
-        if (lat_name == 'None'):
+        lat_name = self.get_coord_name( 'lat' )
+        if (lat_name is None):
             msg1 = 'Sorry, could not find a "latitude" variable.'
             msg2 = 'Checked: lat, LAT, coadsy, COADSY,'
             msg3 = '   latitude and LATITUDE.'
@@ -2105,7 +2641,12 @@ class balto_gui:
         #----------------------------------------------------------
         # Next line type:  <class 'numpy.ndarray'>
         #----------------------------------------------------------                      
-        lats = self.dataset[ lat_name ][:].data
+        # lats = self.dataset[ lat_name ][:].data
+        #----------------------------------------------------------
+        # Now the coordinate arrays are cached per dataset, so
+        # repeated downloads don't fetch them again.
+        #----------------------------------------------------------
+        lats = self.get_coord_array( lat_name )
 
         if (lats.ndim > 1):
             msg1 = 'Sorry, cannot yet restrict latitude indices'
@@ -2151,16 +2692,17 @@ class balto_gui:
         #--------------------------------------
         # Compute the new, restricted indices
         # New method:  (2020-12-12)
-        #--------------------------------------
-        all_indices = np.arange( nlats )
-        w = np.logical_and(lats > user_minlat, lats < user_maxlat)  # boolean array
-        indices = all_indices[w]
-        if (indices.size > 0):
-            lat_i1 = indices[0]
-            lat_i2 = indices[-1]
-        else:
-            lat_i1 = 0
-            lat_i2 = nlats-1
+        #------------------------------------------------
+        # Now a coord_index (see balto_index.py) that is
+        # built once per dataset does this with binary
+        # search, or directly for a regular grid.
+        # lat_i2 is exclusive, as used in the slice
+        # a[lat_i1:lat_i2], so the last latitude in the
+        # box is included.
+        #------------------------------------------------
+        lat_index = self.get_coord_index( lat_name )
+        (lat_i1, lat_i2) = be.get_lat_index_range( lat_index, nlats,
+                                                   user_minlat, user_maxlat )
               
         #--------------------------------------
         # Compute the new, restricted indices
@@ -2211,7 +2753,7 @@ class balto_gui:
 
     #   get_new_lat_index_range()
     #--------------------------------------------------------------------
-    def get_new_lon_index_range(self, REPORT=True):
+    def get_new_lon_index_ranges(self, REPORT=True):
 
         short_name = self.get_var_shortname()
         #-------------------------------------------------
@@ -2220,20 +2762,13 @@ class balto_gui:
         #       variable short names, stored earlier.
         #       They are valid keys to self.dataset.
         #-------------------------------------------------
-        ## dim_list = self.dataset[ short_name ].dimensions
-        ## dim_list = self.dataset[ short_name ].attributes.keys()
-        dim_list = self.var_short_names
-        lon_name_list = ['lon', 'LON', 'coadsx', 'COADSX',
-                         'longitude', 'LONGITUDE', 'None']
-        for lon_name in lon_name_list:
-            if (lon_name in dim_list):
-                break
-        if (lon_name == 'None'):
+        lon_name = self.get_coord_name( 'lon' )
+        if (lon_name is None):
             msg1 = 'Sorry, could not find a "longitude" variable.'
             msg2 = 'Checked: lon, LON, coadsx, COADSX,'
             msg3 = '   longitude and LONGITUDE.'
             self.append_download_log( [msg1, msg2, msg3] )
-            return (None, None)
+            return None
 
         #-------------------------------------------- 
         # Are lons for grid cell edges or centers ?
@@ -2261,13 +2796,13 @@ class balto_gui:
         #----------------------------------       
         # Get the array of lons, and info
         #----------------------------------
-        lons = self.dataset[ lon_name ][:].data
+        lons = self.get_coord_array( lon_name )
        
         if (lons.ndim > 1):
             msg1 = 'Sorry, cannot yet restrict longitude indices'
             msg2 = '   when lon array has more than 1 dimension.'
             self.append_download_log( [msg1, msg2] )
-            return (None, None)
+            return None
 
         # print('## type(lons) =', type(lons) )
         # print('## lons.shape =', lons.shape )
@@ -2305,23 +2840,32 @@ class balto_gui:
         # Convert user lons to have range [0,360]?
         #-------------------------------------------
         ### if (minlon >= 0) and (maxlon <= 360):
-        if (NO_NEGATIVE_LONS):
-            user_minlon = (user_minlon + 360.0) % 360
-            user_maxlon = (user_maxlon + 360.0) % 360
+#         if (NO_NEGATIVE_LONS):
+#             user_minlon = (user_minlon + 360.0) % 360
+#             user_maxlon = (user_maxlon + 360.0) % 360
 
         #--------------------------------------
         # Compute the new, restricted indices
         # New method:  (2020-12-12)
-        #--------------------------------------
-        all_indices = np.arange( nlons )
-        w = np.logical_and(lons > user_minlon, lons < user_maxlon)  # boolean array
-        indices = all_indices[w]
-        if (indices.size > 0):
-            lon_i1 = indices[0]
-            lon_i2 = indices[-1]
-        else:
-            lon_i1 = 0
-            lon_i2 = nlons-1
+        #------------------------------------------------
+        # Now a coord_index (see balto_index.py) that is
+        # built once per dataset does this with binary
+        # search, or directly for a regular grid.
+        # lon_i2 is exclusive, as used in the slice
+        # a[lon_i1:lon_i2], so the last longitude in the
+        # box is included.
+        #------------------------------------------------
+        # Longitudes are periodic, so the user's box is
+        # shifted to the lons of the data, whether they
+        # are in [-180,180] or [0,360].  If the box then
+        # crosses the seam of the grid (e.g. a Pacific
+        # box that crosses 180 or 0), it is split into
+        # two index ranges, instead of downloading the
+        # whole globe.
+        #------------------------------------------------
+        lon_index  = self.get_coord_index( lon_name )
+        lon_ranges = be.get_lon_index_ranges( lon_index, nlons,
+                                              user_minlon, user_maxlon )
                   
         #--------------------------------------
         # Compute the new, restricted indices
@@ -2354,22 +2898,38 @@ class balto_gui:
             print('dlon     =', dlon)
             print('u_minlon =', user_minlon, '(user)')
             print('u_maxlon =', user_maxlon, '(user)')
-            print('lon_i1   =', lon_i1, '(new index)')
-            print('lon_i2   =', lon_i2, '(new index)')
+            print('lon_ranges =', lon_ranges, '(new indices)')
 #             print('nlons    =', nlons)
 #             print('New longitude indices =', lon_i1, ',', lon_i2 )
 #             print()
             #--------------------------------------------------
-            i1s  = str(lon_i1)
-            i2s  = str(lon_i2)
+            ranges_str = '; '.join( [str(i1) + ', ' + str(i2)
+                                     for (i1, i2) in lon_ranges] )
             msg1 = 'lon_name = ' + lon_name
             msg2 = 'dlon     = ' + str(dlon)
             msg3 = 'nlons    = ' + str(nlons)
             msg4 = 'min, max = ' + str(minlon) + ', ' + str(maxlon) + ' (data)'
             msg5 = 'min, max = ' + str(user_minlon) + ', ' + str(user_maxlon) + ' (user)'
-            msg6 = 'New longitude indices = ' + i1s + ', ' + i2s
+            msg6 = 'New longitude indices = ' + ranges_str
             self.append_download_log([msg1, msg2, msg3, msg4, msg5, msg6, ' '])
 
+        return lon_ranges
+
+    #   get_new_lon_index_ranges()
+    #--------------------------------------------------------------------
+    def get_new_lon_index_range(self, REPORT=True):
+
+        #--------------------------------------------------
+        # Note: Returns a single index range that covers
+        #       all of the ranges from the function above.
+        #       Use get_new_lon_index_ranges() to get the
+        #       pieces of a box that crosses the seam.
+        #--------------------------------------------------
+        lon_ranges = self.get_new_lon_index_ranges( REPORT=REPORT )
+        if (lon_ranges is None):
+            return (None, None)
+        lon_i1 = min( [r[0] for r in lon_ranges] )
+        lon_i2 = max( [r[1] for r in lon_ranges] )
         return (lon_i1, lon_i2)
 
     #   get_new_lon_index_range()
@@ -2457,28 +3017,57 @@ class balto_gui:
     #--------------------------------------------------------------------
     def get_download_format(self):
     
+        job = self.get_download_job()
+        if (job is not None):
+            return job['format']
         return self.download_format.value
         
     #   get_download_format()
     #--------------------------------------------------------------------
+    def get_download_strides(self):
+
+        #----------------------------------------------
+        # Return (time_stride, lat_stride, lon_stride)
+        # Default is 1, i.e. full resolution.
+        #----------------------------------------------
+        if not(hasattr(self, 'download_stride_time')):
+            return (1, 1, 1)
+        t_stride   = max( int(self.download_stride_time.value), 1 )
+        lat_stride = max( int(self.download_stride_lat.value),  1 )
+        lon_stride = max( int(self.download_stride_lon.value),  1 )
+        return (t_stride, lat_stride, lon_stride)
+
+    #   get_download_strides()
+    #--------------------------------------------------------------------
     def clear_download_log(self):
     
-        self.download_log.value = ''
+        self.download_log_sink.clear()
 
     #   clear_download_log()
     #--------------------------------------------------------------------
-    def append_download_log(self, msg):
+    def append_download_log(self, msg, level='info'):
     
-        ## type_str = str( type(msg) )
-        ## if (type_str == "<class 'list'>"):
-        
-        if (isinstance( msg, list)):
-            for string in msg:
-                self.download_log.value += (string + '\n')
-        else:
-            self.download_log.value += (msg + '\n')
+        #-----------------------------------------------------
+        # Note: msg is a string or a list of strings.  The
+        #       lines are buffered by a log_sink, which sets
+        #       the Textarea at most every log_min_interval
+        #       secs.  level is 'debug', 'info', 'warning'
+        #       or 'error'.  (See balto_log.py.)
+        #-----------------------------------------------------
+        self.download_log_sink.write( msg, level=level )
 
     #   append_download_log()
+    #--------------------------------------------------------------------
+    def export_download_log(self, path='download_log.txt'):
+
+        #----------------------------------------------------
+        # Save all of the download log that is still in
+        # the buffer, at all levels, as a text file.
+        #----------------------------------------------------
+        self.download_log_sink.flush()
+        return self.download_log_sink.export( path )
+
+    #   export_download_log()
     #--------------------------------------------------------------------   
     def print_user_choices(self):
 
@@ -2517,36 +3106,21 @@ class balto_gui:
 
     #   print_user_choices()
     #--------------------------------------------------------------------
-    def download_data(self, caller_obj=None):
+    def get_download_indices(self, REPORT=True, TIMES=True):
 
-        #-------------------------------------------------
-        # Note: After a reset, self still has a dataset,
-        #       but short_name was reset to ''.
-        #-------------------------------------------------
+        #---------------------------------------------------
+        # Note: Returns a list of tuples of slices, one
+        #       slice for each dimension of the selected
+        #       variable, that define the hyperslab to
+        #       download, based on the user's choices in
+        #       the GUI.  There are two tuples if the lon
+        #       box crosses the seam of the grid, else one.
+        #       With TIMES=False, the time range is ignored
+        #       and all times are used.
+        #---------------------------------------------------
         short_name = self.get_var_shortname()
-        if (short_name == ''):
-            msg = 'Sorry, no variable has been selected.'
-            self.download_log.value = msg
-            return
-
-        #----------------------------------------------------
-        # Note: This is called by the "on_click" method of
-        # the "Go" button beside the Dropdown of filenames.
-        # In this case, type(caller_obj) =
-        # <class 'ipywidgets.widgets.widget_button.Button'>
-        #----------------------------------------------------
-        ## status = self.download_status
-        self.print_user_choices()
-        #--------------------------------------------------
-        # print_user_choices() already displayed error msg
-        #--------------------------------------------------
-        if not(hasattr(self, 'dataset')):
-            return
- 
-        #----------------------------------------           
-        # Get names of the variables dimensions
-        #----------------------------------------
-        dim_list = self.dataset[ short_name ].dimensions
+        pydap_grid = self.dataset[ short_name ]
+        ndims = len( pydap_grid.dimensions ) # (e.g. time, lat, lon)
 
         #--------------------------------------
         # Uncomment to test other time_deltas
@@ -2563,198 +3137,718 @@ class balto_gui:
         # Is there a time variable ?  If so, use time
         # range selected in GUI to clip the data.
         #---------------------------------------------- 
-        (t_i1, t_i2) = self.get_new_time_index_range( REPORT=True)
+        (t_i1, t_i2) = (None, None)
+        if (TIMES):
+            (t_i1, t_i2) = self.get_new_time_index_range( REPORT=REPORT )
            
         #--------------------------------------------
         # Is there a lat variable ?  If so, use lat
         # range selected in GUI to clip the data.
         # Default is the full range.
         #--------------------------------------------
-        (lat_i1, lat_i2) = self.get_new_lat_index_range( REPORT=True)
+        (lat_i1, lat_i2) = self.get_new_lat_index_range( REPORT=REPORT )
             
         #--------------------------------------------
         # Is there a lon variable ?  If so, use lon
         # range selected in GUI to clip the data.
         # Default is the full range.
         #--------------------------------------------
-        (lon_i1, lon_i2) = self.get_new_lon_index_range( REPORT=True)
+        lon_ranges = self.get_new_lon_index_ranges( REPORT=REPORT )
 
         #--------------------------------------        
         # Did user set a spatial resolution ?
-        #--------------------------------------
-                
+        #--------------------------------------------------
+        # Restrict indices to only download the required
+        # data, with one slice for each dimension.  (See
+        # get_hyperslab_indices() in balto_engine.py.)
+        #--------------------------------------------------
+        strides = self.get_download_strides()
+        indices = be.get_hyperslab_indices( ndims, (t_i1, t_i2),
+                                            (lat_i1, lat_i2), lon_ranges,
+                                            strides )
+        return indices
 
-        # Asynchronous download. How do we know its here?
-        # print('Downloading variable:', short_name, '...' )
-        # print('Variable saved in: balto.user_var')
-        # print()
-        
-        msg1 = 'Downloading variable: ' + short_name + '...'   
-        msg2 = 'Variable saved in:  balto.user_var'
-        msg3 = ' '
-        self.append_download_log( [msg1, msg2, msg3] )
+    #   get_download_indices()
+    #--------------------------------------------------------------------
+    def get_lon_slices(self, lon_ranges, lon_stride=None):
+
+        return be.get_lon_slices( lon_ranges, lon_stride )
+
+    #   get_lon_slices()
+    #--------------------------------------------------------------------
+    def get_download_index(self, REPORT=True):
 
-        #---------------------------------------------        
-        # Convert reference to actual numpy variable
-        # which causes it to be downloaded, and then
-        # store it into balto.user_var.
         #---------------------------------------------------
-        # This grid includes var and its dimension vectors.
-        # Note:  type(pydap_grid) = pydap.model.GridType
+        # Note: Returns a single tuple of slices that
+        #       covers all of the pieces from the function
+        #       above.  The last slice is the lon slice.
         #---------------------------------------------------
-        pydap_grid = self.dataset[ short_name ]
-        ndims = len( pydap_grid.dimensions ) # (e.g. time, lat, lon)
-        ## data_obj  = self.dataset[ short_name ]
-        ## data_dims = data_obj.dimensions
-        ## ndim      = len( data_dims )
+        indices = self.get_download_indices( REPORT=REPORT )
+        if (len(indices) == 1):
+            return indices[0]
+        i1 = min( [index[-1].start for index in indices] )
+        i2 = max( [index[-1].stop  for index in indices] )
+        return indices[0][:-1] + (slice(i1, i2, indices[0][-1].step),)
+
+    #   get_download_index()
+    #--------------------------------------------------------------------
+    def unpack_var(self, var, atts, out=None):
 
-        #------------------------------------------------
-        # Actually download the data here to a variable
-        # in the notebook, but restrict indices first,
-        # to only download the required data.
-        #------------------------------------------------
-        if (ndims == 3):
-            #-------------------------------------
-            # Assume dims are:  (time, lat, lon)
-            #------------------------------------------
-            # After subscripting, grid still has type:
-            #    pydap.model.GridType
-            #------------------------------------------
-            if (lat_i1 is None) or (lon_i1 is None):
-                if (t_i1 is None):
-                    grid = pydap_grid[:]
-                else:
-                    grid = pydap_grid[t_i1:t_i2, :, :]
-            else:
-                if (t_i1 is None):
-                    grid = pydap_grid[:, lat_i1:lat_i2, lon_i1:lon_i2]
-                else: 
-                    grid = pydap_grid[t_i1:t_i2, lat_i1:lat_i2, lon_i1:lon_i2]
-        #----------------------------------------
-        elif (ndims == 1):  # time series
-            if (t_i1 is None):
-                grid = pydap_grid[:]
-            else:
-                grid = pydap_grid[t_i1:t_i2]
-        #-----------------------------------
-        elif (ndims == 2):  # spatial grid
-            #-------------------------------
-            # Assume dims are:  (lat, lon)
-            #-------------------------------
-            if (lat_i1 is None) or (lon_i1 is None):
-                grid = pydap_grid[:]
-            else:
-                grid = pydap_grid[lat_i1:lat_i2, lon_i1:lon_i2]
-        #------------------------------------
-        else:
-            grid = pydap_grid[:]
+        #---------------------------------------------------------
+        # Note: Apply missing_value, _FillValue, valid_range,
+        #       scale_factor and add_offset, with one output
+        #       array of dtype self.unpack_dtype.  Missing values
+        #       are handled as set by self.missing_mode.
+        #       (See balto_unpack.py.)
+        #---------------------------------------------------------
+        return bu.unpack_array( var, atts, dtype=self.unpack_dtype,
+                                missing=self.missing_mode, out=out )
+
+    #   unpack_var()
+    #--------------------------------------------------------------------
+    def get_user_var(self, var, atts):
 
+        #---------------------------------------------------------
+        # Note: Return the value to save in balto.user_var for
+        #       an in-memory download: the unpacked array, or a
+        #       packed_array if self.use_packed_array is True.
+        #       A packed_array is indexed like an array, e.g.
+        #       sst[0], and works with numpy and balto_plot.
+        #---------------------------------------------------------
+        return self.get_engine().get_user_var( var, atts )
+
+    #   get_user_var()
+    #--------------------------------------------------------------------
+    def download_data(self, caller_obj=None):
+
+        #-------------------------------------------------
+        # Note: After a reset, self still has a dataset,
+        #       but short_name was reset to ''.
+        #-------------------------------------------------
+        short_name = self.get_var_shortname()
+        if (short_name == ''):
+            msg = 'Sorry, no variable has been selected.'
+            self.clear_download_log()
+            self.append_download_log( msg )
+            return
+
+        #----------------------------------------------------
+        # Note: This is called by the "on_click" method of
+        # the "Go" button beside the Dropdown of filenames.
+        # In this case, type(caller_obj) =
+        # <class 'ipywidgets.widgets.widget_button.Button'>
+        #----------------------------------------------------
+        self.print_user_choices()
         #--------------------------------------------------
-        # Note: type(pydap_grid)   = pydap.model.gridtype
-        #       type(grid)         = pydap.model.gridtype
-        #       type(grid[:].data) = list
-        #       type(grid.data)    = list
+        # print_user_choices() already displayed error msg
         #--------------------------------------------------
-        # Subscript by *ranges* doesn't change data type.
-        #--------------------------------------------------        
-        grid_list = grid.data   ########
-        n_list    = len(grid_list)
-        var = grid_list[0]
-        
-        # For testing
-        # print('## type(grid) =', type(grid) )
-        # print('## type(grid.data) =', type(grid_list) )
-        # print('## len(grid.data)  =', n_list )
-        # print('## type(var) =', type(var) )
-        # print()
-    
-        times = None   # (defaults)
-        lats  = None
-        lons  = None
-        if (n_list > 1):
-            times = grid_list[1]
-        if (n_list > 2):
-            lats = grid_list[2]
-        if (n_list > 3):
-            lons = grid_list[3]
+        if not(hasattr(self, 'dataset')):
+            return
+
+        if (self.is_downloading()):
+            msg1 = 'Sorry, a download is already running.'
+            msg2 = 'Click Cancel to stop it.'
+            self.append_download_log( [msg1, msg2, ' '] )
+            return
+
+        #-----------------------------------------
+        # Get the hyperslab chosen by the user,
+        # as a tuple of slices, one for each dim.
+        # A time period outside of the data is
+        # a ValueError (see balto_engine.py).
+        #-----------------------------------------
+        try:
+            indices = self.get_download_indices( REPORT=True )
+        except ValueError as err:
+            self.append_download_log( ['Sorry, ' + str(err), ' '],
+                                      level='error' )
+            return
+        self.report_download_size( indices )
+
+        #---------------------------------------------------
+        # The download runs in a thread, from a snapshot
+        # of the user's choices, so the notebook can be
+        # used (and the choices changed) while it runs.
+        # Progress is shown below the Download button.
+        #---------------------------------------------------
+        job = self.get_download_snapshot( indices )
+        self.start_download_job( job )
+
+    #   download_data()
+    #--------------------------------------------------------------------
+    def start_download_job(self, job):
+
+        #-----------------------------------------------------
+        # Run a job from get_download_snapshot(), in a thread
+        # if download_in_background is set (see above).
+        #-----------------------------------------------------
+        if (self.download_in_background):
+            self.download_thread = threading.Thread(
+                                       target=self.run_download_job,
+                                       args=(job,), daemon=True )
+            self.download_thread.start()
+        else:
+            self.run_download_job( job )
+
+    #   start_download_job()
+    #--------------------------------------------------------------------
+    def get_engine(self):
+
+        #---------------------------------------------------------
+        # Note: The downloads are done by a download_engine
+        #       (see balto_engine.py), which has no widgets and
+        #       is also used by batch jobs.  The GUI keeps one
+        #       engine, which shares its caches, so coordinates
+        #       are not fetched twice.  The settings can be
+        #       changed at any time, so the GUI's current ones
+        #       are copied to it on each call.  Messages go to
+        #       the download log.
+        #---------------------------------------------------------
+        if (self.engine is None):
+            self.engine = be.download_engine( log=self.append_download_log )
+            self.engine.coord_cache = self.coord_cache
+            self.engine.index_cache = self.index_cache
+        engine = self.engine
+        engine.timeout_secs      = self.timeout_secs
+        engine.use_parallel_download = self.use_parallel_download
+        engine.slab_target_bytes = self.slab_target_bytes
+        engine.n_workers         = self.n_workers
+        engine.cache             = self.get_data_cache()
+        engine.profiles          = self.get_host_profiles()
+        engine.metadata_cache    = self.get_metadata_cache()
+        engine.use_journal       = self.use_journal
+        engine.journal_dir       = self.journal_dir
+        engine.max_memory_bytes  = self.max_memory_bytes
+        engine.scratch_dir       = self.scratch_dir
+        engine.unpack_dtype      = self.unpack_dtype
+        engine.missing_mode      = self.missing_mode
+        engine.use_packed_array  = self.use_packed_array
+        engine.download_dir      = self.download_dir
+        return engine
+
+    #   get_engine()
+    #--------------------------------------------------------------------
+    def get_download_snapshot(self, indices, var_names=None, urls=None,
+                              download_format=None):
+
+        #---------------------------------------------------------
+        # Note: Return the user's choices that a download
+        #       needs, as a read-only mapping, so that the
+        #       download thread does not see later changes.
+        #       (See download_engine.make_job().)
+        #---------------------------------------------------------
+        if (download_format is None):
+            download_format = self.get_download_format()
+        return self.get_engine().make_job( self.get_var_shortname(),
+                                           download_format,
+                                           self.opendap_file_url,
+                                           self.dataset, indices,
+                                           filename=self.data_filename.value,
+                                           callback=self.show_download_progress,
+                                           var_names=var_names, urls=urls )
+
+    #   get_download_snapshot()
+    #--------------------------------------------------------------------
+    def run_download_job(self, job):
+
+        #---------------------------------------------------------
+        # Note: Runs the download for a snapshot from
+        #       get_download_snapshot().  While it runs, the
+        #       snapshot is visible to this thread only, via
+        #       get_download_job(), so get_var_shortname() and
+        #       the other getters return the saved choices.
+        #---------------------------------------------------------
+        # The download itself is done by the download engine
+        # (see balto_engine.py), which picks a netCDF file,
+        # a chunk store, a memory-mapped scratch file or an
+        # in-memory array, and the result is saved in
+        # balto.user_var, with its coordinates.
+        #---------------------------------------------------------
+        # Transient network errors are retried (see
+        # balto_retry.py), and the counts for this job, kept
+        # by its monitor, are shown in the download log when
+        # the download ends.
+        #---------------------------------------------------------
+        self.download_job.snapshot = job
+        self.download_monitor = job['monitor']
+        self.show_download_progress( job['monitor'] )
+        old_counters = br.set_job_counters( job['monitor'].counters )
+        try:
+            result = self.get_engine().run( job )
+            if (result['var'] is not None):
+                self.set_user_var( result )
+        except bd.download_cancelled:
+            self.append_download_log( ['Download cancelled.', ' '],
+                                      level='warning' )
+        except ValueError as err:
+            #----------------------------------------
+            # e.g. variables with other dimensions
+            # (see balto_engine.py)
+            #----------------------------------------
+            self.append_download_log( ['Sorry, ' + str(err), ' '],
+                                      level='error' )
+        except Exception as err:
+            if not(self.download_in_background):
+                raise
+            #----------------------------------------
+            # Nobody can catch it in the thread, so
+            # show it in the download log
+            #----------------------------------------
+            msg = 'Sorry, the download failed: ' + repr(err)
+            self.append_download_log( [msg, ' '], level='error' )
+        finally:
+            br.set_job_counters( old_counters )
+            self.report_retry_counters( job['monitor'].counters )
+            self.download_job.snapshot = None
+            self.show_download_progress( job['monitor'], DONE=True )
+
+    #   run_download_job()
+    #--------------------------------------------------------------------
+    def set_user_var(self, result):
+
+        #---------------------------------------------------------
+        # Note: Save a result from the download engine in
+        #       balto.user_var.  For a netCDF file, it is the
+        #       netCDF4 variable, which reads values lazily,
+        #       e.g. balto.user_var[0:10].  For a chunk store,
+        #       more time steps can be added later with
+        #       balto.user_var.append().
+        #---------------------------------------------------------
+        if (result.get('scratch_file') is not None):
+            #--------------------------------------------------
+            # Remove the previous scratch file.  (On Linux
+            # and macOS, a memmap that still uses it is ok.)
+            #--------------------------------------------------
+            self.remove_scratch_file()
+            self.scratch_file = result['scratch_file']
+        if (result.get('file') is not None):
+            self.user_file = result['file']
+        if (result.get('vars') is not None):
+            self.user_vars = result['vars']
+        self.user_var = result['var']
+        self.user_var_times = result['times']   # (maybe None)
+        self.user_var_lats  = result['lats']    # (maybe None)
+        self.user_var_lons  = result['lons']    # (maybe None)
+
+        msg = 'Variable saved in:  balto.user_var'
+        if (result.get('path') is not None):
+            msg = 'Variable opened as:  balto.user_var'
+        msgs = [msg]
+        if (result.get('vars') is not None):
+            msgs.append( 'Variables saved in:  balto.user_vars' )
+        self.append_download_log( msgs + [' '] )
+
+    #   set_user_var()
+    #--------------------------------------------------------------------
+    def get_download_job(self):
+
+        return getattr( self.download_job, 'snapshot', None )
+
+    #   get_download_job()
+    #--------------------------------------------------------------------
+    def get_download_dataset(self):
+
+        job = self.get_download_job()
+        return (self.dataset if (job is None) else job['dataset'])
+
+    #   get_download_dataset()
+    #--------------------------------------------------------------------
+    def get_download_url(self):
+
+        job = self.get_download_job()
+        return (self.opendap_file_url if (job is None) else job['url'])
+
+    #   get_download_url()
+    #--------------------------------------------------------------------
+    def get_download_monitor(self):
+
+        job = self.get_download_job()
+        return (None if (job is None) else job['monitor'])
+
+    #   get_download_monitor()
+    #--------------------------------------------------------------------
+    def is_downloading(self):
+
+        thread = self.download_thread
+        return (thread is not None) and thread.is_alive()
+
+    #   is_downloading()
+    #--------------------------------------------------------------------
+    def wait_for_download(self, timeout=None):
+
+        #-----------------------------------------------------
+        # Wait for a download that runs in the background,
+        # e.g. before using balto.user_var in the next cell.
+        # Returns True if it is done.
+        #-----------------------------------------------------
+        if (self.download_thread is not None):
+            self.download_thread.join( timeout )
+        return not(self.is_downloading())
+
+    #   wait_for_download()
+    #--------------------------------------------------------------------
+    def cancel_download(self, caller_obj=None):
+
+        #-----------------------------------------------------
+        # Note: Slabs that were not started are skipped, and
+        #       those in flight are dropped when they arrive.
+        #       Completed slabs stay in the journal, so the
+        #       download can be resumed later.
+        #-----------------------------------------------------
+        if not(self.is_downloading()) or (self.download_monitor is None):
+            self.append_download_log( 'No download is running.' )
+            return
+        self.download_monitor.cancel()
+        self.append_download_log( 'Cancelling the download...' )
+
+    #   cancel_download()
+    #--------------------------------------------------------------------
+    def show_download_progress(self, monitor, DONE=False):
+
+        #-----------------------------------------------------
+        # Called by the download_monitor as slabs arrive,
+        # from the download threads.
+        #-----------------------------------------------------
+        if not(hasattr(self, 'download_progress')):
+            return
+        self.download_progress.value = monitor.get_fraction()
+        status = monitor.get_status()
+        if (DONE):
+            if (monitor.is_cancelled()):
+                status = 'Cancelled.  ' + status
+            elif (monitor.is_failed()):
+                status = 'Failed.  ' + status
+            else:
+                status = 'Done.  ' + status
+        self.download_status.value = status
+
+    #   show_download_progress()
+    #--------------------------------------------------------------------
+    def report_retry_counters(self, counters):
+
+        #-----------------------------------------------------
+        # Show the counts of a br.retry_counters, such as
+        # the counters of a download job's monitor.
+        #-----------------------------------------------------
+        counters = counters.get()
+        msg1 = 'Network requests = ' + str(counters['n_calls'])
+        msg2 = 'Retries = ' + str(counters['n_retries'])
+        msg2 += ', recovered = ' + str(counters['n_recovered'])
+        msg2 += ', failed = ' + str(counters['n_failures'])
+        msgs = [msg1, msg2]
+        if (counters['last_error'] is not None):
+            msgs.append( 'Last error = ' + counters['last_error'] )
+        self.append_download_log( msgs + [' '] )
+
+    #   report_retry_counters()
+    #--------------------------------------------------------------------
+    def report_download_size(self, indices):
+
+        #-----------------------------------------------------
+        # Show the number of bytes that will be requested,
+        # and how many fewer that is because of the strides.
+        #-----------------------------------------------------
+        pydap_grid = self.get_download_dataset()[ self.get_var_shortname() ]
+        shape    = pydap_grid.shape
+        itemsize = pydap_grid.dtype.itemsize
+        n_bytes  = bd.get_request_bytes( indices, shape, itemsize )
+        full_indices = [ tuple( [slice(s.start, s.stop) for s in index] )
+                         for index in indices ]
+        n_full   = bd.get_request_bytes( full_indices, shape, itemsize )
+
+        msg1 = 'Bytes requested = ' + str(n_bytes)
+        msgs = [msg1]
+        if (n_bytes < n_full):
+            n_saved = (n_full - n_bytes)
+            pct  = (100.0 * n_saved) / n_full
+            msg2 = 'Bytes saved by strides = ' + str(n_saved)
+            msg2 += ' (' + '{:.1f}'.format(pct) + '%)'
+            msgs.append( msg2 )
+        msgs.append( ' ' )
+        self.append_download_log( msgs )
+
+    #   report_download_size()
+    #--------------------------------------------------------------------
+    def get_download_path(self, extension='.nc'):
+
+        #----------------------------------------------------
+        # e.g.  ./sst.mnmean_sst.nc  for sst in sst.mnmean.nc
+        # (See download_engine.get_output_path().)
+        #----------------------------------------------------
+        job = self.get_download_job()
+        if (job is None):
+            job = {'path': None, 'filename': self.data_filename.value,
+                   'short_name': self.get_var_shortname(),
+                   'download_dir': None}
+        return self.get_engine().get_output_path( job, extension )
+
+    #   get_download_path()
+    #--------------------------------------------------------------------
+    def export_geotiff(self, path=None, time_index=0):
+
+        #---------------------------------------------------------
+        # Note: Export balto.user_var to a cloud-optimized
+        #       GeoTIFF (tiled, compressed, with overviews),
+        #       georeferenced from user_var_lats and
+        #       user_var_lons.  For a 3D variable, the grid at
+        #       time_index is exported.  Needs rasterio.
+        #---------------------------------------------------------
+        if (self.user_var is None):
+            self.append_download_log( 'Sorry, no data has been downloaded.' )
+            return None
+        grid = self.user_var
+        lats = self.user_var_lats
+        lons = self.user_var_lons
+        if (grid.ndim == 3):
+            grid = grid[ time_index ]
+        elif (grid.ndim == 2):
+            grid = grid[:]
+        if (np.ndim(grid) != 2) or (lats is None) or (lons is None):
+            msg1 = 'Sorry, export_geotiff() needs a 2D grid'
+            msg2 = '   with lat and lon coordinates.'
+            self.append_download_log( [msg1, msg2] )
+            return None
+        if (path is None):
+            path = self.get_download_path( '.tif' )
+
+        nodata = None
+        atts = self.get_download_dataset()[ self.get_var_shortname() ].attributes
+        for key in ['missing_value', '_FillValue']:
+            if (key in atts):
+                nodata = float( np.ravel( atts[key] )[0] )
+                break
+        if (self.missing_mode == 'nan') and (grid.dtype.kind == 'f'):
+            nodata = np.nan
+        grid = np.ma.filled( grid, nodata if (nodata is not None) else 0 )
+        try:
+            bio.write_geotiff( path, grid, lats, lons, nodata=nodata )
+        except ValueError as err:
+            #------------------------------------------
+            # e.g. a grid that is not regularly spaced
+            #------------------------------------------
+            self.append_download_log( ['Sorry, ' + str(err), ' '],
+                                      level='error' )
+            return None
+        self.append_download_log( 'GeoTIFF saved in:  ' + path )
+        return path
+
+    #   export_geotiff()
+    #--------------------------------------------------------------------
+    def remove_scratch_file(self):
+
+        path = getattr( self, 'scratch_file', None )
+        if (path is not None):
+            try:
+                os.remove( path )
+            except OSError:
+                pass
+            self.scratch_file = None
+
+    #   remove_scratch_file()
+    #--------------------------------------------------------------------
+    def download_aggregate(self, caller_obj=None, filenames=None,
+                           pattern=None):
+
+        #---------------------------------------------------------
+        # Note: Some products, like GPM IMERG, store one time
+        #       step per file.  This fetches the same spatial
+        #       subset of the selected variable from many files
+        #       in the URL dir, and joins them into one
+        #       time-ordered array in balto.user_var.  (See
+        #       download_engine.download_aggregate().)  By
+        #       default, all files in the filename list are
+        #       used; pattern (e.g. '*201706*') can be used to
+        #       select some of them.
+        #---------------------------------------------------------
+        short_name = self.get_var_shortname()
+        if (short_name == '') or not(hasattr(self, 'dataset')):
+            msg = 'Sorry, no variable has been selected.'
+            self.append_download_log( msg )
+            return
+
+        if (filenames is None):
+            filenames = [f for f in self.data_filename.options if (f != '')]
+        if (pattern is not None):
+            filenames = fnmatch.filter( filenames, pattern )
+        if (len(filenames) == 0):
+            self.append_download_log( 'Sorry, no files were selected.' )
+            return
+        directory = self.data_url_dir.value
+        if (directory[-1] != '/'):
+            directory += '/'
+        urls = [(directory + f) for f in filenames]
+
+        if (self.is_downloading()):
+            msg1 = 'Sorry, a download is already running.'
+            msg2 = 'Click Cancel to stop it.'
+            self.append_download_log( [msg1, msg2, ' '] )
+            return
+
+        #------------------------------------------------
+        # Use the lat/lon subset (and strides) from the
+        # open file, and all times in each file.  The
+        # download runs like download_data(), and can
+        # be cancelled.
+        #------------------------------------------------
+        try:
+            indices = self.get_download_indices( REPORT=True, TIMES=False )
+        except ValueError as err:
+            self.append_download_log( ['Sorry, ' + str(err), ' '],
+                                      level='error' )
+            return
+        job = self.get_download_snapshot( indices, urls=urls,
+                                          download_format='In memory' )
+        self.start_download_job( job )
+
+    #   download_aggregate()
+    #--------------------------------------------------------------------
+    def download_variables(self, caller_obj=None, var_names=None):
+
+        #---------------------------------------------------------
+        # Note: Downloads the same hyperslab of several
+        #       variables from the open file.  The variables
+        #       must have the same dimensions as the selected
+        #       variable.  The results are unpacked and saved
+        #       in the dictionary balto.user_vars, keyed by
+        #       short name.  (See
+        #       download_engine.download_variables().)  It
+        #       runs like download_data(), and returns
+        #       balto.user_vars if it does not run in a thread.
+        #---------------------------------------------------------
+        short_name = self.get_var_shortname()
+        if (short_name == '') or not(hasattr(self, 'dataset')):
+            msg = 'Sorry, no variable has been selected.'
+            self.append_download_log( msg )
+            return None
+        if (var_names is None):
+            var_names = list( self.download_var_names.value )
+        if (len(var_names) == 0):
+            var_names = [ short_name ]
+
+        if (self.is_downloading()):
+            msg1 = 'Sorry, a download is already running.'
+            msg2 = 'Click Cancel to stop it.'
+            self.append_download_log( [msg1, msg2, ' '] )
+            return None
+
+        try:
+            indices = self.get_download_indices( REPORT=True )
+        except ValueError as err:
+            self.append_download_log( ['Sorry, ' + str(err), ' '],
+                                      level='error' )
+            return None
+        job = self.get_download_snapshot( indices, var_names=var_names,
+                                          download_format='In memory' )
+        self.start_download_job( job )
+        if (self.download_in_background):
+            return None
+        return self.user_vars
+
+    #   download_variables()
+    #--------------------------------------------------------------------
+    def get_coords_from_maps(self, maps, dims, coord_atts=None):
 
         #----------------------------------------------
-        # Are lats in reverse order ?  (2020-12-12)
-        # MUST DO THIS BEFORE SUBSETTING WITH INDICES
+        # "maps" holds the dimension vectors that come
+        # with a pydap grid, e.g. [time, lat, lon], and
+        # dims their names.  Returns (times, lats, lons).
         #----------------------------------------------
-#         origin = None
-#         if (lats is not None):
-#             if (lats[0] > lats[-1]):
-#                 origin = 'upper'    # (row major?)
-#                 lats.sort()    #############################
-#             else:
-#                 origin = 'lower'
+        return be.get_coords_from_maps( maps, dims, coord_atts )
 
-        #----------------------------------------------      
-        # Adjust the longitudes ?
-        # MUST DO THIS BEFORE SUBSETTING WITH INDICES
-        #----------------------------------------------
-#         if (n_list > 3):
-#             SIGNED_LONS = True
-#             if (SIGNED_LONS):
-#                 #----------------------------------------        
-#                 # Convert lons to have range [-180,180]
-#                 #----------------------------------------
-#                 lons = ((lons + 180.0) % 360) - 180
-#                 lons.sort()    #################
-               
-        #-----------------------------      
-        # Is there a missing value ?
-        # Is there a fill value ?
-        #-----------------------------
-        atts = pydap_grid.attributes
-        REPLACE_MISSING = False
-        if ('missing_value' in atts.keys()):
-             REPLACE_MISSING = True
-             missing_value = pydap_grid.attributes['missing_value']
-             w = (var == missing_value)
-                  
-        #---------------------------------------      
-        # Is there a scale factor and offset ?
-        #---------------------------------------
-        if ('scale_factor' in atts.keys()):
-            #---------------------------------------------------
-            # Note: var may have type ">i2" while scale_factor
-            #       may have type "float64", so need to upcast
-            #       var and can't use "*="
-            #---------------------------------------------------
-            factor = pydap_grid.attributes['scale_factor']
-            ## print('type(var) =', type(var))
-            ## print('type(factor) =', type(factor))
-            var = var * factor
-        if ('add_offset' in atts.keys()):
-            offset = pydap_grid.attributes['add_offset']
-            ## print('type(var) =', type(var))
-            ## print('type(offset) =', type(offset))
-            var = var + offset
- 
-        #-----------------------------------------
-        # Restore missing values after scaling ?
-        #-----------------------------------------  
-        if (REPLACE_MISSING):
-            var[w] = missing_value
+    #   get_coords_from_maps()
+    #--------------------------------------------------------------------
+    def iter_download(self, REPORT=False, indices=None, journal=None):
 
-        #-----------------------------------------           
-        # Save var into balto object as user_var
-        #-----------------------------------------        
-        self.user_var = var
-        self.user_var_times = times   # (maybe None)
-        self.user_var_lats  = lats    # (maybe None)
-        self.user_var_lons  = lons    # (maybe None)
-        
-        #----------------------------------------------------        
-        # Could define self.user_var as a list, and append
-        # new variables to the list as downloaded.
-        # Could also put them into a dictionary.
         #----------------------------------------------------
-        
+        # Note: This is a generator that yields the user's
+        #       hyperslab one time slab at a time, as
+        #       (times, lats, lons, slab), instead of
+        #       storing all of it in balto.user_var.  Each
+        #       slab has missing_value, scale_factor and
+        #       add_offset applied, as in download_data().
+        #----------------------------------------------------
+        # Example:
+        #    for (times, lats, lons, sst) in balto.iter_download():
+        #        means.append( sst.mean(axis=(1,2)) )
+        #----------------------------------------------------
+        short_name = self.get_var_shortname()
+        if (short_name == '') or not(hasattr(self, 'dataset')):
+            msg = 'Sorry, no variable has been selected.'
+            self.append_download_log( msg )
+            return
+
+        if (indices is None):
+            indices = self.get_download_indices( REPORT=REPORT )
+        job    = self.get_download_snapshot( indices )
+        engine = self.get_engine()
+        for slab in engine.iter_download( job, journal=journal ):
+            yield slab
+
+    #   iter_download()
+    #--------------------------------------------------------------------
+    def get_data_cache(self):
+
+        #------------------------------------------------
+        # Create the on-disk cache the first time it is
+        # needed.  Returns None if caching is disabled.
+        #------------------------------------------------
+        if not(self.use_cache):
+            return None
+        if (self.data_cache is None):
+            self.data_cache = bc.response_cache( cache_dir=self.cache_dir,
+                                     max_bytes=self.cache_max_bytes )
+        return self.data_cache
+
+    #   get_data_cache()
+    #--------------------------------------------------------------------
+    def get_host_profiles(self):
 
-    #   download_data()    
+        #-------------------------------------------------
+        # Per-host performance profiles, kept on disk.
+        # Returns None if they are disabled.
+        #-------------------------------------------------
+        if not(self.use_host_profiles):
+            return None
+        if (self.host_profiles is None):
+            self.host_profiles = bc.host_profiles(
+                                     slab_bytes=self.slab_target_bytes,
+                                     n_workers=self.n_workers )
+        return self.host_profiles
+
+    #   get_host_profiles()
+    #--------------------------------------------------------------------
+    def get_slab_settings(self):
+
+        #---------------------------------------------------
+        # Return (slab_bytes, n_workers) to use for the
+        # current file's server.  These come from its host
+        # profile, which adapts to how fast it responds.
+        #---------------------------------------------------
+        engine = self.get_engine()
+        return engine.get_slab_settings( self.get_download_url() )
+
+    #   get_slab_settings()
+    #--------------------------------------------------------------------
+    def get_cache_info(self, REPORT=True):
+
+        cache = self.get_data_cache()
+        if (cache is None):
+            return None
+        info = cache.info()
+        if (REPORT):
+            for key, val in info.items():
+                print( key, '=', val )
+        return info
+
+    #   get_cache_info()
+    #--------------------------------------------------------------------
+    def clear_cache(self):
+
+        cache = self.get_data_cache()
+        if (cache is not None):
+            cache.clear()
+
+    #   clear_cache()
     #--------------------------------------------------------------------
     def show_grid(self, grid, var_name=None, extent=None,
                   cmap='rainbow', xsize=8, ysize=8 ):
@@ -2827,6 +3921,7 @@ class balto_gui:
         # {"IRI":"result1_IRI", "label":"result1_label", "matchrank": "result1_rank"},
         # {"IRI":"result2_IRI", "label":"result2_label", "matchrank": "result2_rank"} ] }
         #------------------------------------------------------------------        
+        import requests
         result = requests.get( match_phrase_url )
         print('Finished.')
         print()
@@ -2849,4 +3944,4 @@ class balto_gui:
     
     
     
-         
\ No newline at end of file
+            
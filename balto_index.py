@@ -0,0 +1,560 @@
+"""
+This module defines index objects that are used by the BALTO GUI
+app to convert a range of coordinate values, such as a range of
+latitudes chosen by the user, to a range of array indices.  Each
+index is built once for a coordinate array and then reused.  Sorted
+axes (ascending or descending) use a binary search, and regular
+grids only store (start, step, n) and compute indices directly.
+A longitude box that crosses the seam of a grid is split into two
+index ranges.
+Time axes given as "<units> since <origin>" are handled by a
+time_index, which supports the CF calendars.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import re
+import numpy as np
+
+#------------------------------------------------------------------------
+#
+# class coord_index
+#     __init__()
+#     get_values()
+#     index_range()
+#     regular_index_range()
+#     sorted_index_range()
+#     unsorted_index_range()
+#
+# lon_index_ranges()
+# unwrap_lons()
+# days_from_civil()
+# days_from_julian()
+# julian_from_days()
+# get_calendar_name()
+# parse_time_units()
+#
+# class time_index
+#     __init__()
+#     get_day_number()
+#     get_date_from_day_number()
+#     encode()
+#     to_datetime64()
+#     get_datetime()
+#     index_range()
+#
+#------------------------------------------------------------------------
+class coord_index:
+    #--------------------------------------------------------------------
+    def __init__(self, values, rtol=1e-5):
+
+        #-----------------------------------------------------
+        # Note: kind is one of 'regular', 'sorted' or
+        #       'unsorted'.  A regular index doesn't keep
+        #       a copy of the values, just (start, step, n).
+        #-----------------------------------------------------
+        values = np.asarray( values, dtype='float64' ).ravel()
+        n = values.size
+        self.n = n
+        self.min = values.min() if (n > 0) else None
+        self.max = values.max() if (n > 0) else None
+        self.values = None
+        self.start  = None
+        self.step   = None
+
+        if (n < 2):
+            self.kind = 'sorted'
+            self.ascending = True
+            self.values = values
+            return
+
+        diffs = np.diff( values )
+        if np.all( diffs > 0 ):
+            self.ascending = True
+        elif np.all( diffs < 0 ):
+            self.ascending = False
+        else:
+            self.kind = 'unsorted'
+            self.ascending = None
+            self.values = values
+            return
+
+        #-------------------------------------------------
+        # Is the spacing constant, to within tolerance ?
+        #-------------------------------------------------
+        step = (values[-1] - values[0]) / (n - 1)
+        if np.all( np.abs(diffs - step) <= (rtol * np.abs(step)) ):
+            self.kind  = 'regular'
+            self.start = values[0]
+            self.step  = step
+        else:
+            self.kind   = 'sorted'
+            self.values = values
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def get_values(self):
+
+        if (self.kind == 'regular'):
+            return self.start + (self.step * np.arange( self.n ))
+        else:
+            return self.values
+
+    #   get_values()
+    #--------------------------------------------------------------------
+    def index_range(self, vmin, vmax):
+
+        #----------------------------------------------------
+        # Return (i1, i2) such that values[i1:i2] are all of
+        # the values with vmin <= value <= vmax.  Note that
+        # i2 is exclusive, as for a Python slice.  If there
+        # are no such values, then i1 == i2.
+        #----------------------------------------------------
+        # vmin and vmax may also be arrays, to resolve many
+        # ranges against the same axis at once.
+        #----------------------------------------------------
+        if (self.n == 0):
+            return (0, 0)
+        if (self.kind == 'regular'):
+            (i1, i2) = self.regular_index_range( vmin, vmax )
+        elif (self.kind == 'sorted'):
+            (i1, i2) = self.sorted_index_range( vmin, vmax )
+        else:
+            (i1, i2) = self.unsorted_index_range( vmin, vmax )
+
+        i1 = np.clip( i1, 0, self.n )
+        i2 = np.clip( i2, i1, self.n )
+        if (np.ndim(i1) == 0):
+            return (int(i1), int(i2))
+        return (i1.astype('int64'), i2.astype('int64'))
+
+    #   index_range()
+    #--------------------------------------------------------------------
+    def regular_index_range(self, vmin, vmax):
+
+        #------------------------------------------------
+        # Values are (start + k*step), so indices can be
+        # computed directly.  For a descending axis,
+        # step < 0, and vmax gives the first index.
+        #------------------------------------------------
+        eps = 1e-9
+        if (self.step > 0):
+            (v1, v2) = (vmin, vmax)
+        else:
+            (v1, v2) = (vmax, vmin)
+        i1 = np.ceil( ((np.asarray(v1) - self.start) / self.step) - eps )
+        i2 = np.floor( ((np.asarray(v2) - self.start) / self.step) + eps ) + 1
+        return (i1, i2)
+
+    #   regular_index_range()
+    #--------------------------------------------------------------------
+    def sorted_index_range(self, vmin, vmax):
+
+        if (self.ascending):
+            i1 = np.searchsorted( self.values, vmin, side='left' )
+            i2 = np.searchsorted( self.values, vmax, side='right' )
+        else:
+            #------------------------------------------------
+            # Search the reversed (ascending) values, then
+            # convert to indices into the original values.
+            #------------------------------------------------
+            rev = self.values[::-1]
+            j1 = np.searchsorted( rev, vmin, side='left' )
+            j2 = np.searchsorted( rev, vmax, side='right' )
+            i1 = (self.n - j2)
+            i2 = (self.n - j1)
+        return (i1, i2)
+
+    #   sorted_index_range()
+    #--------------------------------------------------------------------
+    def unsorted_index_range(self, vmin, vmax):
+
+        #-------------------------------------------------
+        # Fall back to a boolean mask.  Returns the first
+        # and (last + 1) indices of values in range.
+        #-------------------------------------------------
+        if (np.ndim(vmin) > 0):
+            pairs = [self.unsorted_index_range( a, b )
+                     for (a, b) in zip(np.ravel(vmin), np.ravel(vmax))]
+            i1 = np.array( [p[0] for p in pairs] )
+            i2 = np.array( [p[1] for p in pairs] )
+            return (i1, i2)
+
+        w = np.logical_and( self.values >= vmin, self.values <= vmax )
+        indices = np.flatnonzero( w )
+        if (indices.size == 0):
+            return (0, 0)
+        return (indices[0], indices[-1] + 1)
+
+    #   unsorted_index_range()
+#------------------------------------------------------------------------
+def lon_index_ranges( lon_index, minlon, maxlon, period=360.0 ):
+
+    #-----------------------------------------------------------
+    # Note: Longitude is periodic, so a box from minlon to
+    #       maxlon (going east) may cross the "seam" of the
+    #       data grid, e.g. 180 for lons in [-180,180) or 0
+    #       for lons in [0,360).  Then it is split into two
+    #       index ranges: one that ends at the east edge of
+    #       the grid and one that starts at its west edge.
+    #       Returns a list of (i1, i2), west to east, with
+    #       i2 exclusive.  The list is empty if no lons are
+    #       in the box.  Also works if minlon > maxlon, as
+    #       for a box from 170 to -170.
+    #-----------------------------------------------------------
+    minlon = float( minlon )
+    maxlon = float( maxlon )
+    if (lon_index.n == 0):
+        return []
+    width = (maxlon - minlon)
+    if (width < 0):
+        width += period
+    if (width >= period):
+        return [ (0, lon_index.n) ]
+
+    #------------------------------------------------
+    # Shift the box so that it starts within one
+    # period east of the grid's smallest longitude
+    #------------------------------------------------
+    west   = lon_index.min
+    lon1   = west + ((minlon - west) % period)
+    lon2   = lon1 + width
+    ranges = list()
+    (i1, i2) = lon_index.index_range( lon1, min(lon2, west + period) )
+    if (i1 < i2):
+        ranges.append( (i1, i2) )
+    if (lon2 >= west + period):
+        (i1, i2) = lon_index.index_range( west, lon2 - period )
+        if (i1 < i2):
+            ranges.append( (i1, i2) )
+    return ranges
+
+#   lon_index_ranges()
+#------------------------------------------------------------------------
+def unwrap_lons( lons, period=360.0 ):
+
+    #-----------------------------------------------------
+    # Note: After the pieces of a box that crosses the
+    #       seam are stitched together, the lons jump
+    #       back by one period, e.g. [..., 359, 0, 1].
+    #       Add period after the jump, so the lons are in
+    #       continuous order, e.g. [..., 359, 360, 361].
+    #-----------------------------------------------------
+    lons = np.array( lons )
+    jumps = np.flatnonzero( np.diff(lons) < 0 )
+    if (jumps.size > 0):
+        lons[ jumps[0] + 1: ] += period
+    return lons
+
+#   unwrap_lons()
+#------------------------------------------------------------------------
+def days_from_civil( y, m, d ):
+
+    #----------------------------------------------------
+    # Days since 1970-01-01 in the proleptic Gregorian
+    # calendar.  Works for year 0 and negative years,
+    # and with numpy arrays for y, m and d.
+    # See:  http://howardhinnant.github.io/date_algorithms.html
+    #----------------------------------------------------
+    y = np.asarray(y, dtype='int64')
+    m = np.asarray(m, dtype='int64')
+    d = np.asarray(d, dtype='int64')
+    y   = y - (m <= 2)
+    era = np.floor_divide( y, 400 )
+    yoe = y - (era * 400)
+    mp  = np.where( m > 2, m - 3, m + 9 )
+    doy = ((153 * mp) + 2) // 5 + (d - 1)
+    doe = (yoe * 365) + (yoe // 4) - (yoe // 100) + doy
+    return (era * 146097) + doe - 719468
+
+#   days_from_civil()
+#------------------------------------------------------------------------
+def days_from_julian( y, m, d ):
+
+    #----------------------------------------------------
+    # Days since 1970-01-01 (Gregorian) for a date in
+    # the Julian calendar, in which every 4th year is a
+    # leap year (also 1900 and 2100), so the same day
+    # has the same number as in days_from_civil().  As
+    # there, the year starts in March, so a leap day is
+    # the last day of a year, and the calendar repeats
+    # every 4 years (1461 days).
+    #----------------------------------------------------
+    y = np.asarray(y, dtype='int64')
+    m = np.asarray(m, dtype='int64')
+    d = np.asarray(d, dtype='int64')
+    y   = y - (m <= 2)
+    era = np.floor_divide( y, 4 )
+    yoe = y - (era * 4)
+    mp  = np.where( m > 2, m - 3, m + 9 )
+    doy = ((153 * mp) + 2) // 5 + (d - 1)
+    doe = (yoe * 365) + doy
+    return (era * 1461) + doe - 719470
+
+#   days_from_julian()
+#------------------------------------------------------------------------
+def julian_from_days( days ):
+
+    #-------------------------------------------------
+    # Inverse of days_from_julian(), as numpy arrays
+    # (y, m, d).
+    #-------------------------------------------------
+    days = np.asarray( days, dtype='int64' ) + 719470
+    era  = np.floor_divide( days, 1461 )
+    doe  = days - (era * 1461)
+    yoe  = np.minimum( doe // 365, 3 )
+    doy  = doe - (yoe * 365)
+    mp   = ((5 * doy) + 2) // 153
+    d    = doy - ((153 * mp) + 2) // 5 + 1
+    m    = np.where( mp < 10, mp + 3, mp - 9 )
+    y    = (era * 4) + yoe + (m <= 2)
+    return (y, m, d)
+
+#   julian_from_days()
+#------------------------------------------------------------------------
+def get_calendar_name( calendar ):
+
+    #-----------------------------------------------------
+    # Map CF calendar names to the ones used here.
+    # Note: The mixed "standard" calendar is treated as
+    #       proleptic Gregorian, which only differs for
+    #       dates before 1582-10-15.  "julian" is not the
+    #       same: its dates are now 13 days behind.
+    #-----------------------------------------------------
+    calendar = str(calendar).strip().lower()
+    name_map = {
+    'standard':'standard', 'gregorian':'standard',
+    'proleptic_gregorian':'standard', 'julian':'julian',
+    'noleap':'noleap', '365_day':'noleap',
+    'all_leap':'all_leap', '366_day':'all_leap',
+    '360_day':'360_day' }
+    if (calendar not in name_map):
+        raise ValueError('Unsupported calendar: ' + calendar)
+    return name_map[ calendar ]
+
+#   get_calendar_name()
+#------------------------------------------------------------------------
+def parse_time_units( units_str ):
+
+    #-------------------------------------------------------
+    # Split a units string like "hours since 1800-1-1 00:00"
+    # into (seconds per unit, (y, m, d, h, mm, s), offset),
+    # where offset is the time zone offset of the origin
+    # from UTC, in seconds (e.g. -21600 for "-06:00").
+    #-------------------------------------------------------
+    # Note: "months since" and "years since" are not
+    #       supported, since CF defines them as a fixed
+    #       fraction of a year, not calendar months.
+    #-------------------------------------------------------
+    if ('since' not in units_str):
+        raise ValueError('Time units string has no "since" part.')
+    parts = units_str.split('since')
+    units = parts[0].strip().lower()
+    secs_per_unit_map = {
+    'second':1.0, 'sec':1.0, 's':1.0, 'minute':60.0, 'min':60.0,
+    'hour':3600.0, 'hr':3600.0, 'h':3600.0,
+    'day':86400.0, 'd':86400.0, 'week':604800.0 }
+    if (units.endswith('s')) and (units[:-1] in secs_per_unit_map):
+        units = units[:-1]
+    if (units not in secs_per_unit_map):
+        raise ValueError('Unsupported time units: ' + units)
+
+    #--------------------------------------------------
+    # Origin may be "1800-1-1", "1800-01-01 00:00:00",
+    # "1800-01-01T00:00:00Z" or have a time zone part,
+    # e.g. "00:00:00+00:00", "00:00 -6:00" or "UTC".
+    #--------------------------------------------------
+    origin = re.sub( r'(\d)T(\d)', r'\1 \2', parts[1].strip() )
+    origin = re.sub( r'(\d)Z$', r'\1', origin )
+    fields = origin.split()
+    tz_str = ''
+    if (len(fields) > 1) and (fields[1][:1].isalpha()):
+        #-------------------------------------
+        # No time of day, e.g. "1800-1-1 UTC"
+        #-------------------------------------
+        tz_str    = fields[1]
+        fields[1] = ''
+    elif (len(fields) > 1):
+        match = re.match( r'^([0-9:.]*)([+-].*)?$', fields[1] )
+        if (match is not None) and (match.group(2) is not None):
+            fields[1] = match.group(1)
+            tz_str    = match.group(2)
+        elif (len(fields) > 2):
+            tz_str = fields[2]
+    offset = 0
+    if (tz_str.upper() not in ['', 'UTC', 'GMT']):
+        match = re.match( r'^([+-])(\d{1,2}):?(\d{2})?$', tz_str )
+        if (match is None):
+            raise ValueError('Unsupported time zone: ' + tz_str)
+        offset = (int(match.group(2)) * 3600) + (int(match.group(3) or 0) * 60)
+        if (match.group(1) == '-'):
+            offset = -offset
+    date_parts = fields[0].split('-')
+    if (date_parts[0] == ''):
+        #--------------------------
+        # Negative year, e.g. -4712
+        #--------------------------
+        date_parts = ['-' + date_parts[1]] + date_parts[2:]
+    y  = int( date_parts[0] )
+    m  = int( date_parts[1] ) if (len(date_parts) > 1) else 1
+    d  = int( date_parts[2] ) if (len(date_parts) > 2) else 1
+    (hh, mm, ss) = (0, 0, 0.0)
+    if (len(fields) > 1) and (fields[1] != ''):
+        time_parts = fields[1].split(':')
+        hh = int( time_parts[0] )
+        mm = int( time_parts[1] ) if (len(time_parts) > 1) else 0
+        ss = float( time_parts[2] ) if (len(time_parts) > 2) else 0.0
+    return (secs_per_unit_map[ units ], (y, m, d, hh, mm, ss), offset)
+
+#   parse_time_units()
+#------------------------------------------------------------------------
+class time_index:
+    #--------------------------------------------------------------------
+    def __init__(self, values, units_str, calendar='standard'):
+
+        #----------------------------------------------------
+        # Note: values are "time since" an origin, in the
+        #       units given by units_str, as in CF metadata.
+        #       They are indexed with a coord_index, so an
+        #       irregular or monthly axis works, too.
+        #----------------------------------------------------
+        self.values    = np.asarray( values, dtype='float64' ).ravel()
+        self.calendar  = get_calendar_name( calendar )
+        (self.secs_per_unit, self.origin, offset) = parse_time_units( units_str )
+        (y, m, d, hh, mm, ss) = self.origin
+        self.origin_day  = self.get_day_number( y, m, d )
+        #------------------------------------------------
+        # Origin in UTC, e.g. "00:00:00+05:00" is 19:00
+        # UTC on the day before.
+        #------------------------------------------------
+        self.origin_secs = (hh * 3600.0) + (mm * 60.0) + ss - offset
+        self.index = coord_index( self.values )
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def get_day_number(self, y, m, d):
+
+        #-----------------------------------------------
+        # Count of days from a fixed day, in calendar.
+        # Works with scalars or numpy arrays.
+        #-----------------------------------------------
+        cum_days = {
+        'noleap':   np.array([0,31,59,90,120,151,181,212,243,273,304,334]),
+        'all_leap': np.array([0,31,60,91,121,152,182,213,244,274,305,335]) }
+        y = np.asarray(y, dtype='int64')
+        m = np.asarray(m, dtype='int64')
+        d = np.asarray(d, dtype='int64')
+        if (self.calendar == 'standard'):
+            return days_from_civil( y, m, d )
+        elif (self.calendar == 'julian'):
+            return days_from_julian( y, m, d )
+        elif (self.calendar == 'noleap'):
+            return (365 * y) + cum_days['noleap'][m - 1] + (d - 1)
+        elif (self.calendar == 'all_leap'):
+            return (366 * y) + cum_days['all_leap'][m - 1] + (d - 1)
+        else:
+            return (360 * y) + (30 * (m - 1)) + (d - 1)
+
+    #   get_day_number()
+    #--------------------------------------------------------------------
+    def get_date_from_day_number(self, day):
+
+        #------------------------------------------------------
+        # Inverse of get_day_number(), for the non-standard
+        # calendars, as numpy arrays (y, m, d).
+        #------------------------------------------------------
+        day = np.asarray( day, dtype='int64' )
+        if (self.calendar == 'julian'):
+            return julian_from_days( day )
+        if (self.calendar == '360_day'):
+            (y, r) = np.divmod( day, 360 )
+            return (y, (r // 30) + 1, (r % 30) + 1)
+        if (self.calendar == 'noleap'):
+            days_per_year = 365
+            cum = np.array([0,31,59,90,120,151,181,212,243,273,304,334])
+        else:
+            days_per_year = 366
+            cum = np.array([0,31,60,91,121,152,182,213,244,274,305,335])
+        (y, r) = np.divmod( day, days_per_year )
+        m = np.searchsorted( cum, r, side='right' )
+        d = r - cum[m - 1] + 1
+        return (y, m, d)
+
+    #   get_date_from_day_number()
+    #--------------------------------------------------------------------
+    def encode(self, datetime_obj):
+
+        #------------------------------------------------
+        # Convert a datetime object to "time since" the
+        # origin, in the units and calendar of the axis.
+        #------------------------------------------------
+        dt = datetime_obj
+        day  = self.get_day_number( dt.year, dt.month, dt.day )
+        secs = (dt.hour * 3600.0) + (dt.minute * 60.0) + dt.second
+        secs += (dt.microsecond / 1e6)
+        total_secs = ((day - self.origin_day) * 86400.0) + \
+                     (secs - self.origin_secs)
+        return float( total_secs / self.secs_per_unit )
+
+    #   encode()
+    #--------------------------------------------------------------------
+    def to_datetime64(self, values=None):
+
+        #--------------------------------------------------------
+        # Convert all time values to numpy datetime64 in one
+        # vectorized pass.  For the 360_day and julian
+        # calendars, days that don't exist in the real
+        # calendar (e.g. Feb. 30, or Feb. 29, 1900) are
+        # mapped to the last day of that month.
+        #--------------------------------------------------------
+        if (values is None):
+            values = self.values
+        secs = (np.asarray(values, dtype='float64') * self.secs_per_unit)
+        secs = secs + self.origin_secs
+        (days, sod) = np.divmod( secs, 86400.0 )
+        days = days.astype('int64') + self.origin_day
+        usecs = np.round( sod * 1e6 ).astype('int64')
+
+        if (self.calendar == 'standard'):
+            day64 = days.astype('datetime64[D]')
+        else:
+            (y, m, d) = self.get_date_from_day_number( days )
+            months = ((y - 1970) * 12) + (m - 1)
+            month64 = months.astype('datetime64[M]')
+            n_days  = ((month64 + 1).astype('datetime64[D]') -
+                       month64.astype('datetime64[D]')).astype('int64')
+            d = np.minimum( d, n_days )
+            day64 = month64.astype('datetime64[D]') + (d - 1)
+        return day64.astype('datetime64[us]') + usecs.astype('timedelta64[us]')
+
+    #   to_datetime64()
+    #--------------------------------------------------------------------
+    def get_datetime(self, value):
+
+        #---------------------------------------------
+        # Convert one time value to a datetime object,
+        # rounded to the nearest second.
+        #---------------------------------------------
+        dt64 = self.to_datetime64( np.array([value]) )[0]
+        dt64 = (dt64 + np.timedelta64(500000, 'us')).astype('datetime64[s]')
+        return dt64.item()
+
+    #   get_datetime()
+    #--------------------------------------------------------------------
+    def index_range(self, start_datetime_obj, end_datetime_obj):
+
+        #------------------------------------------------------
+        # Return (i1, i2) such that times[i1:i2] are all of
+        # the times from start to end, inclusive.  Uses a
+        # binary search on the numeric time values.
+        #------------------------------------------------------
+        t1 = self.encode( start_datetime_obj )
+        t2 = self.encode( end_datetime_obj )
+        return self.index.index_range( t1, t2 )
+
+    #   index_range()
+    #--------------------------------------------------------------------
@@ -0,0 +1,631 @@
+"""
+This module defines functions and classes that are used by the BALTO
+GUI app to write downloaded data to local files, instead of keeping
+all of it in memory.  Each slab is written as soon as it arrives, so
+downloads that are bigger than memory can finish, and reading a
+subset later is a cheap local read.  The netCDF4 package is only
+needed when a netCDF file is written or read.  A "chunk store" is a
+directory with one compressed file per chunk and a JSON file with
+the metadata, so that a reader only touches the chunks it needs.
+2D grids can be exported to a cloud-optimized GeoTIFF, which needs
+the optional rasterio package.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import itertools
+import json
+import os
+import tempfile
+import threading
+import zlib
+import numpy as np
+
+#------------------------------------------------------------------------
+#
+# get_nc_format()
+# get_nc_attributes()
+# get_native_dtype()
+# get_chunk_shape()
+#
+# class netcdf_writer
+#     __init__()
+#     create_coord_var()
+#     write_slab()
+#     close()
+#
+# open_netcdf()
+#
+# get_json_value()
+# get_chunk_selection()
+# create_chunk_store()
+#
+# class chunk_store
+#     __init__()
+#     load_metadata()
+#     save_metadata()
+#     get_coords()
+#     get_chunk_path()
+#     get_chunk_shape()
+#     get_chunk_lock()
+#     read_chunk()
+#     write_chunk()
+#     __getitem__()
+#     write_region()
+#     append()
+#
+# get_overview_levels()
+# write_geotiff()
+#
+#------------------------------------------------------------------------
+def get_nc_format( download_format ):
+
+    #--------------------------------------------------
+    # Map a choice in the "Download Format" dropdown
+    # to a netCDF4 file format.  None if not netCDF.
+    #--------------------------------------------------
+    formats = {'netCDF': 'NETCDF4_CLASSIC', 'netCDF4': 'NETCDF4'}
+    return formats.get( download_format, None )
+
+#   get_nc_format()
+#------------------------------------------------------------------------
+def get_nc_attributes( atts ):
+
+    #-----------------------------------------------------
+    # Note: pydap attribute dictionaries can contain
+    #       nested dictionaries (e.g. "DODS"), which are
+    #       not valid netCDF attributes.  _FillValue must
+    #       be set when a variable is created, so it is
+    #       also skipped here.
+    #-----------------------------------------------------
+    nc_atts = dict()
+    for (key, value) in atts.items():
+        if (key == '_FillValue') or isinstance( value, dict ):
+            continue
+        if isinstance( value, (list, tuple) ):
+            value = np.array( value )
+        nc_atts[ key ] = value
+    return nc_atts
+
+#   get_nc_attributes()
+#------------------------------------------------------------------------
+def get_native_dtype( dtype ):
+
+    #-------------------------------------------------
+    # OpenDAP data is big-endian, e.g. ">i2", but
+    # the file should use the native byte order.
+    #-------------------------------------------------
+    return np.dtype( dtype ).newbyteorder('=')
+
+#   get_native_dtype()
+#------------------------------------------------------------------------
+def get_chunk_shape( shape, itemsize, target_bytes=1000000 ):
+
+    #-----------------------------------------------------------
+    # Note: Chunks span whole grids (all lats and lons) and
+    #       as many time steps as fit in about target_bytes,
+    #       so that both maps and time series are cheap to
+    #       read.  Big grids are halved along their longest
+    #       spatial axis until one grid fits.
+    #-----------------------------------------------------------
+    chunk = [max(n, 1) for n in shape]
+    if (len(chunk) == 0):
+        return None
+    while (itemsize * int( np.prod( chunk[1:] ) ) > target_bytes):
+        k = 1 + int( np.argmax( chunk[1:] ) )
+        if (chunk[k] == 1):
+            break
+        chunk[k] = (chunk[k] + 1) // 2
+    step_bytes = itemsize * int( np.prod( chunk[1:] ) )
+    chunk[0] = max( 1, min( chunk[0], target_bytes // max(step_bytes, 1) ) )
+    return tuple( chunk )
+
+#   get_chunk_shape()
+#------------------------------------------------------------------------
+class netcdf_writer:
+    #--------------------------------------------------------------------
+    def __init__(self, path, var_name, dims, shape, dtype,
+                 atts=None, coord_atts=None, global_atts=None,
+                 nc_format='NETCDF4', complevel=4):
+
+        #-----------------------------------------------------------
+        # Note: Creates a netCDF file with one (packed) variable
+        #       and a coordinate variable for each dimension.
+        #       Attributes such as scale_factor, add_offset and
+        #       missing_value are copied from the source, so the
+        #       netCDF4 package unpacks the values when read.
+        #       coord_atts is a dictionary of attribute
+        #       dictionaries, keyed by dimension name.
+        #-----------------------------------------------------------
+        import netCDF4
+
+        if (atts is None):
+            atts = dict()
+        if (coord_atts is None):
+            coord_atts = dict()
+        if (global_atts is None):
+            global_atts = dict()
+        dtype = get_native_dtype( dtype )
+
+        self.path     = path
+        self.var_name = var_name
+        self.dims     = dims
+        self.dataset  = netCDF4.Dataset( path, 'w', format=nc_format )
+        self.dataset.setncatts( get_nc_attributes( global_atts ) )
+
+        for (dim, n) in zip(dims, shape):
+            self.dataset.createDimension( dim, n )
+        self.coord_atts = coord_atts
+        self.coord_vars = None   # (created by first write_slab)
+
+        fill_value = atts.get( '_FillValue', None )
+        if (fill_value is not None):
+            fill_value = np.array( fill_value, dtype=dtype )
+        chunk_shape = get_chunk_shape( shape, dtype.itemsize )
+        self.var = self.dataset.createVariable( var_name, dtype, dims,
+                                    zlib=True, complevel=complevel,
+                                    shuffle=True, chunksizes=chunk_shape,
+                                    fill_value=fill_value )
+        self.var.setncatts( get_nc_attributes( atts ) )
+        #------------------------------------------------------
+        # Values are written packed, exactly as downloaded.
+        #------------------------------------------------------
+        self.var.set_auto_maskandscale( False )
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def create_coord_var(self, dim, dtype):
+
+        #-------------------------------------------------
+        # Only dimensions that have a variable with the
+        # same name in the source get a coordinate var.
+        #-------------------------------------------------
+        if (dim not in self.coord_atts):
+            return None
+        dtype = get_native_dtype( dtype )
+        coord_var = self.dataset.createVariable( dim, dtype, (dim,) )
+        coord_var.setncatts( get_nc_attributes( self.coord_atts[dim] ) )
+        coord_var.set_auto_maskandscale( False )
+        return coord_var
+
+    #   create_coord_var()
+    #--------------------------------------------------------------------
+    def write_slab(self, k1, k2, var, maps=None):
+
+        #-----------------------------------------------------
+        # Write one slab, i.e. var[k1:k2] along the first
+        # axis, and its part of the first coordinate.  The
+        # other coordinates are written with the first slab.
+        #-----------------------------------------------------
+        self.var[k1:k2] = var
+        if (maps is None) or (len(maps) == 0):
+            return
+        FIRST_SLAB = (self.coord_vars is None)
+        if (FIRST_SLAB):
+            self.coord_vars = [ self.create_coord_var( dim, m.dtype )
+                                for (dim, m) in zip(self.dims, maps) ]
+        for k in range(len(self.coord_vars)):
+            coord_var = self.coord_vars[k]
+            if (coord_var is None):
+                continue
+            if (k == 0):
+                coord_var[k1:k2] = maps[0]
+            elif (FIRST_SLAB):
+                coord_var[:] = maps[k]
+
+    #   write_slab()
+    #--------------------------------------------------------------------
+    def close(self):
+
+        if (self.dataset is not None):
+            self.dataset.close()
+            self.dataset = None
+
+    #   close()
+#------------------------------------------------------------------------
+def open_netcdf( path ):
+
+    #----------------------------------------------------
+    # Open a file written by netcdf_writer, read-only.
+    # Values are read lazily, e.g. ds['sst'][0:10].
+    #----------------------------------------------------
+    import netCDF4
+
+    return netCDF4.Dataset( path, 'r' )
+
+#   open_netcdf()
+#------------------------------------------------------------------------
+def get_json_value( value ):
+
+    #-------------------------------------------------
+    # Convert numpy values and arrays in attributes
+    # to types that can be saved in a JSON file.
+    #-------------------------------------------------
+    if isinstance( value, dict ):
+        return dict( [(k, get_json_value(v)) for (k, v) in value.items()] )
+    if isinstance( value, (list, tuple, np.ndarray) ):
+        return [get_json_value(v) for v in value]
+    if isinstance( value, np.generic ):
+        return value.item()
+    if isinstance( value, bytes ):
+        return value.decode('utf-8', 'replace')
+    return value
+
+#   get_json_value()
+#------------------------------------------------------------------------
+def get_chunk_selection( key, shape ):
+
+    #------------------------------------------------------
+    # Convert a key like [0:10, 5, :] to one array of
+    # (global) indices for each dimension.  Also returns
+    # the dimensions that were given as an int, which
+    # are dropped from the result, like numpy does.
+    #------------------------------------------------------
+    if not(isinstance( key, tuple )):
+        key = (key,)
+    key = key + (slice(None),) * (len(shape) - len(key))
+    selection = list()
+    int_dims  = list()
+    for (d, (k, n)) in enumerate(zip(key, shape)):
+        if isinstance( k, slice ):
+            selection.append( np.arange( *k.indices(n) ) )
+        else:
+            k = int(k)
+            if (k < 0):
+                k += n
+            if (k < 0) or (k >= n):
+                raise IndexError('index out of range for dimension ' + str(d))
+            selection.append( np.array([k]) )
+            int_dims.append( d )
+    return (selection, int_dims)
+
+#   get_chunk_selection()
+#------------------------------------------------------------------------
+def create_chunk_store( path, shape, dtype, chunks, dims=None,
+                        attributes=None, coords=None,
+                        coord_attributes=None, fill_value=None,
+                        complevel=4 ):
+
+    #-----------------------------------------------------------
+    # Note: Create an empty chunk store in the directory path.
+    #       coords is a dictionary of 1D arrays, keyed by
+    #       dimension name, e.g. {'time':..., 'lat':...}.
+    #       A store that already exists there is replaced.
+    #-----------------------------------------------------------
+    os.makedirs( path, exist_ok=True )
+    for e in os.scandir( path ):
+        if (e.name.endswith('.chunk')) or \
+           (e.name == chunk_store.metadata_name):
+            os.remove( e.path )
+
+    dtype = get_native_dtype( dtype )
+    if (dims is None):
+        dims = ['dim' + str(k) for k in range(len(shape))]
+    if (fill_value is None):
+        fill_value = (np.nan if (dtype.kind == 'f') else 0)
+    meta = {'shape': [int(n) for n in shape],
+            'chunks': [int(c) for c in chunks],
+            'dtype': dtype.str,
+            'dims': list(dims),
+            'fill_value': dtype.type( fill_value ).item(),
+            'complevel': complevel,
+            'attributes': get_json_value( attributes or dict() ),
+            'coords': get_json_value( coords or dict() ),
+            'coord_attributes': get_json_value( coord_attributes or dict() ) }
+    store = chunk_store( path, meta=meta )
+    store.save_metadata()
+    return store
+
+#   create_chunk_store()
+#------------------------------------------------------------------------
+class chunk_store:
+
+    metadata_name = 'metadata.json'
+
+    #--------------------------------------------------------------------
+    def __init__(self, path, meta=None):
+
+        #--------------------------------------------------------
+        # Note: Opens an existing chunk store, or wraps the
+        #       metadata of a new one (see create_chunk_store).
+        #       Each chunk is saved in a file named by its
+        #       position in the grid of chunks, e.g. "2.0.1",
+        #       as zlib-compressed bytes in C order.  Chunks
+        #       that were never written read as fill_value.
+        #--------------------------------------------------------
+        # self.lock guards the shape and the metadata.  Chunks
+        # that are only partly written are read, updated and
+        # written back while holding their own lock (see
+        # get_chunk_lock()), so several threads can write or
+        # append at once, and only the metadata is serialized.
+        #--------------------------------------------------------
+        self.path = path
+        self.lock = threading.Lock()
+        self.chunk_locks = dict()
+        if (meta is None):
+            meta = self.load_metadata()
+        self.meta       = meta
+        self.shape      = tuple( meta['shape'] )
+        self.chunks     = tuple( meta['chunks'] )
+        self.dtype      = np.dtype( meta['dtype'] )
+        self.dims       = meta['dims']
+        self.ndim       = len( self.shape )
+        self.attributes = meta['attributes']
+        self.fill_value = meta['fill_value']
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def load_metadata(self):
+
+        with open( os.path.join(self.path, self.metadata_name), 'r' ) as f:
+            return json.load( f )
+
+    #   load_metadata()
+    #--------------------------------------------------------------------
+    def save_metadata(self):
+
+        self.meta['shape'] = list( self.shape )
+        (fd, tmp_path) = tempfile.mkstemp( dir=self.path, suffix='.tmp' )
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( self.meta, f )
+        os.replace( tmp_path, os.path.join(self.path, self.metadata_name) )
+
+    #   save_metadata()
+    #--------------------------------------------------------------------
+    def get_coords(self, dim):
+
+        values = self.meta['coords'].get( dim, None )
+        if (values is None):
+            return None
+        return np.array( values )
+
+    #   get_coords()
+    #--------------------------------------------------------------------
+    def get_chunk_path(self, chunk_pos):
+
+        name = '.'.join( [str(c) for c in chunk_pos] ) + '.chunk'
+        return os.path.join( self.path, name )
+
+    #   get_chunk_path()
+    #--------------------------------------------------------------------
+    def get_chunk_shape(self, chunk_pos):
+
+        #------------------------------------------------
+        # Chunks at the edges of the array may be
+        # smaller than self.chunks.  Chunks along the
+        # first axis are always full size, so that
+        # they stay valid when the array grows.
+        #------------------------------------------------
+        shape = [self.chunks[0]]
+        for d in range(1, self.ndim):
+            start = chunk_pos[d] * self.chunks[d]
+            shape.append( min( self.chunks[d], self.shape[d] - start ) )
+        return tuple( shape )
+
+    #   get_chunk_shape()
+    #--------------------------------------------------------------------
+    def get_chunk_lock(self, chunk_pos):
+
+        with self.lock:
+            if (chunk_pos not in self.chunk_locks):
+                self.chunk_locks[ chunk_pos ] = threading.Lock()
+            return self.chunk_locks[ chunk_pos ]
+
+    #   get_chunk_lock()
+    #--------------------------------------------------------------------
+    def read_chunk(self, chunk_pos):
+
+        shape = self.get_chunk_shape( chunk_pos )
+        try:
+            with open( self.get_chunk_path( chunk_pos ), 'rb' ) as f:
+                data = zlib.decompress( f.read() )
+        except FileNotFoundError:
+            return np.full( shape, self.fill_value, dtype=self.dtype )
+        return np.frombuffer( data, dtype=self.dtype ).reshape( shape ).copy()
+
+    #   read_chunk()
+    #--------------------------------------------------------------------
+    def write_chunk(self, chunk_pos, chunk):
+
+        #----------------------------------------------------
+        # Write to a temporary file, then rename, so that
+        # readers never see a partial chunk.  Different
+        # chunks can be written by different threads.
+        #----------------------------------------------------
+        data = np.ascontiguousarray( chunk, dtype=self.dtype ).tobytes()
+        data = zlib.compress( data, self.meta['complevel'] )
+        (fd, tmp_path) = tempfile.mkstemp( dir=self.path, suffix='.tmp' )
+        with os.fdopen( fd, 'wb' ) as f:
+            f.write( data )
+        os.replace( tmp_path, self.get_chunk_path( chunk_pos ) )
+
+    #   write_chunk()
+    #--------------------------------------------------------------------
+    def __getitem__(self, key):
+
+        #------------------------------------------------------
+        # Read any sub-window, e.g. store[0:10, 5, :], by
+        # reading only the chunks that it overlaps.
+        #------------------------------------------------------
+        (selection, int_dims) = get_chunk_selection( key, self.shape )
+        out = np.empty( [s.size for s in selection], dtype=self.dtype )
+        chunk_ids = [ np.unique( s // c ) for (s, c) in zip(selection, self.chunks) ]
+        for chunk_pos in itertools.product( *chunk_ids ):
+            out_pos   = list()
+            local_pos = list()
+            for (s, c, p) in zip(selection, self.chunks, chunk_pos):
+                w = (s // c) == p
+                out_pos.append( np.flatnonzero( w ) )
+                local_pos.append( s[w] - (p * c) )
+            chunk = self.read_chunk( chunk_pos )
+            out[ np.ix_( *out_pos ) ] = chunk[ np.ix_( *local_pos ) ]
+        if (len(int_dims) > 0):
+            out = out.squeeze( axis=tuple(int_dims) )
+        return out
+
+    #   __getitem__()
+    #--------------------------------------------------------------------
+    def write_region(self, start, data):
+
+        #------------------------------------------------------
+        # Write data into the block that starts at index
+        # tuple start.  Chunks that are only partly covered
+        # are read first, then updated.
+        #------------------------------------------------------
+        data = np.asarray( data )
+        key  = tuple( [slice(i, i + n) for (i, n) in zip(start, data.shape)] )
+        (selection, int_dims) = get_chunk_selection( key, self.shape )
+        chunk_ids = [ np.unique( s // c ) for (s, c) in zip(selection, self.chunks) ]
+        for chunk_pos in itertools.product( *chunk_ids ):
+            data_pos  = list()
+            local_pos = list()
+            FULL = True
+            for (d, (s, c, p)) in enumerate(zip(selection, self.chunks, chunk_pos)):
+                w = (s // c) == p
+                data_pos.append( np.flatnonzero( w ) )
+                local_pos.append( s[w] - (p * c) )
+                if (d > 0):
+                    n_chunk = min( c, self.shape[d] - (p * c) )
+                else:
+                    n_chunk = c
+                FULL = FULL and (w.sum() == n_chunk)
+            if (FULL):
+                chunk = np.empty( self.get_chunk_shape( chunk_pos ),
+                                  dtype=self.dtype )
+                chunk[ np.ix_( *local_pos ) ] = data[ np.ix_( *data_pos ) ]
+                self.write_chunk( chunk_pos, chunk )
+                continue
+            with self.get_chunk_lock( chunk_pos ):
+                chunk = self.read_chunk( chunk_pos )
+                chunk[ np.ix_( *local_pos ) ] = data[ np.ix_( *data_pos ) ]
+                self.write_chunk( chunk_pos, chunk )
+
+    #   write_region()
+    #--------------------------------------------------------------------
+    def append(self, data, times=None):
+
+        #------------------------------------------------------
+        # Append data along the first (time) axis.  The
+        # other dimensions of data must match the store.
+        # times are appended to the first coordinate.
+        #------------------------------------------------------
+        # The rows are reserved under the lock, then the
+        # chunks are compressed and written without it, so
+        # appends from several threads run in parallel.
+        # Rows that another thread is still writing read
+        # as fill_value until it is done.
+        #------------------------------------------------------
+        data = np.asarray( data )
+        if (tuple(data.shape[1:]) != self.shape[1:]):
+            raise ValueError('data shape does not match chunk store.')
+        with self.lock:
+            k1 = self.shape[0]
+            k2 = k1 + data.shape[0]
+            self.shape = (k2,) + self.shape[1:]
+        self.write_region( (k1,) + (0,) * (self.ndim - 1), data )
+        with self.lock:
+            if (times is not None):
+                dim = self.dims[0]
+                all_times = self.meta['coords'].get( dim, [] )
+                all_times += [None] * (k2 - len(all_times))
+                all_times[k1:k2] = get_json_value( times )
+                self.meta['coords'][ dim ] = all_times
+            self.save_metadata()
+
+    #   append()
+#------------------------------------------------------------------------
+def get_overview_levels( shape, blocksize=256 ):
+
+    #----------------------------------------------------
+    # Overview factors 2, 4, 8, ... until the smallest
+    # overview fits in one block (tile).
+    #----------------------------------------------------
+    levels = list()
+    factor = 2
+    while (max(shape) / (factor // 2)) > blocksize:
+        levels.append( factor )
+        factor *= 2
+    return levels
+
+#   get_overview_levels()
+#------------------------------------------------------------------------
+def write_geotiff( path, grid, lats, lons, nodata=None,
+                   blocksize=256, compress='deflate',
+                   resampling='average' ):
+
+    #-----------------------------------------------------------
+    # Note: Writes a 2D grid with dimensions (lat, lon) to a
+    #       cloud-optimized GeoTIFF: tiled, compressed, with
+    #       internal overviews, and georeferenced (EPSG:4326)
+    #       from the lat and lon vectors, which are the grid
+    #       cell centers and must be regularly spaced.  The
+    #       file is first built in memory, with overviews, and
+    #       then copied so that the overviews come before the
+    #       full-resolution data, as in a COG.
+    #-----------------------------------------------------------
+    # A grid with irregular spacing, such as a Gaussian grid,
+    # can't be described by an affine transform, so it raises
+    # a ValueError instead of being written misplaced.  (The
+    # tolerance allows for float32 coordinates.)
+    #-----------------------------------------------------------
+    grid = np.asarray( grid )
+    lats = np.asarray( lats, dtype='float64' )
+    lons = np.asarray( lons, dtype='float64' )
+    if (grid.ndim != 2):
+        raise ValueError('write_geotiff() needs a 2D grid.')
+    (nrows, ncols) = grid.shape
+    if (lats.shape != (nrows,)) or (lons.shape != (ncols,)):
+        raise ValueError('write_geotiff() needs lats and lons that ' +
+                         'match the grid.')
+    for (name, values) in [('lats', lats), ('lons', lons)]:
+        steps = np.diff( values )
+        if (steps.size > 1) and \
+           not(np.allclose( steps, steps[0], rtol=1e-3, atol=0 )):
+            raise ValueError('write_geotiff() needs regularly spaced ' +
+                             name + '.')
+
+    import rasterio
+    import rasterio.shutil
+    from rasterio.enums import Resampling
+    from rasterio.io import MemoryFile
+    from rasterio.transform import from_origin
+
+    #------------------------------------------
+    # GeoTIFF rows go from north to south
+    #------------------------------------------
+    if (nrows > 1) and (lats[0] < lats[-1]):
+        grid = grid[::-1, :]
+        lats = lats[::-1]
+    dlat = abs(lats[0] - lats[-1]) / max(nrows - 1, 1)
+    dlon = abs(lons[-1] - lons[0]) / max(ncols - 1, 1)
+    west  = lons.min() - (dlon / 2.0)
+    north = lats.max() + (dlat / 2.0)
+    transform = from_origin( west, north, dlon, dlat )
+
+    profile = {'driver': 'GTiff', 'width': ncols, 'height': nrows,
+               'count': 1, 'dtype': get_native_dtype( grid.dtype ).name,
+               'crs': 'EPSG:4326', 'transform': transform,
+               'nodata': nodata, 'tiled': True,
+               'blockxsize': blocksize, 'blockysize': blocksize,
+               'compress': compress }
+
+    levels = get_overview_levels( grid.shape, blocksize )
+    with MemoryFile() as mem_file:
+        with mem_file.open( **profile ) as dst:
+            dst.write( grid, 1 )
+            if (len(levels) > 0):
+                dst.build_overviews( levels, Resampling[resampling] )
+                dst.update_tags( ns='rio_overview', resampling=resampling )
+        with mem_file.open() as src:
+            rasterio.shutil.copy( src, path, driver='GTiff',
+                                  copy_src_overviews=True, tiled=True,
+                                  blockxsize=blocksize,
+                                  blockysize=blocksize,
+                                  compress=compress )
+
+#   write_geotiff()
+#------------------------------------------------------------------------
@@ -0,0 +1,160 @@
+"""
+This module defines a buffered log for the message boxes of the
+BALTO GUI app, such as the download log and the datetime notes.
+Messages are kept in a ring buffer with a maximum number of lines,
+and the text of the widget is replaced at most a few times per
+second, instead of once per line.  Each message has a severity
+level, and the whole log can be exported as plain text.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import collections
+import threading
+import time
+
+#------------------------------------------------------------------------
+#
+# class log_sink
+#     __init__()
+#     get_level_number()
+#     write()
+#     flush()
+#     schedule_flush()
+#     clear()
+#     get_text()
+#     export()
+#
+#------------------------------------------------------------------------
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+#------------------------------------------------------------------------
+class log_sink:
+    #--------------------------------------------------------------------
+    def __init__(self, widget=None, max_lines=1000, min_interval=0.2,
+                 level='info'):
+
+        #-----------------------------------------------------------
+        # Note: widget is a widget with a "value" string, like a
+        #       Textarea.  Setting its value sends all of the
+        #       text to the browser, so it is set at most once
+        #       every min_interval seconds; lines written in the
+        #       meantime are flushed together by a timer.  Only
+        #       the last max_lines lines are kept, and only the
+        #       ones at or above level are shown.
+        #-----------------------------------------------------------
+        self.widget       = widget
+        self.max_lines    = max_lines
+        self.min_interval = min_interval
+        self.level        = level
+        self.lines        = collections.deque( maxlen=max_lines )
+        self.lock         = threading.RLock()
+        self.timer        = None
+        self.last_flush   = 0.0
+        self.n_dropped    = 0
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def get_level_number(self, level):
+
+        if (level not in LEVELS):
+            raise ValueError( 'Unknown log level: ' + str(level) )
+        return LEVELS[ level ]
+
+    #   get_level_number()
+    #--------------------------------------------------------------------
+    def write(self, msg, level='info'):
+
+        #-----------------------------------------------------
+        # msg is a string or a list of strings, one per line
+        #-----------------------------------------------------
+        number = self.get_level_number( level )
+        if not(isinstance( msg, list )):
+            msg = [ msg ]
+        with self.lock:
+            for string in msg:
+                if (len(self.lines) == self.max_lines):
+                    self.n_dropped += 1
+                self.lines.append( (number, level, str(string)) )
+            wait = self.min_interval - (time.time() - self.last_flush)
+            if (wait > 0):
+                self.schedule_flush( wait )
+                return
+        self.flush()
+
+    #   write()
+    #--------------------------------------------------------------------
+    def flush(self):
+
+        with self.lock:
+            if (self.timer is not None):
+                self.timer.cancel()
+                self.timer = None
+            self.last_flush = time.time()
+            if (self.widget is None):
+                return
+            text = self.get_text( level=self.level, DROPPED=True )
+            if (self.widget.value != text):
+                self.widget.value = text
+
+    #   flush()
+    #--------------------------------------------------------------------
+    def schedule_flush(self, wait):
+
+        #--------------------------------------------
+        # Note: Call with self.lock held.  At most
+        #       one flush is pending at a time.
+        #--------------------------------------------
+        if (self.timer is not None):
+            return
+        self.timer = threading.Timer( wait, self.flush )
+        self.timer.daemon = True
+        self.timer.start()
+
+    #   schedule_flush()
+    #--------------------------------------------------------------------
+    def clear(self):
+
+        with self.lock:
+            self.lines.clear()
+            self.n_dropped = 0
+        self.flush()
+
+    #   clear()
+    #--------------------------------------------------------------------
+    def get_text(self, level='debug', DROPPED=False):
+
+        #--------------------------------------------------------
+        # Return the lines at or above level, as plain text.
+        # Lines that are not "info" start with their level,
+        # e.g. "WARNING: ".
+        #--------------------------------------------------------
+        number = self.get_level_number( level )
+        with self.lock:
+            lines = list( self.lines )
+            n_dropped = self.n_dropped
+        text = ''
+        if (DROPPED) and (n_dropped > 0):
+            text += '(' + str(n_dropped) + ' earlier lines not shown)\n'
+        for (line_number, line_level, string) in lines:
+            if (line_number < number):
+                continue
+            if (line_level != 'info'):
+                string = line_level.upper() + ': ' + string
+            text += (string + '\n')
+        return text
+
+    #   get_text()
+    #--------------------------------------------------------------------
+    def export(self, path, level='debug'):
+
+        with open( path, 'w' ) as log_file:
+            log_file.write( self.get_text( level=level ) )
+        return path
+
+    #   export()
+#------------------------------------------------------------------------
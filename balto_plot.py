@@ -11,9 +11,11 @@ BALTO GUI app.  It should be included in the same directory as
 #
 #------------------------------------------------------------------------
 
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
+#------------------------------------------------------------------
+# matplotlib and cartopy are slow to import, so they are imported
+# by the functions that need them, on first use.  cartopy is only
+# needed for map projections (use_cartopy = True).
+#------------------------------------------------------------------
 import numpy as np
 
 #------------------------------------------------------------------------
@@ -34,6 +36,8 @@ def plot_data( x, y, xmin=None, xmax=None, ymin=None, ymax=None,
                y_name='y', y_units='',
                x_size=8,   y_size=4):
 
+    import matplotlib.pyplot as plt
+
     figure = plt.figure(1, figsize=(x_size, y_size))
     # fig, ax = plt.subplots( figsize=(x_size, y_size))
 
@@ -84,6 +88,7 @@ def histogram_equalize( grid, PLOT_NCS=False):
     ncs.astype('uint8');
     ############## ncs.astype('uint8') # no semi-colon at end ??????????
     if (PLOT_NCS):
+        import matplotlib.pyplot as plt
         plt.plot( ncs )
 
     flat = grid.flatten()
@@ -157,6 +162,8 @@ def get_map_projection( proj_name,
         satellite_height=35785831, cutoff=-30, approx=None,
         southern_hemisphere=False, zone=15):   #### numeric UTM zone
 
+    import cartopy.crs as ccrs
+
     proj_name = proj_name.lower()
     
     if (proj_name == 'albersequalarea'):
@@ -381,8 +388,11 @@ def show_grid_as_image( grid, long_name, extent=None,
     # See:  https://scitools.org.uk/cartopy/docs/latest/
     #               tutorials/understanding_transform.html
     #-------------------------------------------------------
+    import matplotlib.pyplot as plt
+
     use_cartopy = False
     if (use_cartopy):
+        import cartopy.crs as ccrs
         balto_crs = ccrs.PlateCarree()   # For Geographic lon/lat coordinates.
     
         #-------------------------
@@ -589,6 +599,9 @@ def show_grid_as_image_OLD( grid, long_name, extent=None,
     # See:  https://scitools.org.uk/cartopy/docs/latest/
     #               tutorials/understanding_transform.html
     #-------------------------------------------------------
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+
     balto_crs = ccrs.PlateCarree()   # For Geographic lon/lat coordinates.
     
     #-------------------------
@@ -0,0 +1,339 @@
+"""
+This module defines the retry layer that is shared by all network
+calls of the BALTO GUI app: listing files in a URL directory,
+opening a dataset, and fetching coordinates and data.  Transient
+failures (reset connections, timeouts, HTTP 5xx, 429) are retried
+with exponential backoff and full jitter, within a deadline for the
+whole call, and only for requests that are safe to repeat.  Counts
+of calls, retries and failures can be shown in the download log.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import random
+import re
+import threading
+import time
+
+#------------------------------------------------------------------------
+#
+# get_status_code()
+# is_size_error()
+# is_timeout_error()
+# is_transient_error()
+#
+# class retry_counters
+#     __init__()
+#     add()
+#     wait()
+#     get()
+#     reset()
+#
+# set_job_counters()
+# get_job_counters()
+#
+# class retry_policy
+#     __init__()
+#     get_delay()
+#     call()
+#     get_counters()
+#     reset_counters()
+#
+# http_get()
+#
+#------------------------------------------------------------------------
+def get_status_code( err ):
+
+    #------------------------------------------------------
+    # Find the HTTP status code of an exception, if any.
+    # requests puts it in err.response; pydap (webob)
+    # puts the status line in the message.
+    #------------------------------------------------------
+    response = getattr( err, 'response', None )
+    code = getattr( response, 'status_code', None )
+    if (code is None):
+        code = getattr( err, 'code', None )
+    if isinstance( code, int ):
+        return code
+    match = re.search( r'\b([1-5]\d\d) [A-Z][a-z]', str(err) )
+    if (match is not None):
+        return int( match.group(1) )
+    return None
+
+#   get_status_code()
+#------------------------------------------------------------------------
+def is_size_error( err ):
+
+    #-------------------------------------------------------
+    # Did the server reject a request because it asked for
+    # too much data?  That is status 413, or a message
+    # that says so.  Other server errors are not size
+    # errors, since a smaller request is no more likely to
+    # succeed.  Timeouts are checked separately (see
+    # is_timeout_error()), since they are also retried.
+    #-------------------------------------------------------
+    if (get_status_code( err ) == 413):
+        return True
+    msg = str(err).lower()
+    for phrase in ['too large', 'too big', 'response size', 'size limit',
+                   'maximum size', 'size exceeds']:
+        if (phrase in msg):
+            return True
+    return False
+
+#   is_size_error()
+#------------------------------------------------------------------------
+def is_timeout_error( err ):
+
+    #-------------------------------------------------------
+    # Did a request time out, on our side (a read or
+    # connect timeout) or on the server's (status 408 or
+    # 504)?  A large slab that times out again after its
+    # retries is more likely to succeed if it is smaller.
+    #-------------------------------------------------------
+    name = type(err).__name__
+    if (name in ['Timeout', 'ReadTimeout', 'ConnectTimeout',
+                 'timeout', 'TimeoutError']):
+        return True
+    if (get_status_code( err ) in [408, 504]):
+        return True
+    return ('timed out' in str(err).lower())
+
+#   is_timeout_error()
+#------------------------------------------------------------------------
+def is_transient_error( err ):
+
+    #---------------------------------------------------------
+    # Note: Errors that are worth trying again: dropped or
+    #       reset connections, timeouts, "too many requests"
+    #       and server errors (5xx), except when the server
+    #       says that the request is too large, which will
+    #       fail again (see fetch_slab_adaptive()).
+    #---------------------------------------------------------
+    if (is_size_error( err )):
+        return False
+    msg = str(err).lower()
+    name = type(err).__name__
+    transient_names = ['ConnectionError', 'ConnectionResetError',
+                       'ConnectionAbortedError', 'BrokenPipeError',
+                       'Timeout', 'ReadTimeout', 'ConnectTimeout',
+                       'timeout', 'TimeoutError', 'ChunkedEncodingError',
+                       'RemoteDisconnected', 'IncompleteRead',
+                       'ProtocolError']
+    if (name in transient_names):
+        return True
+    code = get_status_code( err )
+    if (code is not None):
+        return (code in [408, 429]) or ((code >= 500) and (code != 501))
+    return ('connection reset' in msg) or ('timed out' in msg)
+
+#   is_transient_error()
+#------------------------------------------------------------------------
+class retry_counters:
+    #--------------------------------------------------------------------
+    def __init__(self, cancel_event=None):
+
+        #-----------------------------------------------------------
+        # Note: Counts of calls, retries and failures, for one
+        #       policy or for one download job (see call()).
+        #       If cancel_event (a threading.Event) is given, a
+        #       call that is waiting to retry stops as soon as
+        #       it is set, e.g. when the job is cancelled.
+        #-----------------------------------------------------------
+        self.cancel_event = cancel_event
+        self.lock         = threading.Lock()
+        self.reset()
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def add(self, name, err=None):
+
+        with self.lock:
+            setattr( self, name, getattr( self, name ) + 1 )
+            if (err is not None):
+                self.last_error = repr( err )
+
+    #   add()
+    #--------------------------------------------------------------------
+    def wait(self, delay):
+
+        #------------------------------------------------
+        # Wait delay seconds before a retry.  Returns
+        # False if cancel_event was set while waiting.
+        #------------------------------------------------
+        if (self.cancel_event is None):
+            time.sleep( delay )
+            return True
+        return not( self.cancel_event.wait( delay ) )
+
+    #   wait()
+    #--------------------------------------------------------------------
+    def get(self):
+
+        with self.lock:
+            return {'n_calls':     self.n_calls,
+                    'n_retries':   self.n_retries,
+                    'n_recovered': self.n_recovered,
+                    'n_failures':  self.n_failures,
+                    'last_error':  self.last_error }
+
+    #   get()
+    #--------------------------------------------------------------------
+    def reset(self):
+
+        with self.lock:
+            self.n_calls     = 0
+            self.n_retries   = 0
+            self.n_recovered = 0
+            self.n_failures  = 0
+            self.last_error  = None
+
+    #   reset()
+#------------------------------------------------------------------------
+#  The counters of the download job that runs in each thread
+#------------------------------------------------------------------------
+job_counters = threading.local()
+
+#------------------------------------------------------------------------
+def set_job_counters( counters ):
+
+    #--------------------------------------------------------
+    # Note: Calls made in this thread without counters (see
+    #       retry_policy.call()), such as opening a dataset,
+    #       are counted in counters until this is called
+    #       again with None.  Returns the previous counters,
+    #       so they can be restored.
+    #--------------------------------------------------------
+    old_counters = get_job_counters()
+    job_counters.counters = counters
+    return old_counters
+
+#   set_job_counters()
+#------------------------------------------------------------------------
+def get_job_counters():
+
+    return getattr( job_counters, 'counters', None )
+
+#   get_job_counters()
+#------------------------------------------------------------------------
+class retry_policy:
+    #--------------------------------------------------------------------
+    def __init__(self, max_tries=5, base_delay=0.5, max_delay=30.0,
+                 deadline=300.0):
+
+        #-----------------------------------------------------------
+        # Note: A call is tried at most max_tries times.  Before
+        #       try k+1, it waits a random time between 0 and
+        #       min(max_delay, base_delay * 2**k) seconds ("full
+        #       jitter"), so that many clients don't retry at the
+        #       same time.  No retry starts after deadline seconds
+        #       from the first try.
+        #-----------------------------------------------------------
+        self.max_tries  = max_tries
+        self.base_delay = base_delay
+        self.max_delay  = max_delay
+        self.deadline   = deadline
+        self.counters   = retry_counters()
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def get_delay(self, n_tries):
+
+        cap = min( self.max_delay, self.base_delay * (2 ** (n_tries - 1)) )
+        return random.uniform( 0, cap )
+
+    #   get_delay()
+    #--------------------------------------------------------------------
+    def call(self, func, *args, idempotent=True, deadline=None,
+             counters=None, **kwargs):
+
+        #-----------------------------------------------------------
+        # Call func(*args, **kwargs), and retry it after a
+        # transient error.  Requests that are not idempotent
+        # (not safe to repeat) are only tried once.  deadline
+        # overrides self.deadline for this call.
+        #-----------------------------------------------------------
+        # The call is counted in the policy's counters, and in
+        # counters, a retry_counters for the download job that
+        # made it (or the job of this thread, if None; see
+        # set_job_counters()).  If the job is cancelled while
+        # the call waits to retry, the last error is raised.
+        #-----------------------------------------------------------
+        if (deadline is None):
+            deadline = self.deadline
+        if (counters is None):
+            counters = get_job_counters()
+        all_counters = [ self.counters ]
+        if (counters is not None):
+            all_counters.append( counters )
+        end_time = time.time() + deadline
+        n_tries  = 0
+        for c in all_counters:
+            c.add( 'n_calls' )
+        while (True):
+            n_tries += 1
+            try:
+                result = func( *args, **kwargs )
+            except Exception as err:
+                delay = self.get_delay( n_tries )
+                RETRY = idempotent and is_transient_error( err ) and \
+                        (n_tries < self.max_tries) and \
+                        ((time.time() + delay) < end_time)
+                if (RETRY):
+                    waiter = (counters if (counters is not None)
+                              else self.counters)
+                    RETRY = waiter.wait( delay )
+                if not(RETRY):
+                    for c in all_counters:
+                        c.add( 'n_failures', err )
+                    raise
+                for c in all_counters:
+                    c.add( 'n_retries' )
+                continue
+            if (n_tries > 1):
+                for c in all_counters:
+                    c.add( 'n_recovered' )
+            return result
+
+    #   call()
+    #--------------------------------------------------------------------
+    def get_counters(self):
+
+        return self.counters.get()
+
+    #   get_counters()
+    #--------------------------------------------------------------------
+    def reset_counters(self):
+
+        self.counters.reset()
+
+#   reset_counters()
+#------------------------------------------------------------------------
+#  The policy that is shared by all of the BALTO modules
+#------------------------------------------------------------------------
+default_policy = retry_policy()
+
+#------------------------------------------------------------------------
+def http_get( url, headers=None, timeout=60, policy=None ):
+
+    #-------------------------------------------------------
+    # GET with requests, with retries.  HTTP errors are
+    # raised inside the retried call, so 5xx is retried.
+    # A 304 (Not Modified) is returned, not raised.
+    #-------------------------------------------------------
+    import requests
+
+    if (policy is None):
+        policy = default_policy
+    def get():
+        r = requests.get( url, headers=headers, timeout=timeout )
+        r.raise_for_status()
+        return r
+    return policy.call( get )
+
+#   http_get()
+#------------------------------------------------------------------------
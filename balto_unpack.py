@@ -0,0 +1,348 @@
+"""
+This module has functions to unpack the data values of a variable
+downloaded with the BALTO GUI app, using its scale_factor, add_offset,
+missing_value, _FillValue and valid_range attributes (CF conventions).
+The unpacked values are written into a single output array of a
+chosen dtype (float32 by default), without float64 temporaries.
+Missing values can be restored, set to NaN or masked.  The
+packed_array class keeps the packed values, and unpacks only the
+parts that are indexed.
+It should be included in the same directory as "balto_gui.py".
+"""
+#------------------------------------------------------------------------
+#
+#  Copyright (C) 2022.  Scott D. Peckham
+#
+#------------------------------------------------------------------------
+
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+#------------------------------------------------------------------------
+#
+# get_att_values()
+# get_packing_info()
+# get_unpacked_dtype()
+# get_missing_mask()
+# unpack_array()
+#
+# class packed_array
+#     __init__()
+#     unpack()
+#     __array__()
+#     __array_ufunc__()
+#     __getitem__()
+#     __len__()
+#     __repr__()
+#     get_nbytes()
+#     reduce()
+#     min(), max(), sum(), mean()
+#     copy(), flatten(), astype()
+#
+#------------------------------------------------------------------------
+def get_att_values( atts, key ):
+
+    #------------------------------------------------------
+    # Attribute values from pydap may be scalars, lists
+    # or arrays.  Return them as a 1D array, or None.
+    #------------------------------------------------------
+    if (key not in atts):
+        return None
+    values = np.ravel( np.asarray( atts[ key ] ) )
+    if (values.size == 0) or (values.dtype.kind not in 'iufb'):
+        return None
+    return values
+
+#   get_att_values()
+#------------------------------------------------------------------------
+def get_packing_info( atts ):
+
+    #-----------------------------------------------------------
+    # Note: In CF, missing_value, _FillValue and valid_range
+    #       (or valid_min and valid_max) are in packed units,
+    #       so they are compared to the values before scaling.
+    #-----------------------------------------------------------
+    factor = get_att_values( atts, 'scale_factor' )
+    offset = get_att_values( atts, 'add_offset' )
+    missing = list()
+    for key in ['missing_value', '_FillValue']:
+        values = get_att_values( atts, key )
+        if (values is not None):
+            missing.extend( [v for v in values if (v not in missing)] )
+
+    valid_min = None
+    valid_max = None
+    valid_range = get_att_values( atts, 'valid_range' )
+    if (valid_range is not None) and (valid_range.size == 2):
+        (valid_min, valid_max) = valid_range
+    else:
+        values = get_att_values( atts, 'valid_min' )
+        if (values is not None):
+            valid_min = values[0]
+        values = get_att_values( atts, 'valid_max' )
+        if (values is not None):
+            valid_max = values[0]
+
+    info = {'scale_factor': (None if (factor is None) else factor[0]),
+            'add_offset':   (None if (offset is None) else offset[0]),
+            'missing':      missing,
+            'valid_min':    valid_min,
+            'valid_max':    valid_max }
+    return info
+
+#   get_packing_info()
+#------------------------------------------------------------------------
+def get_unpacked_dtype( packed_dtype, atts, dtype='float32',
+                        missing='restore' ):
+
+    #-----------------------------------------------------------
+    # Note: Values that are not packed keep their dtype
+    #       (in native byte order), unless they must hold
+    #       NaN.  Packed values are unpacked to dtype.
+    #-----------------------------------------------------------
+    packed_dtype = np.dtype( packed_dtype ).newbyteorder('=')
+    info = get_packing_info( atts )
+    PACKED = (info['scale_factor'] is not None) or \
+             (info['add_offset'] is not None)
+    if not(PACKED):
+        if (missing != 'nan') or (packed_dtype.kind == 'f'):
+            return packed_dtype
+    return np.dtype( dtype )
+
+#   get_unpacked_dtype()
+#------------------------------------------------------------------------
+def get_missing_mask( var, info ):
+
+    #-----------------------------------------------------
+    # Return a boolean array that is True where var is
+    # missing or out of the valid range, or None if no
+    # value is.  Only this one mask array is allocated.
+    # (For a 0-d var, the ufuncs return a scalar, which
+    # can't be used as out, so it is made an array.)
+    #-----------------------------------------------------
+    mask = None
+    tmp  = None
+    tests = [ (np.equal, value) for value in info['missing'] ]
+    if (info['valid_min'] is not None):
+        tests.append( (np.less, info['valid_min']) )
+    if (info['valid_max'] is not None):
+        tests.append( (np.greater, info['valid_max']) )
+    for (func, value) in tests:
+        if (mask is None):
+            mask = np.asarray( func( var, value ) )
+        else:
+            if (tmp is None):
+                tmp = np.empty( var.shape, dtype='bool' )
+            func( var, value, out=tmp )
+            np.logical_or( mask, tmp, out=mask )
+    if (mask is None) or not(mask.any()):
+        return None
+    return mask
+
+#   get_missing_mask()
+#------------------------------------------------------------------------
+def unpack_array( var, atts, dtype='float32', missing='restore',
+                  out=None ):
+
+    #-----------------------------------------------------------
+    # Note: Computes var * scale_factor + add_offset into one
+    #       output array of the given dtype, in place, so
+    #       that an int16 array unpacked to float32 needs
+    #       about 2x its size (plus a boolean mask if it has
+    #       missing values), instead of several float64
+    #       copies.  out can be given, e.g. a slice of an
+    #       np.memmap, to avoid even that allocation.
+    #
+    #       missing sets what happens to the values that
+    #       equal missing_value or _FillValue, or are out of
+    #       valid_range:
+    #          'restore' = keep the packed value, e.g. 32767
+    #          'nan'     = set to NaN (float dtypes only)
+    #          'mask'    = return an np.ma.MaskedArray, with
+    #                      the packed value under the mask
+    #-----------------------------------------------------------
+    if (missing not in ['restore', 'nan', 'mask']):
+        raise ValueError( 'missing must be restore, nan or mask.' )
+    var  = np.asarray( var )
+    info = get_packing_info( atts )
+    mask = get_missing_mask( var, info )
+    if (out is None):
+        out_dtype = get_unpacked_dtype( var.dtype, atts, dtype=dtype,
+                                        missing=missing )
+        if (mask is None) and (out_dtype == var.dtype) and \
+           (missing != 'mask') and \
+           (info['scale_factor'] is None) and (info['add_offset'] is None):
+            return var   # (nothing to do)
+        out = np.empty( var.shape, dtype=out_dtype )
+
+    #--------------------------------------------------
+    # The ufuncs compute in out.dtype, in small
+    # buffers, so no full-size temporary is created
+    #--------------------------------------------------
+    if (info['scale_factor'] is not None):
+        np.multiply( var, info['scale_factor'], out=out,
+                     dtype=out.dtype, casting='unsafe' )
+        if (info['add_offset'] is not None):
+            np.add( out, info['add_offset'], out=out,
+                    dtype=out.dtype, casting='unsafe' )
+    elif (info['add_offset'] is not None):
+        np.add( var, info['add_offset'], out=out,
+                dtype=out.dtype, casting='unsafe' )
+    else:
+        np.copyto( out, var, casting='unsafe' )
+
+    if (mask is not None):
+        if (missing == 'nan') and (out.dtype.kind in 'fc'):
+            out[ mask ] = np.nan
+        else:
+            out[ mask ] = var[ mask ]
+    if (missing == 'mask'):
+        return np.ma.MaskedArray( out, mask=(np.ma.nomask if (mask is None)
+                                             else mask), copy=False )
+    return out
+
+#   unpack_array()
+#------------------------------------------------------------------------
+class packed_array( NDArrayOperatorsMixin ):
+    #--------------------------------------------------------------------
+    def __init__(self, packed, atts, dtype='float32', missing='restore'):
+
+        #-----------------------------------------------------------
+        # Note: Keeps the packed values (e.g. int16), in native
+        #       byte order, with the attributes that are needed
+        #       to unpack them.  Indexing returns the unpacked
+        #       values of just that part, e.g. sst[0] is one
+        #       float32 grid.  It works with NumPy functions and
+        #       operators (e.g. np.mean(sst), sst == 32767),
+        #       which unpack the whole array as needed.
+        #-----------------------------------------------------------
+        packed = np.asarray( packed )
+        native = packed.dtype.newbyteorder('=')
+        self.packed  = packed.astype( native, copy=False )
+        self.atts    = dict( atts )
+        self.missing = missing
+        self.dtype   = get_unpacked_dtype( native, atts, dtype=dtype,
+                                           missing=missing )
+        self.shape   = self.packed.shape
+        self.ndim    = self.packed.ndim
+        self.size    = self.packed.size
+
+    #   __init__()
+    #--------------------------------------------------------------------
+    def unpack(self, key=Ellipsis):
+
+        return unpack_array( self.packed[ key ], self.atts,
+                             dtype=self.dtype, missing=self.missing )
+
+    #   unpack()
+    #--------------------------------------------------------------------
+    def __array__(self, dtype=None, copy=None):
+
+        var = np.asarray( self.unpack() )
+        if (dtype is not None):
+            var = var.astype( dtype, copy=False )
+        return var
+
+    #   __array__()
+    #--------------------------------------------------------------------
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+
+        #-------------------------------------------------------
+        # Unpack any packed_array inputs, and let NumPy do the
+        # rest.  The result is a regular array.
+        #-------------------------------------------------------
+        inputs = [ (x.unpack() if isinstance(x, packed_array) else x)
+                   for x in inputs ]
+        if ('out' in kwargs):
+            kwargs['out'] = tuple( (x.unpack() if isinstance(x, packed_array)
+                                    else x) for x in kwargs['out'] )
+        return getattr( ufunc, method )( *inputs, **kwargs )
+
+    #   __array_ufunc__()
+    #--------------------------------------------------------------------
+    def __getitem__(self, key):
+
+        var = self.unpack( key )
+        if (np.ndim( var ) == 0):
+            return var[()]
+        return var
+
+    #   __getitem__()
+    #--------------------------------------------------------------------
+    def __len__(self):
+
+        return len( self.packed )
+
+    #   __len__()
+    #--------------------------------------------------------------------
+    def __repr__(self):
+
+        return ('packed_array(shape=' + str(self.shape) +
+                ', packed=' + str(self.packed.dtype) +
+                ', dtype=' + str(self.dtype) + ')')
+
+    #   __repr__()
+    #--------------------------------------------------------------------
+    def get_nbytes(self):
+
+        #----------------------------------------------
+        # Bytes used now, and bytes if fully unpacked
+        #----------------------------------------------
+        return (self.packed.nbytes, self.size * self.dtype.itemsize)
+
+    #   get_nbytes()
+    #--------------------------------------------------------------------
+    def reduce(self, func, axis=None, dtype=None, out=None,
+               keepdims=False, n_steps=16):
+
+        #---------------------------------------------------------
+        # Note: With axis=None, the reduction is done over
+        #       blocks of n_steps along the first axis, so that
+        #       only one block is unpacked at a time.  NumPy
+        #       functions like np.min(var) call these methods,
+        #       with the keywords of the ndarray methods.
+        #---------------------------------------------------------
+        kwargs = dict()
+        if (dtype is not None):
+            kwargs['dtype'] = dtype
+        if (axis is not None) or (self.ndim == 0) or (out is not None) or \
+           (keepdims):
+            return func( self.unpack(), axis=axis, out=out,
+                         keepdims=keepdims, **kwargs )
+        values = [ func( self.unpack( slice(k, k + n_steps) ), **kwargs )
+                   for k in range(0, max(len(self), 1), n_steps) ]
+        return func( np.ma.stack( values ) if (self.missing == 'mask')
+                     else np.array( values ), **kwargs )
+
+    #   reduce()
+    #--------------------------------------------------------------------
+    def min(self, axis=None, out=None, keepdims=False):
+        return self.reduce( np.min, axis=axis, out=out, keepdims=keepdims )
+
+    def max(self, axis=None, out=None, keepdims=False):
+        return self.reduce( np.max, axis=axis, out=out, keepdims=keepdims )
+
+    def sum(self, axis=None, dtype=None, out=None, keepdims=False):
+        return self.reduce( np.sum, axis=axis, dtype=dtype, out=out,
+                            keepdims=keepdims )
+
+    def mean(self, axis=None, dtype=None, out=None, keepdims=False):
+        if (axis is None) and (dtype is None) and (out is None) and \
+           not(keepdims) and (self.missing != 'mask'):
+            return self.sum() / self.size
+        return np.mean( self.unpack(), axis=axis, dtype=dtype, out=out,
+                        keepdims=keepdims )
+
+    #   min(), max(), sum(), mean()
+    #--------------------------------------------------------------------
+    def copy(self):
+        return self.unpack()
+
+    def flatten(self):
+        return np.ravel( self.unpack() )
+
+    def astype(self, dtype):
+        return self.unpack().astype( dtype )
+
+    #   copy(), flatten(), astype()
+#------------------------------------------------------------------------
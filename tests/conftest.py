@@ -0,0 +1,8 @@
+#------------------------------------------------------------------------
+#  The BALTO modules are in the directory above this one.
+#------------------------------------------------------------------------
+import os
+import sys
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname(
+                        os.path.abspath( __file__ ) ) ) )
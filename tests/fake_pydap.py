@@ -0,0 +1,81 @@
+"""
+A fake pydap grid for the tests, so that the download engine can be
+tested without a server.  Indexing it records the request, and calls
+fail(index), which can raise an error like a server would.  A fake
+dataset holds a grid and its coordinate variables.
+"""
+import threading
+
+import numpy as np
+
+#------------------------------------------------------------------------
+class fake_response:
+    def __init__(self, data):
+        self.data = data
+
+#------------------------------------------------------------------------
+class fake_grid:
+    #--------------------------------------------------------------------
+    def __init__(self, var, maps, name='sst',
+                 dims=('time', 'lat', 'lon'), atts=None, fail=None):
+
+        self.var        = np.asarray( var )
+        self.maps       = [ np.asarray( m ) for m in maps ]
+        self.id         = name
+        self.shape      = self.var.shape
+        self.dtype      = self.var.dtype
+        self.dimensions = dims
+        self.attributes = (dict() if (atts is None) else atts)
+        self.fail       = fail
+        self.requests   = list()
+        self.lock       = threading.Lock()
+
+    #--------------------------------------------------------------------
+    def __getitem__(self, index):
+
+        with self.lock:
+            self.requests.append( index )
+        if (self.fail is not None):
+            self.fail( index )
+        data = [ self.var[ index ] ]
+        data += [ m[ s ] for (m, s) in zip( self.maps, index ) ]
+        return fake_response( data )
+
+#------------------------------------------------------------------------
+def make_grid( nt=24, nlat=10, nlon=20, fail=None ):
+
+    time = np.arange( nt, dtype='float64' )
+    lat  = np.linspace( -45.0, 45.0, nlat )
+    lon  = np.arange( nlon, dtype='float64' )
+    var  = np.arange( nt * nlat * nlon, dtype='int32' )
+    var  = var.reshape( nt, nlat, nlon )
+    return fake_grid( var, [time, lat, lon], fail=fail )
+
+#------------------------------------------------------------------------
+class fake_dataset:
+    #--------------------------------------------------------------------
+    def __init__(self, grid, atts=None):
+
+        #-------------------------------------------------
+        # Each map of the grid is also a variable with
+        # the name of its dimension, as in pydap
+        #-------------------------------------------------
+        self.vars = {grid.id: grid}
+        for (dim, m) in zip( grid.dimensions, grid.maps ):
+            self.vars[ dim ] = fake_grid( m, [m], name=dim, dims=(dim,),
+                                          atts={'units': dim + '_units'} )
+        self.attributes = {'NC_GLOBAL': {'title': 'fake'}}
+        if (atts is not None):
+            self.attributes['NC_GLOBAL'].update( atts )
+
+    #--------------------------------------------------------------------
+    def __getitem__(self, name):
+
+        return self.vars[ name ]
+
+    #--------------------------------------------------------------------
+    def keys(self):
+
+        return self.vars.keys()
+
+#------------------------------------------------------------------------
@@ -0,0 +1,192 @@
+"""
+Tests for balto_cache.py: the response cache, the metadata cache,
+slab journals and host profiles.  These don't use the network.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import balto_cache as bc
+import balto_retry as br
+
+URL = 'http://example.com/opendap/sst.mnmean.nc'
+
+#------------------------------------------------------------------------
+def get_slab( k=0 ):
+
+    var  = np.arange( 24, dtype='int16' ).reshape( 2, 3, 4 ) + k
+    maps = [ np.arange( 2.0 ), np.arange( 3.0 ), np.arange( 4.0 ) ]
+    return (var, maps)
+
+#------------------------------------------------------------------------
+def test_response_cache_round_trip( tmp_path ):
+
+    cache = bc.response_cache( cache_dir=str(tmp_path) )
+    index = (slice(0, 2, 1), slice(0, 3, 1), slice(0, 4, 1))
+    assert cache.get( URL, 'sst', index ) is None
+    (var, maps) = get_slab()
+    path = cache.put( URL, 'sst', index, var, maps )
+    assert os.path.exists( path )
+    (var2, maps2) = cache.get( URL, 'sst', index )
+    assert np.array_equal( var, var2 ) and (var2.dtype == var.dtype)
+    assert all( [np.array_equal( a, b ) for (a, b) in zip(maps, maps2)] )
+    assert cache.get( URL, 'sst2', index ) is None
+    info = cache.info()
+    assert (info['n_entries'] == 1) and (info['n_hits'] == 1)
+    assert (info['n_misses'] == 2)
+
+#------------------------------------------------------------------------
+def test_response_cache_validator( tmp_path ):
+
+    #---------------------------------------------------
+    # When the file changes on the server (a new ETag),
+    # the old entries are no longer used
+    #---------------------------------------------------
+    cache = bc.response_cache( cache_dir=str(tmp_path) )
+    index = (slice(0, 2, 1),)
+    cache.set_validator( URL, '"etag-1"' )
+    cache.put( URL, 'sst', index, *get_slab() )
+    assert cache.get( URL, 'sst', index ) is not None
+    cache.set_validator( URL, '"etag-2"' )
+    assert cache.get( URL, 'sst', index ) is None
+    cache.set_validator( URL, '"etag-1"' )
+    assert cache.get( URL, 'sst', index ) is not None
+
+#------------------------------------------------------------------------
+def test_response_cache_evict( tmp_path ):
+
+    cache = bc.response_cache( cache_dir=str(tmp_path) )
+    (var, maps) = get_slab()
+    path = cache.put( URL, 'sst', (slice(0, 1, 1),), var, maps )
+    entry_bytes = os.path.getsize( path )
+    cache.clear()
+
+    #---------------------------------------------------
+    # Room for 3 entries.  The directory is listed once
+    # for the running total, and again to evict.
+    #---------------------------------------------------
+    cache = bc.response_cache( cache_dir=str(tmp_path),
+                               max_bytes=(3 * entry_bytes) )
+    n_listed = [0]
+    get_entries = cache.get_entries
+    def count_entries():
+        n_listed[0] += 1
+        return get_entries()
+    cache.get_entries = count_entries
+    indices = [ (slice(k, k + 1, 1),) for k in range(5) ]
+    for k in range(3):
+        cache.put( URL, 'sst', indices[k], *get_slab( k ) )
+        os.utime( cache.get_path( cache.get_key( URL, 'sst', indices[k] ) ),
+                  (1000.0 + k, 1000.0 + k) )
+    assert (n_listed[0] == 1)
+    cache.get( URL, 'sst', indices[0] )   # (now the newest)
+    cache.put( URL, 'sst', indices[3], *get_slab( 3 ) )
+    assert (n_listed[0] == 2)
+    assert cache.get( URL, 'sst', indices[1] ) is None
+    for k in [0, 2, 3]:
+        assert cache.get( URL, 'sst', indices[k] ) is not None
+    assert (cache.get_total_bytes() == 3 * entry_bytes)
+    cache.get_entries = get_entries
+    assert (cache.info()['n_bytes'] == 3 * entry_bytes)
+
+#------------------------------------------------------------------------
+def test_journal_uses_cache_path( tmp_path ):
+
+    #--------------------------------------------------
+    # A slab that is in the response cache is only
+    # recorded by the journal, not saved again
+    #--------------------------------------------------
+    cache = bc.response_cache( cache_dir=str(tmp_path / 'cache') )
+    index = (slice(0, 2, 1), slice(0, 3, 1), slice(0, 4, 1))
+    journal = bc.slab_journal( URL, 'sst', [index],
+                               journal_dir=str(tmp_path / 'journal') )
+    (var, maps) = get_slab()
+    path = cache.put( URL, 'sst', index, var, maps )
+    journal.put( index, var, maps, path=path )
+    files = os.listdir( journal.dir )
+    assert (files == ['journal.json'])
+    assert np.array_equal( journal.get( index )[0], var )
+
+#------------------------------------------------------------------------
+class fake_response:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text        = text
+        self.headers     = (dict() if (headers is None) else headers)
+
+#------------------------------------------------------------------------
+def test_metadata_cache_revalidation( tmp_path, monkeypatch ):
+
+    requests = list()
+    def http_get( url, headers=None, timeout=60, policy=None ):
+        requests.append( (url, headers) )
+        if (headers) and (headers.get('If-None-Match') == '"v1"'):
+            return fake_response( 304 )
+        if url.endswith( '.dds' ):
+            return fake_response( 200, 'DDS', {'ETag': '"v1"'} )
+        return fake_response( 200, 'DAS' )
+    monkeypatch.setattr( br, 'http_get', http_get )
+
+    cache = bc.metadata_cache( cache_dir=str(tmp_path) )
+    entry = cache.fetch_entry( URL )
+    assert (entry['dds'] == 'DDS') and (entry['das'] == 'DAS')
+    assert (len( requests ) == 2)
+    cache.save_entry( entry )
+    assert (cache.get_validator( URL ) == '"v1"')
+    assert cache.get_validator( URL + '2' ) is None
+
+    entry['checked'] = 0.0
+    entry = cache.fetch_entry( URL, entry=entry )
+    assert (len( requests ) == 3)
+    assert (entry['dds'] == 'DDS') and (entry['checked'] > 0.0)
+
+#------------------------------------------------------------------------
+def test_metadata_cache_offline( tmp_path, monkeypatch ):
+
+    #--------------------------------------------------
+    # If the server can't be reached, a cached entry
+    # is used (with a warning), but a missing one is
+    # still an error
+    #--------------------------------------------------
+    def http_get( url, headers=None, timeout=60, policy=None ):
+        raise ConnectionError( 'offline' )
+    monkeypatch.setattr( br, 'http_get', http_get )
+
+    logs  = list()
+    cache = bc.metadata_cache( cache_dir=str(tmp_path),
+                               log=lambda msg, level: logs.append( level ) )
+    entry = {'url': URL, 'dds': 'DDS', 'das': 'DAS', 'etag': None,
+             'last_modified': 'Mon, 01 Jan 2001 00:00:00 GMT',
+             'checked': 0.0}
+    assert cache.fetch_entry( URL, entry=dict(entry) ) == entry
+    assert (logs == ['warning'])
+    with pytest.raises( ConnectionError ):
+        cache.fetch_entry( URL )
+
+#------------------------------------------------------------------------
+def test_host_profiles( tmp_path ):
+
+    profiles = bc.host_profiles( path=str(tmp_path / 'hosts.json'),
+                                 slab_bytes=8000000, n_workers=4 )
+    profiles.record_success( URL, 8000000, 1.0 )
+    assert profiles.get_slab_settings( URL ) == (12000000, 5)
+    profiles.record_success( URL, 8000000, 60.0 )
+    assert profiles.get_slab_settings( URL ) == (9000000, 4)
+
+    #-------------------------------------------------
+    # Size errors and timeouts shrink the slabs and
+    # remove a worker; other failures are counted
+    #-------------------------------------------------
+    profiles.record_failure( URL )
+    assert profiles.get_slab_settings( URL ) == (9000000, 4)
+    profiles.record_failure( URL, SIZE=True )
+    assert profiles.get_slab_settings( URL ) == (4500000, 3)
+    profiles.record_failure( URL, TIMEOUT=True )
+    assert profiles.get_slab_settings( URL ) == (2250000, 2)
+
+    profiles = bc.host_profiles( path=str(tmp_path / 'hosts.json') )
+    profile  = profiles.get( 'example.com' )
+    assert (profile['n_requests'] == 5) and (profile['n_failures'] == 3)
+
+#------------------------------------------------------------------------
@@ -0,0 +1,80 @@
+"""
+Tests for the chunk store in balto_io.py: writing, appending from
+several threads, and reading sub-windows back.
+"""
+import threading
+
+import numpy as np
+import pytest
+
+import balto_io as bio
+
+#------------------------------------------------------------------------
+def make_store( path, nlat=5, nlon=7, chunks=(3, 2, 4) ):
+
+    return bio.create_chunk_store( str(path), (0, nlat, nlon), 'float32',
+                                   chunks, dims=['time', 'lat', 'lon'],
+                                   attributes={'units': 'K'},
+                                   coords={'lat': np.arange(nlat),
+                                           'lon': np.arange(nlon)} )
+
+#------------------------------------------------------------------------
+def test_round_trip( tmp_path ):
+
+    data  = np.random.default_rng( 1 ).random( (10, 5, 7) )
+    data  = data.astype( 'float32' )
+    store = make_store( tmp_path )
+    store.append( data[0:4], times=np.arange(4) )
+    store.append( data[4:10], times=np.arange(4, 10) )
+
+    #----------------------------------------------
+    # Open it again from disk, and read windows,
+    # with strides and ints, like a numpy array
+    #----------------------------------------------
+    store = bio.chunk_store( str(tmp_path) )
+    assert (store.shape == (10, 5, 7))
+    assert (store.attributes == {'units': 'K'})
+    assert list( store.get_coords( 'time' ) ) == list( range(10) )
+    assert np.array_equal( store[:], data )
+    for key in [ (slice(2, 9, 3), slice(1, 4), slice(None, None, 2)),
+                 (5, slice(None), 6),
+                 (slice(None), -1) ]:
+        assert np.array_equal( store[ key ], data[ key ] )
+
+    store.write_region( (1, 1, 1), np.zeros( (2, 2, 2) ) )
+    data[1:3, 1:3, 1:3] = 0
+    assert np.array_equal( store[:], data )
+
+    with pytest.raises( ValueError ):
+        store.append( np.zeros( (2, 5, 6) ) )
+    with pytest.raises( IndexError ):
+        store[ 10 ]
+
+#------------------------------------------------------------------------
+def test_parallel_append( tmp_path ):
+
+    #------------------------------------------------
+    # Slabs of 2 time steps share chunks of 3 steps,
+    # so the partly written chunks must not lose
+    # each other's rows
+    #------------------------------------------------
+    store = make_store( tmp_path )
+    def append( k ):
+        slab = np.full( (2, 5, 7), k, dtype='float32' )
+        store.append( slab, times=[k, k] )
+    threads = [ threading.Thread( target=append, args=(k,) )
+                for k in range(12) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    store = bio.chunk_store( str(tmp_path) )
+    assert (store.shape == (24, 5, 7))
+    times = store.get_coords( 'time' )
+    values = store[:]
+    for t in range(24):
+        assert np.all( values[t] == times[t] )
+    assert sorted( times ) == sorted( list( range(12) ) * 2 )
+
+#------------------------------------------------------------------------
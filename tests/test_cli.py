@@ -0,0 +1,50 @@
+"""
+Tests for the command line, "python -m balto_gui", which must work
+without ipywidgets (e.g. on compute nodes).
+"""
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+#------------------------------------------------------------------------
+def run_cli( tmp_path, args ):
+
+    #-----------------------------------------------------
+    # Put modules that can't be imported first on the
+    # path, so the test is the same with or without the
+    # widget modules installed.
+    #-----------------------------------------------------
+    block_dir = tmp_path / 'blocked'
+    block_dir.mkdir()
+    for name in ['ipywidgets', 'IPython', 'traitlets', 'ipyleaflet']:
+        (block_dir / (name + '.py')).write_text(
+            'raise ImportError("No module named ' + name + '")\n' )
+    env = dict( os.environ )
+    env['PYTHONPATH'] = os.pathsep.join( [str(block_dir), REPO_DIR] )
+    return subprocess.run( [sys.executable, '-m', 'balto_gui'] + args,
+                           cwd=str(tmp_path), env=env,
+                           capture_output=True, text=True, timeout=60 )
+
+#------------------------------------------------------------------------
+def test_cli_help_without_widgets( tmp_path ):
+
+    result = run_cli( tmp_path, ['--help'] )
+    assert (result.returncode == 0), result.stderr
+    assert ('spec_files' in result.stdout)
+
+#------------------------------------------------------------------------
+def test_cli_bad_spec_without_widgets( tmp_path ):
+
+    spec_path = tmp_path / 'spec.json'
+    spec_path.write_text( json.dumps( {'url': 'http://example.com/a.nc',
+                                       'var_name': 'sst',
+                                       'start': '2000-01-01'} ) )
+    result = run_cli( tmp_path, [str(spec_path)] )
+    assert (result.returncode == 1)
+    assert ('both start and end' in (result.stdout + result.stderr))
+    assert ('ipywidgets' not in result.stderr)
+
+#------------------------------------------------------------------------
@@ -0,0 +1,109 @@
+"""
+Tests for the debounced data panel update in balto_gui.py: only the
+file that is still selected after data_panel_delay is opened, and a
+reset drops a pending open.  They need ipywidgets (for the import of
+balto_gui), but the panel's widgets are replaced by plain objects.
+"""
+import threading
+import time
+import types
+
+import pytest
+
+pytest.importorskip( 'ipywidgets' )
+pytest.importorskip( 'IPython' )
+import balto_gui as bg
+
+#------------------------------------------------------------------------
+def make_gui( delay=0.05 ):
+
+    #--------------------------------------------------
+    # A balto_gui with only what the data panel uses.
+    # Opening a file records its url.
+    #--------------------------------------------------
+    gui = bg.balto_gui.__new__( bg.balto_gui )
+    gui.data_panel_delay      = delay
+    gui.data_panel_timer      = None
+    gui.data_panel_pending    = None
+    gui.data_panel_shown      = None
+    gui.data_panel_generation = 0
+    gui.data_panel_lock       = threading.RLock()
+    for name in ['data_url_dir', 'data_filename', 'data_var_name',
+                 'data_var_long_name', 'data_var_units', 'data_var_shape',
+                 'data_var_dims', 'data_var_type', 'data_var_atts',
+                 'data_status']:
+        setattr( gui, name, types.SimpleNamespace( value='', options=[] ) )
+    gui.data_url_dir.value = 'http://a/'
+    gui.default_url_dir    = 'http://a/'
+    gui.opened = list()
+    gui.shown  = list()
+    def get_dataset( url ):
+        gui.opened.append( url )
+        return dict()
+    gui.get_dataset = get_dataset
+    gui.show_dataset_info = lambda: gui.shown.append( gui.opendap_file_url )
+    gui.clear_download_log = lambda: None
+    return gui
+
+#------------------------------------------------------------------------
+def select( gui, filename ):
+
+    gui.data_filename.value = filename
+    gui.schedule_data_panel_update()
+
+#------------------------------------------------------------------------
+def test_only_last_selection_is_opened():
+
+    gui = make_gui()
+    for filename in ['a.nc', 'b.nc', 'c.nc']:
+        select( gui, filename )
+    time.sleep( 0.3 )
+    assert (gui.opened == ['http://a/c.nc'])
+    assert (gui.shown  == ['http://a/c.nc'])
+    assert (gui.data_status.value == 'Ready.')
+
+    #---------------------------------------------
+    # Selecting the file that is shown does not
+    # open it again
+    #---------------------------------------------
+    select( gui, 'c.nc' )
+    time.sleep( 0.2 )
+    assert (gui.opened == ['http://a/c.nc'])
+
+#------------------------------------------------------------------------
+def test_reset_cancels_pending_open():
+
+    gui = make_gui()
+    select( gui, 'a.nc' )
+    gui.reset_data_panel()
+    time.sleep( 0.2 )
+    assert (gui.opened == []) and (gui.shown == [])
+    assert (gui.data_panel_pending is None)
+
+#------------------------------------------------------------------------
+def test_stale_open_is_dropped():
+
+    #-------------------------------------------------
+    # A file that is selected while another one is
+    # opening replaces it, and the first is not shown
+    #-------------------------------------------------
+    gui = make_gui( delay=0.01 )
+    opening = threading.Event()
+    release = threading.Event()
+    def get_dataset( url ):
+        gui.opened.append( url )
+        if (url.endswith( 'a.nc' )):
+            opening.set()
+            release.wait( 5 )
+        return dict()
+    gui.get_dataset = get_dataset
+    select( gui, 'a.nc' )
+    assert opening.wait( 5 )
+    select( gui, 'b.nc' )
+    time.sleep( 0.2 )
+    release.set()
+    time.sleep( 0.1 )
+    assert (gui.opened == ['http://a/a.nc', 'http://a/b.nc'])
+    assert (gui.shown  == ['http://a/b.nc'])
+
+#------------------------------------------------------------------------
@@ -0,0 +1,225 @@
+"""
+Tests for balto_download.py: the parallel slab engine, with a fake
+pydap grid (see fake_pydap.py) instead of a server, and resuming a
+download from a slab_journal.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import balto_cache as bc
+import balto_download as bd
+import balto_retry as br
+from fake_pydap import make_grid
+
+#------------------------------------------------------------------------
+def test_plan_slabs_with_stride():
+
+    grid  = make_grid( nt=24 )
+    index = (slice(1, 20, 3), slice(2, 8), slice(None))
+    (out_shape, slabs) = bd.plan_slabs( grid, index, slab_size=2 )
+    assert (out_shape == (7, 6, 20))
+    steps = list()
+    for (k1, k2, slab_index) in slabs:
+        slab_steps = list( range( *slab_index[0].indices( 24 ) ) )
+        assert (len( slab_steps ) == (k2 - k1) <= 2)
+        steps += slab_steps
+    assert steps == list( range(1, 20, 3) )
+
+#------------------------------------------------------------------------
+@pytest.mark.parametrize( 'n_workers', [1, 4] )
+def test_download_slabs( n_workers ):
+
+    grid  = make_grid( nt=24 )
+    index = (slice(1, 20, 2), slice(2, 8), slice(5, 15))
+    monitor = bd.download_monitor( 1 )
+    (var, maps) = bd.download_slabs( grid, index, slab_size=3,
+                                     n_workers=n_workers,
+                                     monitor=monitor )
+    assert np.array_equal( var, grid.var[ index ] )
+    assert np.array_equal( maps[0], grid.maps[0][ index[0] ] )
+    assert np.array_equal( maps[2], grid.maps[2][ index[2] ] )
+    assert (len( grid.requests ) == 4)
+    assert (monitor.n_bytes == var.nbytes)
+    assert (monitor.counters.get()['n_calls'] == 4)
+
+#------------------------------------------------------------------------
+def test_slab_error_stops_the_others():
+
+    #--------------------------------------------------
+    # The first slab fails, so with one worker, none
+    # of the others should be sent to the server
+    #--------------------------------------------------
+    def fail( index ):
+        if (index[0].start == 0):
+            raise RuntimeError( 'boom' )
+    grid = make_grid( nt=24, fail=fail )
+    monitor = bd.download_monitor( 1 )
+    index = (slice(None), slice(None), slice(None))
+    with pytest.raises( RuntimeError ):
+        bd.download_slabs( grid, index, slab_size=2, n_workers=1,
+                           monitor=monitor )
+    assert monitor.is_failed()
+    assert (len( grid.requests ) == 1)
+
+#------------------------------------------------------------------------
+def test_cancel():
+
+    grid = make_grid( nt=24 )
+    index = (slice(None), slice(None), slice(None))
+    monitor = bd.download_monitor( 1 )
+    monitor.cancel()
+    with pytest.raises( bd.download_cancelled ):
+        bd.download_slabs( grid, index, slab_size=2, monitor=monitor )
+    assert (len( grid.requests ) == 0)
+
+    #-----------------------------------------------
+    # Cancel from the progress callback, after the
+    # first slab arrives
+    #-----------------------------------------------
+    grid = make_grid( nt=24 )
+    monitor = bd.download_monitor( grid.var.nbytes,
+                                   callback=lambda m: m.cancel(),
+                                   min_interval=0.0 )
+    with pytest.raises( bd.download_cancelled ):
+        bd.download_slabs( grid, index, slab_size=2, n_workers=1,
+                           monitor=monitor )
+    assert (len( grid.requests ) == 1)
+
+#------------------------------------------------------------------------
+def test_monitor_status():
+
+    monitor = bd.download_monitor( 4000000 )
+    monitor.add( 1000000 )
+    assert (monitor.get_fraction() == 0.25)
+    assert monitor.get_status().startswith( '1.0 of 4.0 MB' )
+
+#------------------------------------------------------------------------
+def test_iter_slabs_in_order():
+
+    grid  = make_grid( nt=10 )
+    index = (slice(None), slice(0, 3), slice(0, 4))
+    slabs = list( bd.iter_slabs( grid, index, slab_size=3, n_workers=3 ) )
+    assert [len( s[0] ) for s in slabs] == [3, 3, 3, 1]
+    var = np.concatenate( [s[0] for s in slabs] )
+    assert np.array_equal( var, grid.var[ index ] )
+
+#------------------------------------------------------------------------
+def test_download_pieces_across_seam():
+
+    grid = make_grid( nt=6, nlon=20 )
+    indices = [ (slice(None), slice(None), slice(15, 20)),
+                (slice(None), slice(None), slice(0, 5)) ]
+    (var, maps) = bd.download_pieces( grid, indices, slab_size=2 )
+    expected = np.concatenate( [grid.var[ index ] for index in indices],
+                               axis=-1 )
+    assert np.array_equal( var, expected )
+    assert list( maps[2] ) == [15, 16, 17, 18, 19, 0, 1, 2, 3, 4]
+
+#------------------------------------------------------------------------
+def test_journal_resume( tmp_path ):
+
+    #--------------------------------------------------
+    # A download that stops part way is resumed with
+    # a new journal for the same request, and only
+    # the missing slabs are sent to the server
+    #--------------------------------------------------
+    def fail( index ):
+        if (index[0].start == 6):
+            raise RuntimeError( 'boom' )
+    index = (slice(None), slice(None), slice(None))
+    journal_dir = str(tmp_path)
+    grid    = make_grid( nt=24, fail=fail )
+    journal = bc.slab_journal( 'url', 'sst', [index], journal_dir )
+    with pytest.raises( RuntimeError ):
+        bd.download_slabs( grid, index, slab_size=2, n_workers=1,
+                           journal=journal )
+    assert (journal.get_n_done() == 3)
+
+    grid    = make_grid( nt=24 )
+    journal = bc.slab_journal( 'url', 'sst', [index], journal_dir )
+    assert (journal.get_n_done() == 3)
+    (var, maps) = bd.download_slabs( grid, index, slab_size=2,
+                                     n_workers=2, journal=journal )
+    assert np.array_equal( var, grid.var )
+    assert np.array_equal( maps[0], grid.maps[0] )
+    assert (len( grid.requests ) == 9)
+    assert all( [(r[0].start >= 6) for r in grid.requests] )
+    journal.finish()
+    assert not( os.path.exists( journal.dir ) )
+
+#------------------------------------------------------------------------
+def test_journal_keeps_slab_plan( tmp_path ):
+
+    #--------------------------------------------------
+    # The slab size and the split slabs of the first
+    # attempt are used again, even if target_bytes or
+    # the host profile has changed since
+    #--------------------------------------------------
+    grid    = make_grid( nt=24 )
+    indices = [ (slice(None), slice(None), slice(None)) ]
+    step_bytes = (10 * 20 * 4)
+    journal = bc.slab_journal( 'url', 'sst', indices, str(tmp_path) )
+    assert bd.get_plan_slab_size( grid, indices, 4 * step_bytes,
+                                  journal ) == 4
+    journal = bc.slab_journal( 'url', 'sst', indices, str(tmp_path) )
+    assert bd.get_plan_slab_size( grid, indices, 8 * step_bytes,
+                                  journal ) == 4
+
+    index = (slice(0, 4), slice(None), slice(None))
+    journal.add_split( index )
+    journal = bc.slab_journal( 'url', 'sst', indices, str(tmp_path) )
+    (var, maps) = bd.fetch_slab_adaptive( grid, index, journal=journal )
+    assert np.array_equal( var, grid.var[ index ] )
+    assert [r[0] for r in grid.requests] == [slice(0, 2, 1), slice(2, 4, 1)]
+
+#------------------------------------------------------------------------
+class server_error( Exception ):
+    def __init__(self, code):
+        Exception.__init__( self, '%d Server Error' % code )
+        self.code = code
+
+#------------------------------------------------------------------------
+@pytest.mark.parametrize( 'err', [server_error( 413 ),
+                                  TimeoutError( 'timed out' )] )
+def test_fetch_slab_adaptive( tmp_path, monkeypatch, err ):
+
+    #--------------------------------------------------
+    # Slabs of more than 2 time steps are too large
+    # or time out, so they are split, and the host
+    # profile shrinks
+    #--------------------------------------------------
+    def fail( index ):
+        if (len( range(*index[0].indices( 24 )) ) > 2):
+            raise err
+    monkeypatch.setattr( br, 'default_policy',
+                         br.retry_policy( max_tries=1 ) )
+    profiles = bc.host_profiles( path=str(tmp_path / 'hosts.json') )
+    grid  = make_grid( nt=24, fail=fail )
+    index = (slice(0, 8), slice(None), slice(None))
+    (var, maps) = bd.fetch_slab_adaptive( grid, index, url='http://a/b',
+                                          profiles=profiles )
+    assert np.array_equal( var, grid.var[ index ] )
+    assert np.array_equal( maps[0], grid.maps[0][ index[0] ] )
+    assert (len( grid.requests ) == 7)
+    assert (profiles.get( 'a' )['n_failures'] == 3)
+    assert (profiles.get_slab_settings( 'http://a/b' )[0] < 16000000)
+
+#------------------------------------------------------------------------
+def test_fetch_slab_adaptive_other_errors( tmp_path, monkeypatch ):
+
+    def fail( index ):
+        raise server_error( 500 )
+    monkeypatch.setattr( br, 'default_policy',
+                         br.retry_policy( max_tries=1 ) )
+    profiles = bc.host_profiles( path=str(tmp_path / 'hosts.json') )
+    grid  = make_grid( nt=24, fail=fail )
+    index = (slice(0, 8), slice(None), slice(None))
+    with pytest.raises( server_error ):
+        bd.fetch_slab_adaptive( grid, index, url='http://a/b',
+                                profiles=profiles )
+    assert (len( grid.requests ) == 1)
+    assert profiles.get_slab_settings( 'http://a/b' ) == (16000000, 4)
+
+#------------------------------------------------------------------------
@@ -0,0 +1,210 @@
+"""
+Tests for balto_engine.py: request specs, the time, lat and lon
+index ranges of a hyperslab, and matching coordinates to dimensions.
+These don't use the network.
+"""
+import datetime
+
+import numpy as np
+import pytest
+
+import balto_engine as be
+import balto_index as bi
+from fake_pydap import fake_dataset, fake_grid
+
+URL = 'http://example.com/opendap/sst.mnmean.nc'
+
+#------------------------------------------------------------------------
+def test_request_spec_defaults():
+
+    spec = be.get_request_spec( {'url': URL, 'var_name': 'sst',
+                                 'format': 'in memory', 'strides': 2} )
+    assert (spec['format'] == 'In memory')
+    assert (spec['strides'] == [2, 2, 2])
+    assert (spec['start'] is None) and (spec['end'] is None)
+
+#------------------------------------------------------------------------
+def test_request_spec_datetimes():
+
+    spec = be.get_request_spec( {'url': URL, 'var_name': 'sst',
+                                 'start': '2000-01-01T06:00:00Z',
+                                 'end': '2000-01-02T00:00:00+06:00'} )
+    assert spec['start'] == datetime.datetime( 2000, 1, 1, 6 )
+    assert spec['end'] == datetime.datetime( 2000, 1, 1, 18 )
+
+#------------------------------------------------------------------------
+def test_request_spec_var_names_and_urls():
+
+    spec = be.get_request_spec( {'url': URL, 'var_names': ['u', 'v']} )
+    assert (spec['var_name'] == 'u')
+    spec = be.get_request_spec( {'var_name': 'sst', 'urls': [URL, URL]} )
+    assert (spec['url'] == URL)
+
+#------------------------------------------------------------------------
+@pytest.mark.parametrize( 'spec', [
+    {'var_name': 'sst'},
+    {'url': URL},
+    {'url': URL, 'var_name': 'sst', 'color': 'red'},
+    {'url': URL, 'var_name': 'sst', 'bbox': [0, 0, 10]},
+    {'url': URL, 'var_name': 'sst', 'strides': [1, 0, 1]},
+    {'url': URL, 'var_name': 'sst', 'format': 'GRIB'},
+    {'url': URL, 'var_name': 'sst', 'start': '2000-01-01'},
+    {'url': URL, 'var_name': 'sst', 'start': '2001-01-01',
+     'end': '2000-01-01'},
+    {'url': URL, 'var_names': ['u'], 'urls': [URL]},
+    {'url': URL, 'var_names': 'u'},
+    {'urls': [URL], 'var_name': 'sst', 'start': '2000-01-01',
+     'end': '2000-02-01'},
+    {'url': URL, 'var_names': ['u', 'v'], 'format': 'Chunk store'} ] )
+def test_request_spec_errors( spec ):
+
+    with pytest.raises( ValueError ):
+        be.get_request_spec( spec )
+
+#------------------------------------------------------------------------
+def get_monthly_index():
+
+    values = np.arange( 0, 120 ) * 30.0
+    return bi.time_index( values, 'days since 2000-01-01 00:00:00' )
+
+#------------------------------------------------------------------------
+def test_time_index_range():
+
+    index = get_monthly_index()
+    start = datetime.datetime( 2000, 3, 1 )
+    end   = datetime.datetime( 2001, 2, 28 )
+    assert be.get_time_index_range( index, 120, start, end ) == (2, 15)
+    assert be.get_time_index_range( None, 120, start, end ) == (0, 120)
+
+    #------------------------------------------------
+    # A period shorter than the spacing gets the
+    # last time before it
+    #------------------------------------------------
+    start = datetime.datetime( 2000, 1, 10 )
+    end   = datetime.datetime( 2000, 1, 20 )
+    assert be.get_time_index_range( index, 120, start, end ) == (0, 1)
+
+#------------------------------------------------------------------------
+def test_time_index_range_errors():
+
+    index = get_monthly_index()
+    start = datetime.datetime( 2001, 1, 1 )
+    end   = datetime.datetime( 2000, 1, 1 )
+    with pytest.raises( ValueError ):
+        be.get_time_index_range( index, 120, start, end )
+    start = datetime.datetime( 2020, 1, 1 )
+    end   = datetime.datetime( 2021, 1, 1 )
+    with pytest.raises( ValueError ):
+        be.get_time_index_range( index, 120, start, end )
+
+#------------------------------------------------------------------------
+def test_lat_index_range_empty_box():
+
+    index = bi.coord_index( np.arange( -89.5, 90, 1.0 ) )
+    assert be.get_lat_index_range( index, 180, 5.1, 5.2 ) == (0, 180)
+
+#------------------------------------------------------------------------
+@pytest.mark.parametrize( 'lons', [ np.arange( 0.5, 360, 1.0 ),
+                                    np.arange( -179.5, 180, 1.0 ) ] )
+def test_lon_index_ranges_seam( lons ):
+
+    #-----------------------------------------------
+    # Each box gives the same 20 lons, for either
+    # convention of the grid, in order west to east
+    #-----------------------------------------------
+    index = bi.coord_index( lons )
+    for (minlon, maxlon) in [(-10, 10), (350, 10), (170, -170)]:
+        ranges = be.get_lon_index_ranges( index, lons.size, minlon, maxlon )
+        picked = np.concatenate( [lons[i1:i2] for (i1, i2) in ranges] )
+        assert (picked.size == 20)
+        assert np.all( np.diff( bi.unwrap_lons( picked ) ) == 1.0 )
+        assert ((picked[0] - (minlon + 0.5)) % 360 == 0)
+
+#------------------------------------------------------------------------
+@pytest.mark.parametrize( 'stride', [2, 3, 7] )
+def test_lon_slices_stride_across_seam( stride ):
+
+    lons = np.arange( 0.5, 360, 1.0 )
+    slices = be.get_lon_slices( [(350, 360), (0, 10)], stride )
+    picked = np.concatenate( [lons[s] for s in slices] )
+    assert np.all( np.diff( bi.unwrap_lons( picked ) ) == stride )
+    assert (picked[0] == 350.5)
+
+#------------------------------------------------------------------------
+def test_hyperslab_indices():
+
+    indices = be.get_hyperslab_indices( 3, (2, 14), (80, 100),
+                                        [(350, 360), (0, 10)], (1, 2, 1) )
+    assert indices == [ (slice(2, 14, None), slice(80, 100, 2),
+                         slice(350, 360, None)),
+                        (slice(2, 14, None), slice(80, 100, 2),
+                         slice(0, 10, None)) ]
+    indices = be.get_hyperslab_indices( 1, (2, 14), (None, None), None )
+    assert indices == [ (slice(2, 14, None),) ]
+
+#------------------------------------------------------------------------
+def test_aggregate_indices():
+
+    urls = [ ('file' + str(k) + '.nc') for k in range(7) ]
+    index = (slice(None, None, 3), slice(80, 100), slice(0, 10))
+    (new_urls, indices) = be.get_aggregate_indices( (1, 180, 360), urls,
+                                                    [index] )
+    assert new_urls == ['file0.nc', 'file3.nc', 'file6.nc']
+    assert indices == [ (slice(None),) + index[1:] ]
+    (new_urls, indices) = be.get_aggregate_indices( (24, 180, 360), urls,
+                                                    [index] )
+    assert (new_urls == urls) and (indices == [index])
+
+#------------------------------------------------------------------------
+def test_get_dim_kind():
+
+    assert be.get_dim_kind( 'latitude' ) == 'lat'
+    assert be.get_dim_kind( 'TIME' ) == 'time'
+    assert be.get_dim_kind( 'depth' ) is None
+    assert be.get_dim_kind( 'y', {'axis': 'Y'} ) == 'lat'
+    assert be.get_dim_kind( 'xc', {'standard_name': 'longitude'} ) == 'lon'
+    assert be.get_dim_kind( 't', {'units': 'days since 1800-1-1'} ) == 'time'
+    assert be.get_dim_kind( 'yc', {'units': 'degrees_north'} ) == 'lat'
+
+#------------------------------------------------------------------------
+def test_get_coords_from_maps():
+
+    #------------------------------------------------
+    # Coordinates go by dimension, not by position
+    #------------------------------------------------
+    (lat, lon, depth) = (np.arange(3), np.arange(4), np.arange(2))
+    assert be.get_coords_from_maps( [lat, lon],
+                                    ['lat', 'lon'] ) == (None, lat, lon)
+    (times, lats, lons) = be.get_coords_from_maps(
+                              [depth, lat, lon], ['level', 'y', 'x'],
+                              {'y': {'axis': 'Y'}, 'x': {'axis': 'X'}} )
+    assert (times is None) and (lats is lat) and (lons is lon)
+
+#------------------------------------------------------------------------
+@pytest.mark.parametrize( 'download_format', ['In memory', 'Chunk store'] )
+def test_download_2d_coords( tmp_path, download_format ):
+
+    #-------------------------------------------------
+    # A 2D (lat, lon) variable gets lats and lons,
+    # and no times
+    #-------------------------------------------------
+    lat  = np.linspace( -45.0, 45.0, 10 )
+    lon  = np.arange( 20, dtype='float64' )
+    var  = np.arange( 200, dtype='float32' ).reshape( 10, 20 )
+    grid = fake_grid( var, [lat, lon], name='topo', dims=('lat', 'lon') )
+    engine = be.download_engine( use_journal=False,
+                                 download_dir=str(tmp_path) )
+    index  = (slice(2, 8), slice(5, 15))
+    job = engine.make_job( 'topo', download_format, 'http://a/topo.nc',
+                           fake_dataset( grid ), [index] )
+    result = engine.run( job )
+    assert (result['times'] is None)
+    assert np.array_equal( result['lats'], lat[2:8] )
+    assert np.array_equal( result['lons'], lon[5:15] )
+    assert np.array_equal( result['var'][:], var[ index ] )
+    if (download_format == 'Chunk store'):
+        store = result['var']
+        assert np.array_equal( store.get_coords( 'lat' ), lat[2:8] )
+        assert np.array_equal( store.get_coords( 'lon' ), lon[5:15] )
+
+#------------------------------------------------------------------------
@@ -0,0 +1,50 @@
+"""
+Tests for the GeoTIFF export in balto_io.py.  Writing a file needs
+the rasterio package, and those tests are skipped without it.
+"""
+import numpy as np
+import pytest
+
+import balto_io as bio
+
+#------------------------------------------------------------------------
+def test_irregular_spacing( tmp_path ):
+
+    #-----------------------------------------------
+    # e.g. a Gaussian grid, which has no affine
+    # transform (checked before rasterio is used)
+    #-----------------------------------------------
+    path = str(tmp_path / 'grid.tif')
+    grid = np.zeros( (4, 5), dtype='float32' )
+    lons = np.arange( 5, dtype='float64' )
+    with pytest.raises( ValueError, match='regularly spaced lats' ):
+        bio.write_geotiff( path, grid, [0.0, 1.0, 3.0, 4.0], lons )
+    with pytest.raises( ValueError, match='regularly spaced lons' ):
+        bio.write_geotiff( path, grid, np.arange(4.0),
+                           [0.0, 1.0, 2.0, 3.0, 5.0] )
+    with pytest.raises( ValueError, match='match the grid' ):
+        bio.write_geotiff( path, grid, lons, np.arange(4.0) )
+
+#------------------------------------------------------------------------
+def test_write_geotiff( tmp_path ):
+
+    rasterio = pytest.importorskip( 'rasterio' )
+    path = str(tmp_path / 'grid.tif')
+    lats = np.arange( -89.5, 90.0, 1.0, dtype='float32' )
+    lons = np.arange( 0.5, 360.0, 1.0, dtype='float32' )
+    grid = np.arange( lats.size * lons.size, dtype='float32' )
+    grid = grid.reshape( lats.size, lons.size )
+    bio.write_geotiff( path, grid, lats, lons, nodata=-9999.0 )
+
+    #-------------------------------------------------
+    # Rows go from north to south, with overviews
+    #-------------------------------------------------
+    with rasterio.open( path ) as src:
+        assert (src.shape == grid.shape)
+        assert (src.crs.to_epsg() == 4326)
+        assert np.allclose( src.bounds, (0.0, -90.0, 360.0, 90.0) )
+        assert np.array_equal( src.read( 1 ), grid[::-1, :] )
+        assert (src.overviews( 1 ) == [2])
+        assert (src.nodata == -9999.0)
+
+#------------------------------------------------------------------------
@@ -0,0 +1,129 @@
+"""
+Tests for balto_index.py: coordinate index ranges, longitude boxes
+that cross the seam of the grid, and time indexes in CF calendars.
+"""
+import datetime
+
+import numpy as np
+
+import balto_index as bi
+
+#------------------------------------------------------------------------
+def test_coord_index_ascending_lats():
+
+    lats  = np.arange( -89.5, 90, 1.0 )
+    index = bi.coord_index( lats )
+    assert (index.kind == 'regular')
+    (i1, i2) = index.index_range( -10, 10 )
+    assert (i1, i2) == (80, 100)
+    assert np.all( (lats[i1:i2] >= -10) & (lats[i1:i2] <= 10) )
+
+#------------------------------------------------------------------------
+def test_coord_index_descending_lats():
+
+    lats  = np.arange( 89.5, -90, -1.0 )
+    index = bi.coord_index( lats )
+    assert (index.kind == 'regular') and not(index.ascending)
+    (i1, i2) = index.index_range( -10, 10 )
+    assert (i1, i2) == (80, 100)
+    assert (lats[i1], lats[i2 - 1]) == (9.5, -9.5)
+
+#------------------------------------------------------------------------
+def test_coord_index_irregular_descending_lats():
+
+    lats  = np.array( [80.0, 50.0, 10.0, 0.0, -10.0, -40.0] )
+    index = bi.coord_index( lats )
+    assert (index.kind == 'sorted')
+    assert index.index_range( -10, 10 ) == (2, 5)
+    assert index.index_range( 20, 30 ) == (2, 2)
+
+#------------------------------------------------------------------------
+def test_time_index_noleap():
+
+    #---------------------------------------------
+    # There is no Feb. 29 in the noleap calendar
+    #---------------------------------------------
+    values = np.arange( 0, 800, dtype='float64' )
+    index  = bi.time_index( values, 'days since 2000-01-01 00:00:00',
+                            calendar='noleap' )
+    start = datetime.datetime( 2001, 2, 28 )
+    end   = datetime.datetime( 2001, 3, 1 )
+    assert index.index_range( start, end ) == (423, 425)
+    assert index.encode( datetime.datetime( 2001, 1, 1 ) ) == 365.0
+    assert index.get_datetime( 424 ) == datetime.datetime( 2001, 3, 1 )
+
+#------------------------------------------------------------------------
+def test_time_index_360_day():
+
+    values = np.arange( 0, 720, dtype='float64' )
+    index  = bi.time_index( values, 'days since 2000-01-01',
+                            calendar='360_day' )
+    assert index.encode( datetime.datetime( 2000, 3, 1 ) ) == 60.0
+    assert index.encode( datetime.datetime( 2001, 1, 1 ) ) == 360.0
+    start = datetime.datetime( 2000, 12, 1 )
+    end   = datetime.datetime( 2000, 12, 30 )
+    assert index.index_range( start, end ) == (330, 360)
+
+#------------------------------------------------------------------------
+def test_time_index_utc_offset():
+
+    #-------------------------------------------------
+    # The origin is 19:00 UTC on Dec. 31, 1999, so
+    # 00:00 UTC on Jan. 1 is 5 hours after it.
+    #-------------------------------------------------
+    values = np.arange( 0, 48, dtype='float64' )
+    index  = bi.time_index( values,
+                            'hours since 2000-01-01 00:00:00+05:00' )
+    assert index.encode( datetime.datetime( 2000, 1, 1 ) ) == 5.0
+    index = bi.time_index( values, 'hours since 2000-01-01T00:00:00Z' )
+    assert index.encode( datetime.datetime( 2000, 1, 1 ) ) == 0.0
+
+#------------------------------------------------------------------------
+def test_parse_time_units():
+
+    (secs, origin, offset) = bi.parse_time_units(
+                                 'minutes since 1970-01-01 00:00:00 -0130' )
+    assert (secs, origin, offset) == (60.0, (1970, 1, 1, 0, 0, 0), -5400.0)
+    (secs, origin, offset) = bi.parse_time_units( 'days since 1800-1-1 UTC' )
+    assert (secs, origin, offset) == (86400.0, (1800, 1, 1, 0, 0, 0), 0.0)
+
+#------------------------------------------------------------------------
+def test_time_index_julian():
+
+    #-------------------------------------------------
+    # 1900 is a leap year in the Julian calendar, and
+    # Julian dates are 13 days behind Gregorian ones
+    #-------------------------------------------------
+    values = np.arange( 0, 400, dtype='float64' )
+    index  = bi.time_index( values, 'days since 1900-01-01',
+                            calendar='julian' )
+    assert index.encode( datetime.datetime( 1900, 3, 1 ) ) == 60.0
+    assert index.encode( datetime.datetime( 1901, 1, 1 ) ) == 366.0
+    assert bi.days_from_julian( 2000, 1, 1 ) == \
+           bi.days_from_civil( 2000, 1, 14 )
+    days = np.arange( -800000, 800000, 7 )
+    (y, m, d) = bi.julian_from_days( days )
+    assert np.all( bi.days_from_julian( y, m, d ) == days )
+    assert index.get_datetime( 59 ) == datetime.datetime( 1900, 2, 28 )
+
+#------------------------------------------------------------------------
+def test_lon_index_ranges_0_to_360():
+
+    index = bi.coord_index( np.arange( 0.5, 360, 1.0 ) )
+    assert bi.lon_index_ranges( index, 170, -170 ) == [(170, 190)]
+    assert bi.lon_index_ranges( index, -10, 10 ) == [(350, 360), (0, 10)]
+
+#------------------------------------------------------------------------
+def test_lon_index_ranges_minus_180_to_180():
+
+    index = bi.coord_index( np.arange( -179.5, 180, 1.0 ) )
+    assert bi.lon_index_ranges( index, -10, 10 ) == [(170, 190)]
+    assert bi.lon_index_ranges( index, 170, -170 ) == [(350, 360), (0, 10)]
+
+#------------------------------------------------------------------------
+def test_unwrap_lons():
+
+    lons = bi.unwrap_lons( [358.5, 359.5, 0.5, 1.5] )
+    assert list( lons ) == [358.5, 359.5, 360.5, 361.5]
+
+#------------------------------------------------------------------------
@@ -0,0 +1,31 @@
+"""
+Tests for balto_log.py: the log keeps only its last max_lines lines.
+"""
+import balto_log as bl
+
+#------------------------------------------------------------------------
+class text_widget:
+    value = ''
+
+#------------------------------------------------------------------------
+def test_log_sink_truncation():
+
+    widget = text_widget()
+    sink = bl.log_sink( widget=widget, max_lines=3, min_interval=0.0 )
+    sink.write( ['line 1', 'line 2'] )
+    sink.write( 'line 3' )
+    sink.write( ['line 4', 'line 5'], level='warning' )
+    sink.flush()
+    assert sink.get_text() == 'line 3\nWARNING: line 4\nWARNING: line 5\n'
+    assert widget.value.startswith( '(2 earlier lines not shown)\n' )
+    assert sink.get_text( level='warning' ).count( '\n' ) == 2
+
+#------------------------------------------------------------------------
+def test_log_sink_clear():
+
+    sink = bl.log_sink( max_lines=2, min_interval=0.0 )
+    sink.write( ['a', 'b', 'c'] )
+    sink.clear()
+    assert (sink.get_text( DROPPED=True ) == '')
+
+#------------------------------------------------------------------------
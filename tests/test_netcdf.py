@@ -0,0 +1,99 @@
+"""
+Tests for writing downloads to netCDF files (see balto_io.py and
+download_engine.download_to_netcdf()).  They need the netCDF4 package,
+and are skipped without it.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import balto_engine as be
+import balto_io as bio
+from fake_pydap import fake_dataset, make_grid
+
+netCDF4 = pytest.importorskip( 'netCDF4' )
+
+#------------------------------------------------------------------------
+def test_netcdf_writer( tmp_path ):
+
+    #-----------------------------------------------
+    # Values are written packed, with the packing
+    # attributes, so netCDF4 unpacks them on read
+    #-----------------------------------------------
+    path = str(tmp_path / 'sst.nc')
+    grid = make_grid( nt=6, nlat=4, nlon=5 )
+    var  = grid.var.astype( '>i2' )
+    atts = {'scale_factor': 0.5, 'add_offset': 10.0, '_FillValue': -1,
+            'DODS': {'strlen': 0}}
+    writer = bio.netcdf_writer( path, 'sst', ('time', 'lat', 'lon'),
+                                var.shape, var.dtype, atts=atts,
+                                coord_atts={'time': {'units': 'days'},
+                                            'lat': dict()},
+                                global_atts={'title': 'test'} )
+    maps = [grid.maps[0][0:4]] + grid.maps[1:]
+    writer.write_slab( 0, 4, var[0:4], maps )
+    writer.write_slab( 4, 6, var[4:6], [grid.maps[0][4:6]] )
+    writer.close()
+
+    nc_file = bio.open_netcdf( path )
+    try:
+        assert (nc_file.title == 'test')
+        sst = nc_file['sst']
+        assert (sst.dtype == np.dtype('int16'))
+        assert np.allclose( sst[:], (var * 0.5) + 10.0 )
+        assert 'DODS' not in sst.ncattrs()
+        assert np.array_equal( nc_file['time'][:], grid.maps[0] )
+        assert (nc_file['time'].units == 'days')
+        assert np.array_equal( nc_file['lat'][:], grid.maps[1] )
+        assert 'lon' not in nc_file.variables
+    finally:
+        nc_file.close()
+
+#------------------------------------------------------------------------
+def test_download_to_netcdf( tmp_path ):
+
+    #-------------------------------------------------
+    # The file is written as a ".part" file, which is
+    # renamed when it is complete
+    #-------------------------------------------------
+    engine  = be.download_engine( use_journal=False,
+                                  download_dir=str(tmp_path),
+                                  slab_target_bytes=500 )
+    grid    = make_grid( nt=12 )
+    dataset = fake_dataset( grid )
+    index   = (slice(2, 10), slice(None), slice(0, 5))
+    job = engine.make_job( 'sst', 'netCDF4', 'http://a/sst.mnmean.nc',
+                           dataset, [index] )
+    result = engine.run( job )
+    try:
+        assert (result['path'] == str(tmp_path / 'sst.mnmean_sst.nc'))
+        assert (os.listdir( str(tmp_path) ) == ['sst.mnmean_sst.nc'])
+        assert np.array_equal( result['var'][:], grid.var[ index ] )
+        assert np.array_equal( result['times'], grid.maps[0][2:10] )
+        assert (len( grid.requests ) > 1)
+    finally:
+        result['file'].close()
+
+#------------------------------------------------------------------------
+def test_download_to_netcdf_failure( tmp_path ):
+
+    #-------------------------------------------------
+    # When a slab fails, the part file is removed and
+    # nothing is left at the path
+    #-------------------------------------------------
+    def fail( index ):
+        if (index[0].start >= 6):
+            raise RuntimeError( 'boom' )
+    engine  = be.download_engine( use_journal=False,
+                                  download_dir=str(tmp_path),
+                                  slab_target_bytes=500, n_workers=1 )
+    grid    = make_grid( nt=12, fail=fail )
+    index   = (slice(None), slice(None), slice(None))
+    job = engine.make_job( 'sst', 'netCDF', 'http://a/sst.mnmean.nc',
+                           fake_dataset( grid ), [index] )
+    with pytest.raises( RuntimeError ):
+        engine.run( job )
+    assert (os.listdir( str(tmp_path) ) == [])
+
+#------------------------------------------------------------------------
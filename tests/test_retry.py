@@ -0,0 +1,165 @@
+"""
+Tests for balto_retry.py: which errors are retried, backoff, deadlines
+and counters.  A fake clock is used, so nothing really sleeps, except
+when a cancelled call is tested.
+"""
+import threading
+import time
+
+import pytest
+
+import balto_retry as br
+
+#------------------------------------------------------------------------
+class fake_clock:
+    def __init__(self):
+        self.now    = 1000.0
+        self.sleeps = list()
+    def time(self):
+        return self.now
+    def sleep(self, secs):
+        self.sleeps.append( secs )
+        self.now += secs
+
+#------------------------------------------------------------------------
+@pytest.fixture
+def clock( monkeypatch ):
+
+    #-------------------------------------------------
+    # Each delay is its cap, so the backoff can be
+    # checked without the jitter
+    #-------------------------------------------------
+    clock = fake_clock()
+    monkeypatch.setattr( br.time, 'time', clock.time )
+    monkeypatch.setattr( br.time, 'sleep', clock.sleep )
+    monkeypatch.setattr( br.random, 'uniform', lambda a, b: b )
+    return clock
+
+#------------------------------------------------------------------------
+def failing( n_fails, err ):
+
+    #------------------------------------------------
+    # A function that raises err n_fails times, then
+    # returns the number of calls
+    #------------------------------------------------
+    calls = list()
+    def func():
+        calls.append( 1 )
+        if (len( calls ) <= n_fails):
+            raise err
+        return len( calls )
+    return func
+
+#------------------------------------------------------------------------
+def test_error_kinds():
+
+    assert br.is_transient_error( ConnectionResetError() )
+    assert br.is_transient_error( RuntimeError( '503 Service Unavailable' ) )
+    assert not br.is_transient_error( RuntimeError( '404 Not Found' ) )
+    assert not br.is_transient_error( RuntimeError( '413 Too Large' ) )
+    assert br.is_size_error( RuntimeError( 'response size exceeds limit' ) )
+    assert br.is_timeout_error( TimeoutError() )
+    assert not br.is_timeout_error( RuntimeError( '500 Server Error' ) )
+
+#------------------------------------------------------------------------
+def test_backoff( clock ):
+
+    policy = br.retry_policy( max_tries=5, base_delay=0.5, max_delay=3.0 )
+    func = failing( 4, ConnectionResetError() )
+    assert policy.call( func ) == 5
+    assert clock.sleeps == [0.5, 1.0, 2.0, 3.0]
+    counters = policy.get_counters()
+    assert (counters['n_calls'] == 1) and (counters['n_retries'] == 4)
+    assert (counters['n_recovered'] == 1) and (counters['n_failures'] == 0)
+
+    func = failing( 5, ConnectionResetError() )
+    with pytest.raises( ConnectionResetError ):
+        policy.call( func )
+    assert (policy.get_counters()['n_failures'] == 1)
+
+#------------------------------------------------------------------------
+def test_deadline( clock ):
+
+    #------------------------------------------------
+    # No retry may start after the deadline, so the
+    # 4 second delay is not taken
+    #------------------------------------------------
+    policy = br.retry_policy( max_tries=10, base_delay=1.0,
+                              max_delay=30.0, deadline=5.0 )
+    func = failing( 10, ConnectionResetError() )
+    with pytest.raises( ConnectionResetError ):
+        policy.call( func )
+    assert clock.sleeps == [1.0, 2.0]
+    clock.sleeps = list()
+    with pytest.raises( ConnectionResetError ):
+        policy.call( failing( 10, ConnectionResetError() ), deadline=2.5 )
+    assert clock.sleeps == [1.0]
+
+#------------------------------------------------------------------------
+def test_no_retry( clock ):
+
+    #-----------------------------------------------
+    # Errors that are not transient, and requests
+    # that are not idempotent, are tried once
+    #-----------------------------------------------
+    policy = br.retry_policy()
+    with pytest.raises( RuntimeError ):
+        policy.call( failing( 1, RuntimeError( '404 Not Found' ) ) )
+    with pytest.raises( ConnectionResetError ):
+        policy.call( failing( 1, ConnectionResetError() ),
+                     idempotent=False )
+    assert (clock.sleeps == [])
+    counters = policy.get_counters()
+    assert (counters['n_failures'] == 2) and (counters['n_retries'] == 0)
+    assert 'ConnectionResetError' in counters['last_error']
+
+#------------------------------------------------------------------------
+def test_job_counters( clock ):
+
+    #------------------------------------------------
+    # Calls in a thread with job counters are counted
+    # for that job and for the policy, but not for
+    # the jobs of other threads
+    #------------------------------------------------
+    policy = br.retry_policy()
+    jobs = [br.retry_counters(), br.retry_counters()]
+    def run( counters, n_calls ):
+        old_counters = br.set_job_counters( counters )
+        try:
+            for k in range(n_calls):
+                policy.call( lambda: 1 )
+        finally:
+            br.set_job_counters( old_counters )
+    threads = [ threading.Thread( target=run, args=(jobs[0], 3) ),
+                threading.Thread( target=run, args=(jobs[1], 5) ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    policy.call( failing( 1, ConnectionResetError() ), counters=jobs[0] )
+    assert (jobs[0].get()['n_calls'] == 4)
+    assert (jobs[0].get()['n_retries'] == 1)
+    assert (jobs[1].get()['n_calls'] == 5)
+    assert (policy.get_counters()['n_calls'] == 9)
+    assert br.get_job_counters() is None
+
+#------------------------------------------------------------------------
+def test_cancel_while_waiting():
+
+    #------------------------------------------------
+    # A call that is waiting to retry stops as soon
+    # as its job is cancelled
+    #------------------------------------------------
+    event    = threading.Event()
+    counters = br.retry_counters( cancel_event=event )
+    policy   = br.retry_policy( base_delay=60.0, max_delay=60.0 )
+    timer    = threading.Timer( 0.1, event.set )
+    timer.start()
+    start_time = time.time()
+    with pytest.raises( ConnectionResetError ):
+        policy.call( failing( 10, ConnectionResetError() ),
+                     counters=counters )
+    assert (time.time() - start_time) < 30.0
+    assert (counters.get()['n_failures'] == 1)
+
+#------------------------------------------------------------------------
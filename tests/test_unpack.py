@@ -0,0 +1,76 @@
+"""
+Tests for balto_unpack.py: scale_factor and add_offset, and values
+that are missing (_FillValue) or out of valid_range.
+"""
+import numpy as np
+
+import balto_unpack as bu
+
+ATTS = {'scale_factor': 0.5, 'add_offset': 10.0, '_FillValue': -999,
+        'valid_range': [0, 1000]}
+
+#------------------------------------------------------------------------
+def test_unpack_restore():
+
+    var = np.array( [0, 4, -999, 5000], dtype='>i2' )
+    out = bu.unpack_array( var, ATTS )
+    assert (out.dtype == np.float32)
+    assert list( out ) == [10.0, 12.0, -999.0, 5000.0]
+
+#------------------------------------------------------------------------
+def test_unpack_nan():
+
+    var = np.array( [0, 4, -999, 5000], dtype='int16' )
+    out = bu.unpack_array( var, ATTS, missing='nan' )
+    assert list( out[:2] ) == [10.0, 12.0]
+    assert np.all( np.isnan( out[2:] ) )
+
+#------------------------------------------------------------------------
+def test_unpack_mask():
+
+    var = np.array( [0, 4, -999, 5000], dtype='int16' )
+    out = bu.unpack_array( var, ATTS, missing='mask' )
+    assert isinstance( out, np.ma.MaskedArray )
+    assert list( out.mask ) == [False, False, True, True]
+    assert (out.data[2] == -999.0)
+
+#------------------------------------------------------------------------
+def test_unpack_not_packed():
+
+    var = np.array( [1, 2, 3], dtype='int32' )
+    assert bu.unpack_array( var, {} ) is var
+    out = bu.unpack_array( var, {'_FillValue': 2}, missing='nan' )
+    assert (out.dtype == np.float32) and np.isnan( out[1] )
+
+#------------------------------------------------------------------------
+def test_packed_array():
+
+    var = np.array( [[0, 4], [-999, 8]], dtype='int16' )
+    packed = bu.packed_array( var, ATTS, missing='nan' )
+    assert (packed.shape == (2, 2))
+    assert list( packed[0] ) == [10.0, 12.0]
+    assert np.isnan( packed[1, 0] )
+    assert (float( np.nanmax( np.asarray( packed ) ) ) == 14.0)
+
+#------------------------------------------------------------------------
+def test_packed_array_reductions():
+
+    var = (np.arange( 40, dtype='int16' ) % 7).reshape( 20, 2 )
+    var[3, 1] = -999
+    atts = {'scale_factor': 0.5, '_FillValue': -999}
+    packed = bu.packed_array( var, atts, missing='mask' )
+    unpacked = bu.unpack_array( var, atts, missing='mask' )
+    assert np.isclose( np.min( packed ), unpacked.min() )
+    assert np.isclose( np.max( packed ), unpacked.max() )
+    assert np.isclose( np.mean( packed ), unpacked.mean() )
+    assert np.allclose( np.sum( packed, axis=0 ), unpacked.sum( axis=0 ) )
+
+    packed = bu.packed_array( var, atts, missing='restore' )
+    unpacked = bu.unpack_array( var, atts )
+    assert np.isclose( packed.reduce( np.sum, n_steps=3 ), unpacked.sum() )
+    assert np.isclose( np.mean( packed ), unpacked.mean() )
+    assert (np.max( packed, keepdims=True ).shape == (1, 1))
+    assert (np.sum( packed, dtype='float64' ).dtype == np.float64)
+    assert np.allclose( np.mean( packed, axis=1 ), unpacked.mean( axis=1 ) )
+
+#------------------------------------------------------------------------